@@ -0,0 +1,87 @@
+"""
+Audit volume of page reruns (src/database/access_log.py).
+
+Simulates --users staff members each rerunning a page --reruns times that shows
+--previews patients (the dashboard preview is 10; the staff dashboard lists
+every patient). "legacy" writes one audit entry per patient per rerun, as the
+pages did; "coalesced" records each rerun with one record_accesses call.
+Reports audit rows and bytes added and the logging time per rerun.
+
+    python benchmarks/access_log.py --users 5 --reruns 200 --previews 10
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("HOSPITAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="hms-access-"), "access.db"))
+
+from database.access_log import record_accesses, _connect  # noqa: E402
+from database.connection import get_db_connection, import_patients, log_action  # noqa: E402
+
+
+def _sizes():
+    conn = _connect()
+    logs = conn.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+    sessions = conn.execute("SELECT COUNT(*) FROM access_sessions").fetchone()[0]
+    size = conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+    conn.close()
+    return logs, sessions, size
+
+
+def legacy_rerun(user_id, pids):
+    for pid in pids:
+        log_action(user_id, "doctor", "view_patient_preview", f"pid={pid}", patient_id=pid)
+
+
+def coalesced_rerun(user_id, pids):
+    record_accesses(user_id, "doctor", "view_patient_preview", pids, details="pid={patient_id}")
+
+
+def run(name, rerun, users, reruns, pids):
+    logs, sessions, size = _sizes()
+    samples = []
+    for _ in range(reruns):
+        for user_id in range(1, users + 1):
+            started = time.perf_counter()
+            rerun(user_id, pids)
+            samples.append((time.perf_counter() - started) * 1000)
+    logs_after, sessions_after, size_after = _sizes()
+    return {
+        "audit_rows_added": logs_after - logs,
+        "session_rows_added": sessions_after - sessions,
+        "db_bytes_added": size_after - size,
+        "rerun_median_ms": round(statistics.median(samples), 2),
+        "rerun_p99_ms": round(sorted(samples)[int(0.99 * (len(samples) - 1))], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--reruns", type=int, default=200)
+    parser.add_argument("--previews", type=int, default=10, help="patients shown per rerun")
+    args = parser.parse_args()
+
+    import_patients([{"name": f"Patient {i}", "contact": f"0300-{i:07d}", "diagnosis": "seed"}
+                     for i in range(args.previews)])
+    conn = get_db_connection()
+    pids = [r[0] for r in conn.execute("SELECT patient_id FROM patients ORDER BY patient_id LIMIT ?", (args.previews,))]
+    conn.close()
+
+    print(json.dumps({
+        "users": args.users,
+        "reruns": args.reruns,
+        "patients_per_rerun": len(pids),
+        "legacy": run("legacy", legacy_rerun, args.users, args.reruns, pids),
+        "coalesced": run("coalesced", coalesced_rerun, args.users, args.reruns, pids),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Local load test for the JSON API (src/api/server.py).
+
+Starts the server in a subprocess against a throwaway database, then drives it
+with keep-alive asyncio clients and prints throughput and latency percentiles.
+
+    python benchmarks/api_load.py --clients 32 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Client:
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body=None, token=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(data)}\r\n"
+        if token:
+            head += f"Authorization: Bearer {token}\r\n"
+        self.writer.write(head.encode("latin-1") + b"\r\n" + data)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":", 1)[1])
+        payload = json.loads(await self.reader.readexactly(length)) if length else {}
+        return status, payload
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+
+async def _wait_ready(host, port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            client = Client(host, port)
+            await client.connect()
+            status, _ = await client.request("GET", "/health")
+            client.close()
+            if status == 200:
+                return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("API server did not start")
+
+
+# weighted request mix per role
+MIX = {
+    "admin": [("GET", "/patients?limit=50", None, 5), ("GET", "/audit?limit=50", None, 2),
+              ("GET", "/appointments?limit=50", None, 2), ("POST", "/patients", "patient", 1)],
+    "drbob": [("GET", "/patients?limit=50", None, 6), ("GET", "/appointments?limit=50", None, 3),
+              ("POST", "/appointments", "appointment", 1)],
+    "alice_recep": [("GET", "/patients?limit=50", None, 5), ("POST", "/patients", "patient", 3),
+                    ("POST", "/appointments", "appointment", 2)],
+}
+PASSWORDS = {"admin": "admin123", "drbob": "doc123", "alice_recep": "rec123"}
+
+
+def _body(kind, n):
+    if kind == "patient":
+        return {"name": f"Load Patient {n}", "contact": f"0300-{n:07d}", "diagnosis": "load test"}
+    if kind == "appointment":
+        return {"patient_id": 1, "date": "2030-01-01", "time": "09:00:00"}
+    return None
+
+
+async def _worker(host, port, username, token, stop_at, latencies, errors, counter):
+    client = Client(host, port)
+    await client.connect()
+    ops = MIX[username]
+    weights = [w for *_, w in ops]
+    try:
+        while time.monotonic() < stop_at:
+            method, path, kind, _ = random.choices(ops, weights)[0]
+            counter[0] += 1
+            started = time.perf_counter()
+            status, _ = await client.request(method, path, _body(kind, counter[0]), token)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status >= 400:
+                errors[status] = errors.get(status, 0) + 1
+    finally:
+        client.close()
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+async def run(args):
+    host, port = "127.0.0.1", args.port or _free_port()
+    db_dir = tempfile.mkdtemp(prefix="hms-load-")
+    env = dict(os.environ, HOSPITAL_DB_PATH=os.path.join(db_dir, "load.db"), PYTHONPATH=str(SRC_DIR))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "api.server", "--host", host, "--port", str(port), "--workers", str(args.workers)],
+        cwd=SRC_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        await _wait_ready(host, port)
+        tokens = {}
+        setup = Client(host, port)
+        await setup.connect()
+        for username, password in PASSWORDS.items():
+            status, payload = await setup.request("POST", "/auth/token", {"username": username, "password": password})
+            if status != 200:
+                raise RuntimeError(f"login failed for {username}: {payload}")
+            tokens[username] = payload["token"]
+        await setup.request("POST", "/patients", _body("patient", 0), tokens["alice_recep"])
+        setup.close()
+
+        latencies, errors, counter = [], {}, [0]
+        stop_at = time.monotonic() + args.duration
+        users = list(PASSWORDS)
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            _worker(host, port, users[i % len(users)], tokens[users[i % len(users)]], stop_at, latencies, errors, counter)
+            for i in range(args.clients)
+        ])
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    return {
+        "clients": args.clients,
+        "workers": args.workers,
+        "duration_s": round(elapsed, 2),
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0,
+        "latency_ms": {p: round(_percentile(latencies, p), 2) for p in (50, 90, 99)},
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
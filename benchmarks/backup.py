@@ -0,0 +1,142 @@
+"""
+Benchmark for online backups (src/database/backup.py).
+
+Seeds a throwaway database, starts a mixed read/write workload on worker threads,
+and takes snapshots with different step sizes while the workload runs. Reports
+backup throughput and the latency the workload sees during each backup compared
+with a baseline window without one.
+
+    python benchmarks/backup.py --patients 100000 --logs 200000 --threads 4
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("HOSPITAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="hms-backup-"), "bench.db"))
+
+from database.connection import DB_PATH, get_db_connection, get_patient, import_patients, log_action  # noqa: E402
+from database.backup import create_backup, verify_backup  # noqa: E402
+
+# (label, pages per step, pause between steps in seconds)
+CONFIGS = [
+    ("single_step", -1, 0.0),
+    ("256_pages", 256, 0.005),
+    ("64_pages", 64, 0.005),
+]
+
+
+def _percentiles(samples_ms):
+    if not samples_ms:
+        return {"ops": 0}
+    samples_ms = sorted(samples_ms)
+    pick = lambda p: samples_ms[min(len(samples_ms) - 1, int(p / 100 * len(samples_ms)))]
+    return {"ops": len(samples_ms), "p50_ms": round(pick(50), 3), "p99_ms": round(pick(99), 3),
+            "max_ms": round(samples_ms[-1], 3), "mean_ms": round(statistics.mean(samples_ms), 3)}
+
+
+def seed(n_patients, n_logs):
+    import_patients([
+        {"name": f"Patient Number {i}", "contact": f"0300-{i:07d}", "diagnosis": "Seasonal influenza, follow up in two weeks"}
+        for i in range(n_patients)
+    ])
+    conn = get_db_connection()
+    conn.executemany(
+        "INSERT INTO logs (user_id, role, action, timestamp, details) VALUES (?,?,?,?,?)",
+        [(1, "doctor", "view_patient", f"2024-01-01T00:00:{i % 60:02d}", f"viewed patient_id={i % max(n_patients, 1) + 1}")
+         for i in range(n_logs)]
+    )
+    conn.commit()
+    conn.close()
+
+
+class Workload:
+    """Threads alternating patient reads and audit writes; latencies go to the current phase."""
+
+    def __init__(self, threads, n_patients, write_ratio):
+        self.n_patients = n_patients
+        self.write_ratio = write_ratio
+        self.phase = None
+        self.samples = {}
+        self.errors = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, args=(i,), daemon=True) for i in range(threads)]
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join()
+
+    def _run(self, seed):
+        rng = random.Random(seed)
+        while not self._stop.is_set():
+            pid = rng.randint(1, self.n_patients)
+            t0 = time.perf_counter()
+            try:
+                if rng.random() < self.write_ratio:
+                    log_action(1, "doctor", "view_patient", f"viewed patient_id={pid}", patient_id=pid)
+                else:
+                    get_patient(pid, role="doctor")
+            except Exception:
+                self.errors += 1
+                continue
+            elapsed = (time.perf_counter() - t0) * 1000
+            phase = self.phase
+            if phase:
+                with self._lock:
+                    self.samples.setdefault(phase, []).append(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--logs", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    parser.add_argument("--baseline-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    seed(args.patients, args.logs)
+    db_bytes = Path(DB_PATH).stat().st_size
+    out_dir = Path(tempfile.mkdtemp(prefix="hms-snapshots-"))
+
+    workload = Workload(args.threads, args.patients, args.write_ratio)
+    workload.start()
+    workload.phase = "baseline"
+    time.sleep(args.baseline_seconds)
+
+    results = {"db_mb": round(db_bytes / 2 ** 20, 1), "threads": args.threads, "write_ratio": args.write_ratio}
+    for label, pages, pause in CONFIGS:
+        workload.phase = label
+        backup = create_backup(directory=out_dir / label, pages=pages, pause=pause)
+        workload.phase = None
+        results[label] = {
+            "copy_seconds": backup["copy_seconds"],
+            "total_seconds": backup["seconds"],
+            "copy_mb_per_s": round(backup["db_bytes"] / 2 ** 20 / max(backup["copy_seconds"], 1e-9), 1),
+            "compression_ratio": round(backup["db_bytes"] / max(backup["bytes"], 1), 2),
+            "verified": verify_backup(backup["path"])["ok"],
+        }
+    workload.stop()
+
+    results["workload_baseline"] = _percentiles(workload.samples.get("baseline", []))
+    for label, _, _ in CONFIGS:
+        results[label]["workload_during_backup"] = _percentiles(workload.samples.get(label, []))
+    results["workload_errors"] = workload.errors
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
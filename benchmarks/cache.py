@@ -0,0 +1,110 @@
+"""
+Cross-process consistency and hit rate of the query caches (src/database/cache.py).
+
+Starts --readers separate processes (spawned, like independent Streamlit
+workers) that loop over the doctor's patient list and the staff list, and one
+writer process that adds a patient every --write-interval seconds. After each
+commit the writer publishes the new patient id; a reader that starts a call
+after that must see the patient, otherwise the result counts as stale. Runs
+once with caching on and once with QUERY_CACHE_ENTRIES=0, and reports reads per
+second, latency, stale reads and per-helper hit rates.
+
+    python benchmarks/cache.py --patients 5000 --readers 3 --seconds 5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC = str(Path(__file__).resolve().parents[1] / "src")
+sys.path.insert(0, SRC)
+os.environ.setdefault("HOSPITAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="hms-cache-"), "cache.db"))
+
+
+def reader(committed, stop, results):
+    from database.cache import cache_stats
+    from database.connection import get_patients, get_staff
+    stale, samples = 0, []
+    while not stop.is_set():
+        newest = committed.value
+        started = time.perf_counter()
+        patients = get_patients(role="doctor")
+        get_staff()
+        samples.append((time.perf_counter() - started) * 1000)
+        if newest and (not patients or patients[0]["patient_id"] < newest):
+            stale += 1
+    stats = cache_stats()
+    results.put({"reads": len(samples), "stale": stale, "samples": samples,
+                 "get_patients": stats["database.connection.get_patients"],
+                 "get_staff": stats["database.connection.get_staff"]})
+
+
+def writer(committed, stop, interval, results):
+    from database.connection import add_patient
+    written = 0
+    while not stop.wait(interval):
+        committed.value = add_patient(f"Walk In {written}", f"0311-{written:07d}", "triage")
+        written += 1
+    results.put({"writes": written})
+
+
+def run(readers, seconds, interval, cache_entries):
+    os.environ["QUERY_CACHE_ENTRIES"] = str(cache_entries)  # read by the spawned children's Config
+    ctx = multiprocessing.get_context("spawn")
+    committed, stop, results = ctx.Value("q", 0), ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=reader, args=(committed, stop, results)) for _ in range(readers)]
+    procs.append(ctx.Process(target=writer, args=(committed, stop, interval, results)))
+    for p in procs:
+        p.start()
+    time.sleep(seconds)
+    stop.set()
+    out = [results.get(timeout=60) for _ in procs]
+    for p in procs:
+        p.join()
+    reads = [r for r in out if "reads" in r]
+    samples = [s for r in reads for s in r["samples"]]
+
+    def merged(name):
+        hits = sum(r[name]["hits"] for r in reads)
+        calls = hits + sum(r[name]["misses"] for r in reads)
+        return {"hit_rate": round(hits / calls, 3) if calls else None,
+                "invalidated": sum(r[name]["invalidated"] for r in reads)}
+
+    return {
+        "reads_per_s": round(len(samples) / seconds, 1),
+        "read_median_ms": round(statistics.median(samples), 3),
+        "read_p99_ms": round(sorted(samples)[int(0.99 * (len(samples) - 1))], 3),
+        "stale_reads": sum(r["stale"] for r in reads),
+        "writes": sum(r.get("writes", 0) for r in out),
+        "get_patients": merged("get_patients"),
+        "get_staff": merged("get_staff"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=5000)
+    parser.add_argument("--readers", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--write-interval", type=float, default=0.25)
+    args = parser.parse_args()
+
+    from database.connection import import_patients
+    import_patients([{"name": f"Patient {i}", "contact": f"0300-{i:07d}", "diagnosis": "seed"}
+                     for i in range(args.patients)])
+
+    print(json.dumps({
+        "patients": args.patients,
+        "readers": args.readers,
+        "cached": run(args.readers, args.seconds, args.write_interval, 16),
+        "uncached": run(args.readers, args.seconds, args.write_interval, 0),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark for chart rendering (src/components/rendering.py, used by components.charts).
+
+Renders an appointment-trend chart of --years of daily data the way the page
+did before (pyplot figure with every point, never closed) and the way it does
+now (LTTB-downsampled, pyplot-free figure, cached by data version), --reruns
+times each, as Streamlit reruns would. Reports render latency, cache-hit
+latency, memory growth and figures left open.
+
+    python benchmarks/charts.py --years 5 --reruns 30
+"""
+import argparse
+import datetime
+import gc
+import json
+import math
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import matplotlib  # noqa: E402
+matplotlib.use("Agg")
+from matplotlib import pyplot as plt  # noqa: E402
+
+from components.rendering import RenderCache, data_version, render_trend_png  # noqa: E402
+
+
+def daily_series(years, seed=3):
+    rng = random.Random(seed)
+    start = datetime.date.today() - datetime.timedelta(days=int(365.25 * years))
+    days = [start + datetime.timedelta(days=i) for i in range(int(365.25 * years))]
+    # weekly cycle, slow growth, noise and a few spikes the downsampling must keep
+    counts = [max(0, round(40 + i / 30 + 15 * math.sin(i * 2 * math.pi / 7) + rng.gauss(0, 6)
+                           + (80 if rng.random() < 0.004 else 0)))
+              for i in range(len(days))]
+    return {"date": [d.isoformat() for d in days], "appointments": counts}
+
+
+def render_legacy(data):
+    # what plot_appointment_trends did: every point with a marker, figure left open.
+    # Dates are parsed first; as strings, matplotlib would draw one category tick per day.
+    import io
+    fig, ax = plt.subplots()
+    ax.plot([datetime.date.fromisoformat(d) for d in data["date"]], data["appointments"], marker="o")
+    ax.set_title("Appointments Over Time")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Number of Appointments")
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")  # st.pyplot(fig) does the same
+    return buffer.getvalue()
+
+
+def render_current(data, cache, max_points):
+    key = ("appointment_trends", data_version(data), max_points)
+    return cache.get_or_render(key, lambda: render_trend_png(
+        data["date"], data["appointments"], "Appointments Over Time", "Date", "Number of Appointments", max_points))
+
+
+def measure(render, reruns, reset=None):
+    """Time `reruns` calls, then repeat them under tracemalloc for the memory they keep."""
+    samples = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        png = render()
+        samples.append((time.perf_counter() - started) * 1000)
+    if reset:
+        reset()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(reruns):
+        render()
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {
+        "first_ms": round(samples[0], 1),
+        "rerun_median_ms": round(statistics.median(samples[1:] or samples), 3),
+        "retained_kib": round(retained / 1024, 1),
+        "open_figures": len(plt.get_fignums()),
+        "png_bytes": len(png),
+    }
+
+
+def measure_once(render):
+    started = time.perf_counter()
+    render()
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=float, default=5)
+    parser.add_argument("--reruns", type=int, default=30)
+    parser.add_argument("--max-points", type=int, default=500)
+    args = parser.parse_args()
+
+    data = daily_series(args.years)
+    render_legacy(daily_series(0.1))  # warm up matplotlib (font cache, backend) outside the timings
+    plt.close("all")
+    legacy = measure(lambda: render_legacy(data), args.reruns)
+    plt.close("all")
+    cache = RenderCache()
+    current = measure(lambda: render_current(data, cache, args.max_points), args.reruns, reset=cache.clear)
+    uncached = statistics.median(
+        measure_once(lambda: render_current(data, RenderCache(), args.max_points)) for _ in range(5)
+    )
+    all_points = statistics.median(
+        measure_once(lambda: render_current(data, RenderCache(), len(data["date"]))) for _ in range(5)
+    )
+
+    # a data change (new day appended) misses the cache once, then hits again
+    data["date"].append((datetime.date.fromisoformat(data["date"][-1]) + datetime.timedelta(days=1)).isoformat())
+    data["appointments"].append(50)
+    changed_ms = measure_once(lambda: render_current(data, cache, args.max_points))
+
+    print(json.dumps({
+        "points": len(data["date"]) - 1,
+        "reruns": args.reruns,
+        "legacy": legacy,
+        "current": dict(current, max_points=args.max_points, uncached_render_ms=round(uncached, 1),
+                        uncached_render_all_points_ms=round(all_points, 1),
+                        render_after_data_change_ms=round(changed_ms, 1)),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
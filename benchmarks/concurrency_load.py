@@ -0,0 +1,271 @@
+"""
+Concurrency load test for the data layer (no HTTP, no Streamlit).
+
+Simulates N staff sessions against a throwaway database, spread over worker
+processes and threads the way several Streamlit workers would be. Each session
+has a role and calls the same helpers the pages do: add_patient, get_patients,
+log_action, anonymize_data and appointment inserts. Lock errors are retried with
+backoff, like a careful caller would; the report shows how often that happened.
+
+    python benchmarks/concurrency_load.py --users 24 --processes 3 --duration 10
+    python benchmarks/concurrency_load.py --journal-mode delete --busy-timeout 1   # pre-WAL behaviour
+
+Prints JSON: throughput, per-operation latency percentiles, lock timeouts,
+retries, operations that failed after all retries, and audit entries dropped
+by log_action.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("HOSPITAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="hms-concurrency-"), "load.db"))
+
+# (operation, weight) per role
+MIX = {
+    "admin": [("get_patients", 4), ("log_action", 3), ("anonymize_data", 2), ("add_patient", 1)],
+    "doctor": [("get_patients", 5), ("log_action", 4), ("anonymize_data", 1), ("book_appointment", 2)],
+    "receptionist": [("add_patient", 3), ("get_patients", 3), ("add_appointment", 3), ("log_action", 2)],
+}
+LOCK_MESSAGES = ("database is locked", "database is busy", "database table is locked")
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+    return {"count": len(samples), "p50_ms": round(pick(50), 3), "p90_ms": round(pick(90), 3),
+            "p99_ms": round(pick(99), 3), "max_ms": round(samples[-1], 3)}
+
+
+def _parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        role, _, weight = part.partition("=")
+        if role.strip() not in MIX:
+            raise argparse.ArgumentTypeError(f"unknown role '{role}'")
+        weights[role.strip()] = int(weight or 1)
+    return weights
+
+
+def _anonymize():
+    # anonymize_data lives in utils.gdpr, which needs streamlit for its error
+    # reporting; without it, call what it delegates to
+    try:
+        from utils.gdpr import anonymize_data
+        return anonymize_data, "utils.gdpr.anonymize_data"
+    except ImportError:
+        from database.connection import anonymize_patient, log_action
+
+        def anonymize_data(patient_id, user_id=None, role=None):
+            if not anonymize_patient(patient_id):
+                return False
+            log_action(user_id, role, "anonymize_patient", f"anonymized patient_id={patient_id}", patient_id=patient_id)
+            return True
+        return anonymize_data, "database.connection.anonymize_patient (streamlit not installed)"
+
+
+def seed(n_patients):
+    from database.connection import get_db_connection, import_patients
+    from utils.passwords import hash_password
+    import_patients([
+        {"name": f"Seed Patient {i}", "contact": f"0300-{i:07d}", "diagnosis": "seed"} for i in range(n_patients)
+    ])
+    conn = get_db_connection()
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (username, password_hash, role) VALUES (?,?,?)",
+        [(f"load_doc_{i}", hash_password("x"), "doctor") for i in range(8)]
+    )
+    conn.commit()
+    doctors = [r[0] for r in conn.execute("SELECT user_id FROM users WHERE role = 'doctor'")]
+    conn.close()
+    return doctors
+
+
+class Session:
+    def __init__(self, index, role, doctors, n_patients, stats, retries, think):
+        self.rng = random.Random(index)
+        self.role, self.user_id = role, index + 1
+        self.doctors, self.n_patients = doctors, n_patients
+        self.stats, self.max_retries, self.think = stats, retries, think
+        self.ops = MIX[role]
+        self.counter = 0
+
+    def _operation(self, name):
+        from database import connection, scheduling
+        rng, pid = self.rng, self.rng.randint(1, self.n_patients)
+        if name == "add_patient":
+            self.counter += 1
+            return lambda: connection.add_patient(f"Load {self.user_id}-{self.counter}", f"0311-{rng.randint(0, 9999999):07d}",
+                                                  "load test", self.user_id, self.role)
+        if name == "get_patients":
+            return lambda: connection.get_patients(role=self.role)
+        if name == "log_action":
+            return lambda: connection.log_action(self.user_id, self.role, "view_patient", f"viewed patient_id={pid}",
+                                                 patient_id=pid)
+        if name == "anonymize_data":
+            return lambda: self.stats["anonymize"](pid, self.user_id, self.role)
+        if name == "add_appointment":
+            day = (datetime.date(2031, 1, 1) + datetime.timedelta(days=rng.randrange(365))).isoformat()
+            return lambda: connection.add_appointment(f"Seed Patient {pid}", day, "10:00:00", "Scheduled",
+                                                      created_by=self.user_id, patient_id=pid)
+        if name == "book_appointment":
+            day = datetime.date(2031, 1, 6) + datetime.timedelta(weeks=rng.randrange(52), days=rng.randrange(5))
+            time_str = f"{rng.randrange(9, 17):02d}:{rng.choice((0, 15, 30, 45)):02d}:00"
+
+            def book():
+                try:
+                    return scheduling.book_appointment(pid, f"Seed Patient {pid}", rng.choice(self.doctors),
+                                                       day.isoformat(), time_str, created_by=self.user_id)
+                except scheduling.SchedulingConflict:
+                    self.stats["conflicts"] += 1
+            return book
+        raise ValueError(name)
+
+    def _error(self, e):
+        key = f"{type(e).__name__}: {e}"[:120]
+        self.stats["errors"][key] = self.stats["errors"].get(key, 0) + 1
+
+    def step(self):
+        name = self.rng.choices([n for n, _ in self.ops], [w for _, w in self.ops])[0]
+        call = self._operation(name)
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                call()
+                break
+            except sqlite3.OperationalError as e:
+                if not any(m in str(e) for m in LOCK_MESSAGES):
+                    self._error(e)
+                    break
+                self.stats["lock_timeouts"] += 1
+                if attempt >= self.max_retries:
+                    self.stats["failed"] += 1
+                    break
+                attempt += 1
+                self.stats["retries"] += 1
+                time.sleep(0.01 * 2 ** attempt * (0.5 + self.rng.random()))
+            except Exception as e:
+                self._error(e)
+                break
+        self.stats["latency"].setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        self.stats["ops"] += 1
+        if self.think:
+            time.sleep(self.rng.uniform(0, 2 * self.think))
+
+
+def run_process(sessions, doctors, n_patients, duration, retries, think):
+    """Run the given (index, role) sessions on threads of this process; returns raw stats."""
+    from database.connection import log_failure_count
+    anonymize, anonymize_via = _anonymize()
+    stats = {"ops": 0, "lock_timeouts": 0, "retries": 0, "failed": 0, "conflicts": 0, "errors": {},
+             "latency": {}, "anonymize": anonymize}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    log_failures_before = log_failure_count()
+
+    def user(index, role):
+        local = dict(stats, ops=0, lock_timeouts=0, retries=0, failed=0, conflicts=0, errors={}, latency={})
+        session = Session(index, role, doctors, n_patients, local, retries, think)
+        while time.monotonic() < stop_at:
+            session.step()
+        with lock:
+            for key in ("ops", "lock_timeouts", "retries", "failed", "conflicts"):
+                stats[key] += local[key]
+            for key, count in local["errors"].items():
+                stats["errors"][key] = stats["errors"].get(key, 0) + count
+            for key, samples in local["latency"].items():
+                stats["latency"].setdefault(key, []).extend(samples)
+
+    threads = [threading.Thread(target=user, args=s) for s in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats.pop("anonymize")
+    stats["log_failures"] = log_failure_count() - log_failures_before
+    stats["anonymize_via"] = anonymize_via
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=24)
+    parser.add_argument("--processes", type=int, default=3)
+    parser.add_argument("--mix", type=_parse_mix, default=_parse_mix("admin=1,doctor=3,receptionist=2"),
+                        help="role weights, e.g. admin=1,doctor=3,receptionist=2")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--patients", type=int, default=2000, help="patients seeded before the run")
+    parser.add_argument("--retries", type=int, default=3, help="retries after a lock error")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a session's operations")
+    parser.add_argument("--busy-timeout", type=float, default=None, help="seconds SQLite waits on a lock (HOSPITAL_DB_TIMEOUT)")
+    parser.add_argument("--journal-mode", default=None, help="override the journal mode after seeding, e.g. delete")
+    args = parser.parse_args()
+
+    if args.busy_timeout is not None:
+        os.environ["HOSPITAL_DB_TIMEOUT"] = str(args.busy_timeout)
+    from database.connection import get_db_connection
+    doctors = seed(args.patients)
+    conn = get_db_connection()
+    if args.journal_mode:
+        conn.execute(f"PRAGMA journal_mode={args.journal_mode}")
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    conn.close()
+
+    roles = [role for role, weight in args.mix.items() for _ in range(weight)]
+    sessions = [(i, roles[i % len(roles)]) for i in range(args.users)]
+    per_process = [sessions[p::args.processes] for p in range(args.processes)]
+
+    started = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(args.processes) as pool:
+        results = pool.starmap(run_process, [
+            (chunk, doctors, args.patients, args.duration, args.retries, args.think_ms / 1000)
+            for chunk in per_process if chunk
+        ])
+    elapsed = time.perf_counter() - started
+
+    latency, errors = {}, {}
+    for r in results:
+        for key, samples in r["latency"].items():
+            latency.setdefault(key, []).extend(samples)
+        for key, count in r["errors"].items():
+            errors[key] = errors.get(key, 0) + count
+    total = lambda key: sum(r[key] for r in results)
+    ops = total("ops")
+    report = {
+        "users": args.users,
+        "processes": args.processes,
+        "roles": {role: sum(1 for _, r in sessions if r == role) for role in MIX},
+        "journal_mode": journal_mode,
+        "busy_timeout_s": float(os.environ.get("HOSPITAL_DB_TIMEOUT", "5")),
+        "duration_s": round(elapsed, 2),
+        "operations": ops,
+        "throughput_ops_per_s": round(ops / args.duration, 1),
+        "latency": {"all": _percentiles([s for v in latency.values() for s in v]),
+                    **{k: _percentiles(v) for k, v in sorted(latency.items())}},
+        "lock_timeouts": total("lock_timeouts"),
+        "retries": total("retries"),
+        "retry_rate": round(total("retries") / ops, 4) if ops else 0,
+        "failed_after_retries": total("failed"),
+        "dropped_audit_entries": total("log_failures"),
+        "booking_conflicts": total("conflicts"),
+        "other_errors": errors,
+        "anonymize_via": results[0]["anonymize_via"] if results else None,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
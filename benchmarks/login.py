@@ -0,0 +1,136 @@
+"""
+Login throughput under contention (src/utils/passwords.py).
+
+Seeds --accounts users (a --legacy share of them with old unsalted SHA-256
+hashes), then runs --threads concurrent clients logging in through
+api.tokens.issue_token for --duration seconds, once per pool size in
+--workers. "inline" verifies on the calling thread with no pool, for
+comparison. Legacy hashes are upgraded during the first run.
+
+    python benchmarks/login.py --threads 16 --workers inline,1,2,4 --duration 5
+
+Prints JSON: logins per second and latency percentiles per configuration,
+plus how many legacy hashes were upgraded.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("HOSPITAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="hms-login-"), "login.db"))
+
+from api.tokens import issue_token  # noqa: E402
+from database.connection import get_db_connection  # noqa: E402
+from utils import passwords  # noqa: E402
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+    return {"count": len(samples), "p50_ms": round(pick(50), 1), "p90_ms": round(pick(90), 1),
+            "p99_ms": round(pick(99), 1), "max_ms": round(samples[-1], 1)}
+
+
+def seed(accounts, legacy_share):
+    conn = get_db_connection()
+    rows = []
+    for i in range(accounts):
+        password = f"pw-{i}"
+        legacy = i < accounts * legacy_share
+        stored = hashlib.sha256(password.encode("utf-8")).hexdigest() if legacy else passwords.hash_password(password)
+        rows.append((f"bench_user_{i}", stored, "doctor"))
+    conn.executemany("INSERT OR REPLACE INTO users (username, password_hash, role) VALUES (?,?,?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def _legacy_count():
+    conn = get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM users WHERE password_hash NOT LIKE 'scrypt$%'").fetchone()[0]
+    conn.close()
+    return count
+
+
+def run(threads, duration, accounts, failed_share):
+    latencies, failures = [], [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(index):
+        rng = random.Random(index)
+        local = []
+        while time.monotonic() < stop_at:
+            i = rng.randrange(accounts)
+            wrong = rng.random() < failed_share
+            started = time.perf_counter()
+            token = issue_token(f"bench_user_{i}", "wrong" if wrong else f"pw-{i}")
+            local.append((time.perf_counter() - started) * 1000)
+            if (token is None) != wrong:
+                with lock:
+                    failures[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return {"logins": len(latencies), "logins_per_s": round(len(latencies) / elapsed, 1),
+            "latency": _percentiles(latencies), "unexpected_results": failures[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=50)
+    parser.add_argument("--legacy", type=float, default=0.5, help="share of accounts seeded with legacy hashes")
+    parser.add_argument("--threads", type=int, default=16, help="concurrent login clients")
+    parser.add_argument("--workers", default="inline,1,2,4", help="pool sizes to compare; 'inline' = no pool")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--failed-share", type=float, default=0.1, help="share of attempts with a wrong password")
+    parser.add_argument("--n", type=int, default=None, help="scrypt cost (default: PASSWORD_SCRYPT_N)")
+    args = parser.parse_args()
+
+    if args.n:
+        passwords.Config.PASSWORD_SCRYPT_N = args.n
+    seed(args.accounts, args.legacy)
+    legacy_before = _legacy_count()
+
+    results = {}
+    original = passwords.check_user_password
+    for setting in [w.strip() for w in args.workers.split(",") if w.strip()]:
+        if setting == "inline":
+            def inline(user, password, timeout=None):
+                return bool(user) and passwords.verify_password(password, user["password_hash"])
+            passwords.check_user_password = inline
+            sys.modules["api.tokens"].check_user_password = inline
+        else:
+            passwords._reset_pool(int(setting))
+            sys.modules["api.tokens"].check_user_password = original
+        results[setting] = run(args.threads, args.duration, args.accounts, args.failed_share)
+    passwords.check_user_password = original
+    passwords._reset_pool()
+
+    print(json.dumps({
+        "scrypt": passwords.current_params(),
+        "cpus": os.cpu_count(),
+        "threads": args.threads,
+        "legacy_hashes_before": legacy_before,
+        "legacy_hashes_after": _legacy_count(),
+        "runs": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
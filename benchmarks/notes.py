@@ -0,0 +1,134 @@
+"""
+Benchmark for clinical notes in the blob store (src/database/notes.py, blobs.py).
+
+1. List views: --patients patients with a --note-kib note each, kept inline in
+   patients.diagnosis (site "wide") versus stored as notes with a short
+   diagnosis (site "main"); times the doctor's patient list (get_patients)
+   plus, for notes, the per-patient note counts the page shows.
+2. Storage: bytes written versus bytes stored, with --duplicates of the notes
+   being re-uploads of earlier ones (deduplicated) and gzip on text.
+3. Reads: peak Python memory streaming a --attachment-mib attachment with
+   iter_note() versus reading it whole.
+
+    python benchmarks/notes.py --patients 5000 --note-kib 8
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("HOSPITAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="hms-notes-"), "notes.db"))
+os.environ.setdefault("HOSPITAL_SHARDS", "wide=wide.db")
+
+from database import blobs, notes  # noqa: E402
+from database.connection import UnitOfWork, get_patients, import_patients  # noqa: E402
+from database.shards import use_site  # noqa: E402
+
+WORDS = ("patient", "reports", "mild", "severe", "pain", "since", "yesterday", "no", "fever", "history", "of",
+         "hypertension", "prescribed", "review", "in", "two", "weeks", "bloods", "normal", "follow-up")
+
+
+def note_text(rng, kib):
+    words, size = [], 0
+    while size < kib * 1024:
+        words.append(rng.choice(WORDS))
+        size += len(words[-1]) + 1
+    return " ".join(words)
+
+
+def seed(patients, kib, duplicates, seed_value=11):
+    rng = random.Random(seed_value)
+    texts = []
+    for i in range(patients):
+        reuse = texts and rng.random() < duplicates
+        texts.append(rng.choice(texts) if reuse else note_text(rng, kib))
+    records = [{"name": f"Patient {i}", "contact": f"0300-{i:07d}"} for i in range(patients)]
+    with use_site("wide"):
+        import_patients([dict(r, diagnosis=t) for r, t in zip(records, texts)])
+    import_patients([dict(r, diagnosis=t[:60]) for r, t in zip(records, texts)])
+    ids = sorted(p["patient_id"] for p in get_patients(columns=("patient_id",)))
+    written = 0
+    started = time.perf_counter()
+    with UnitOfWork() as uow:
+        for pid, text in zip(ids, texts):
+            notes.add_note(pid, text, "Progress note", uow=uow)
+            written += len(text.encode("utf-8"))
+    return ids, written, time.perf_counter() - started
+
+
+def median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(samples), 2)
+
+
+def stored():
+    conn = blobs._connect()
+    row = conn.execute("SELECT COUNT(*), SUM(stored_size) FROM blobs").fetchone()
+    conn.close()
+    return row[0], row[1]
+
+
+def peak_kib(func):
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=5000)
+    parser.add_argument("--note-kib", type=float, default=8)
+    parser.add_argument("--duplicates", type=float, default=0.2, help="share of notes that repeat an earlier one")
+    parser.add_argument("--attachment-mib", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    ids, written, store_s = seed(args.patients, args.note_kib, args.duplicates)
+
+    def wide_list():
+        with use_site("wide"):
+            get_patients(role="doctor")
+
+    def notes_list():
+        patients = get_patients(role="doctor")
+        notes.note_counts(p["patient_id"] for p in patients)
+
+    distinct, stored_bytes = stored()
+    attachment = os.urandom(args.attachment_mib * 1024 * 1024)
+    note_id = notes.add_attachment(ids[0], io.BytesIO(attachment), "scan.bin")
+    del attachment
+
+    def streamed():
+        for _ in notes.iter_note(note_id):
+            pass
+
+    def whole():
+        notes.open_note(note_id)[1].read()
+
+    print(json.dumps({
+        "patients": args.patients,
+        "note_kib": args.note_kib,
+        "list_view_ms": {"inline_diagnosis": median_ms(wide_list, args.repeat),
+                         "note_references": median_ms(notes_list, args.repeat)},
+        "storage": {"notes": len(ids), "distinct": distinct, "bytes_written": written,
+                    "bytes_stored": stored_bytes, "store_s": round(store_s, 2)},
+        "attachment_read_peak_kib": {"streamed": peak_kib(streamed), "whole": peak_kib(whole)},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
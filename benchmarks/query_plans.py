@@ -0,0 +1,133 @@
+"""
+Query-plan and latency check for the data layer (src/database/query_plans.py).
+
+Seeds a throwaway database with --rows patients, audit entries and
+appointments (plus duplicate flags), then:
+
+  * runs EXPLAIN QUERY PLAN for every registered statement and fails if one no
+    longer uses its expected index;
+  * times every statement that has a budget (median of --repeat runs) and fails
+    if it is over budget.
+
+    python benchmarks/query_plans.py                  # 100k rows
+    python benchmarks/query_plans.py --rows 20000 --repeat 5
+
+Prints JSON and exits with status 1 on any plan problem or budget breach, so it
+can gate a CI job or a pre-release check.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("HOSPITAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="hms-plans-"), "plans.db"))
+
+from database import dedup, query_plans  # noqa: E402
+from database.connection import get_db_connection, import_patients  # noqa: E402
+
+ACTIONS = ["view_patient", "add_patient", "anonymize_patient", "login", "export_data"]
+STATUSES = ["Scheduled", "Completed", "Cancelled", "No-show"]
+
+
+def seed(rows, seed_value=7):
+    rng = random.Random(seed_value)
+    start = datetime.datetime(2015, 1, 1)
+    stamp = lambda i: (start + datetime.timedelta(minutes=i * 50)).isoformat()
+    batch = 10000
+    for offset in range(0, rows, batch):
+        import_patients([
+            {"name": f"Patient {i}", "contact": f"0300-{rng.randrange(10 ** 7):07d}", "diagnosis": "seed",
+             "date_added": stamp(i)}
+            for i in range(offset, min(rows, offset + batch))
+        ])
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    first_patient = cur.execute("SELECT MIN(patient_id) FROM patients").fetchone()[0]
+    patient = lambda: first_patient + rng.randrange(rows)
+    cur.executemany(
+        "INSERT INTO logs (user_id, role, action, timestamp, details) VALUES (?,?,?,?,?)",
+        [(rng.randrange(1, 51), "doctor", rng.choice(ACTIONS), stamp(i), f"seed entry {i}") for i in range(rows)]
+    )
+    cur.execute("SELECT log_id FROM logs ORDER BY log_id")
+    cur.executemany("INSERT OR IGNORE INTO log_subjects (patient_id, log_id) VALUES (?,?)",
+                    [(patient(), r[0]) for r in cur.fetchall()[::2]])
+    day = datetime.date(2031, 1, 1)
+    cur.executemany(
+        "INSERT INTO appointments (patient_id, patient_name, provider_id, date, time, status, duration_minutes) "
+        "VALUES (?,?,?,?,?,?,30)",
+        [(patient(), "seed", rng.randrange(1, 26), (day + datetime.timedelta(days=rng.randrange(730))).isoformat(),
+          f"{rng.randrange(9, 17):02d}:{rng.choice((0, 15, 30, 45)):02d}:00", rng.choice(STATUSES))
+         for _ in range(rows)]
+    )
+    conn.commit()
+    conn.close()
+
+    conn = dedup._connect()
+    conn.executemany(
+        "INSERT OR IGNORE INTO duplicate_flags (patient_id, candidate_id, score, source, status, flagged_at) "
+        "VALUES (?,?,?,?,?,?)",
+        [(patient(), patient(), rng.random(), "seed", rng.choice(("open", "dismissed", "merged")), stamp(i))
+         for i in range(rows // 20)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def time_statement(conn, statement, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(statement.sql, statement.params).fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+        if conn.in_transaction:
+            conn.rollback()
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="patients, audit entries and appointments each")
+    parser.add_argument("--repeat", type=int, default=15, help="timed runs per statement (the median is compared)")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="multiply every budget, e.g. on slow CI hosts")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed(args.rows)
+    seed_s = time.perf_counter() - started
+
+    plans = query_plans.check_plans()
+    problems = [{"name": r["name"], "problem": r["problem"], "plan": r["plan"]} for r in plans if r["problem"]]
+
+    conn = get_db_connection()
+    timings, over_budget = {}, []
+    for statement in query_plans.statements():
+        if statement.budget_ms is None:
+            continue
+        median_ms = time_statement(conn, statement, args.repeat)
+        budget = statement.budget_ms * args.budget_scale
+        timings[statement.name] = {"median_ms": round(median_ms, 3), "budget_ms": budget}
+        if median_ms > budget:
+            over_budget.append(statement.name)
+    conn.close()
+
+    print(json.dumps({
+        "rows": args.rows,
+        "seed_s": round(seed_s, 2),
+        "statements": len(plans),
+        "plan_problems": problems,
+        "over_budget": over_budget,
+        "timings": timings,
+    }, indent=2))
+    sys.exit(1 if problems or over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
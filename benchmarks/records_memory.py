@@ -0,0 +1,63 @@
+"""
+Memory benchmark for patient result sets: dict-per-row (the old get_patients)
+versus slot-based PatientRecord, with and without role projection.
+
+    python benchmarks/records_memory.py --rows 100000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("HOSPITAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="hms-records-"), "bench.db"))
+
+from database.connection import get_db_connection, get_patients, import_patients  # noqa: E402
+
+
+def _measure(load):
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(result)
+    del result
+    return {"rows": count, "mb": round(current / (1024 * 1024), 2), "bytes_per_row": round(current / max(count, 1))}
+
+
+def _dict_rows():
+    conn = get_db_connection()
+    rows = [dict(r) for r in conn.execute("SELECT * FROM patients ORDER BY patient_id DESC").fetchall()]
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    import_patients([
+        {"name": f"Patient Number {i}", "contact": f"0300-{i:07d}", "diagnosis": "Seasonal influenza, follow up in two weeks"}
+        for i in range(args.rows)
+    ])
+
+    results = {
+        "dict_per_row_all_columns": _measure(_dict_rows),
+        "records_all_columns": _measure(get_patients),
+        "records_doctor": _measure(lambda: get_patients(role="doctor")),
+        "records_receptionist": _measure(lambda: get_patients(role="receptionist")),
+    }
+    base = results["dict_per_row_all_columns"]["mb"]
+    for name, r in results.items():
+        r["vs_dict"] = f"{r['mb'] / base:.0%}" if base else "n/a"
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark for the appointment availability engine (src/database/scheduling.py).
+
+Seeds a throwaway database with tens of thousands of appointments spread over
+many providers, then measures index build time, overlap checks, next-N free
+slot queries and full bookings (which include the SQLite write).
+
+    python benchmarks/scheduling.py --appointments 50000 --providers 25
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("HOSPITAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="hms-sched-"), "bench.db"))
+
+from database.connection import get_db_connection  # noqa: E402
+from utils.passwords import hash_password  # noqa: E402
+from database import scheduling  # noqa: E402
+
+
+def _percentiles(samples_ms):
+    samples_ms = sorted(samples_ms)
+    pick = lambda p: samples_ms[min(len(samples_ms) - 1, int(p / 100 * len(samples_ms)))]
+    return {"p50_ms": round(pick(50), 4), "p99_ms": round(pick(99), 4), "mean_ms": round(statistics.mean(samples_ms), 4)}
+
+
+def seed(n_appointments, n_providers, start_date):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT OR IGNORE INTO users (username, password_hash, role) VALUES (?,?,?)",
+        [(f"bench_doc_{i}", hash_password("x"), "doctor") for i in range(n_providers)]
+    )
+    provider_ids = [r[0] for r in cur.execute("SELECT user_id FROM users WHERE role = 'doctor'")]
+    rows, taken = [], set()
+    workdays = [start_date + datetime.timedelta(days=d) for d in range(400)
+                if (start_date + datetime.timedelta(days=d)).weekday() < 5]
+    rng = random.Random(7)
+    while len(rows) < n_appointments:
+        pid = rng.choice(provider_ids)
+        day = rng.choice(workdays).isoformat()
+        slot = rng.randrange(9 * 2, 17 * 2)  # 30-minute slots
+        if (pid, day, slot) in taken:
+            continue
+        taken.add((pid, day, slot))
+        rows.append((f"Bench Patient {len(rows)}", day, f"{slot // 2:02d}:{slot % 2 * 30:02d}:00", "Scheduled", pid, 30))
+    cur.executemany(
+        "INSERT INTO appointments (patient_name, date, time, status, provider_id, duration_minutes) VALUES (?,?,?,?,?,?)",
+        rows
+    )
+    conn.commit()
+    conn.close()
+    return provider_ids, workdays
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--appointments", type=int, default=50000)
+    parser.add_argument("--providers", type=int, default=25)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--bookings", type=int, default=200)
+    args = parser.parse_args()
+
+    start_date = datetime.date.today()
+    provider_ids, workdays = seed(args.appointments, args.providers, start_date)
+
+    started = time.perf_counter()
+    index = scheduling.get_availability_index(reload=True)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    rng = random.Random(11)
+    checks, searches = [], []
+    for _ in range(args.queries):
+        pid, day = rng.choice(provider_ids), rng.choice(workdays).isoformat()
+        start = rng.randrange(9 * 60, 17 * 60 - 30, 15)
+        t0 = time.perf_counter()
+        index.conflict(pid, day, start, 30)
+        checks.append((time.perf_counter() - t0) * 1000)
+
+        after = datetime.datetime.combine(rng.choice(workdays), datetime.time(rng.randrange(8, 17)))
+        t0 = time.perf_counter()
+        index.next_free_slots(10, duration=30, after=after)
+        searches.append((time.perf_counter() - t0) * 1000)
+
+    bookings, conflicts = [], 0
+    for i in range(args.bookings):
+        pid, day = rng.choice(provider_ids), rng.choice(workdays).isoformat()
+        time_str = f"{rng.randrange(9, 16):02d}:{rng.choice((0, 15, 30, 45)):02d}:00"
+        t0 = time.perf_counter()
+        try:
+            scheduling.book_appointment(None, f"Booked {i}", pid, day, time_str, duration_minutes=30)
+        except scheduling.SchedulingConflict:
+            conflicts += 1
+        bookings.append((time.perf_counter() - t0) * 1000)
+
+    print(json.dumps({
+        "appointments": args.appointments,
+        "providers": len(provider_ids),
+        "index_build_ms": round(build_ms, 1),
+        "overlap_check": _percentiles(checks),
+        "next_10_free_slots_all_providers": _percentiles(searches),
+        "book_appointment": dict(_percentiles(bookings), conflicts=conflicts, attempts=args.bookings),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
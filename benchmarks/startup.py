@@ -0,0 +1,110 @@
+"""
+Cold-start benchmark: import time and resident memory for each entry point.
+
+Every module is imported in a fresh interpreter so nothing is shared between
+measurements. The run fails (exit code 1) when an entry point exceeds its
+import-time or RSS budget, or when it eagerly imports one of the heavy
+dependencies that are supposed to load on first use.
+
+    python benchmarks/startup.py                # check against default budgets
+    python benchmarks/startup.py --repeat 5     # median of 5 cold starts
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+# module -> (max import ms, max RSS MB). Budgets include streamlit itself, which
+# every page needs; they are meant to catch a heavy dependency sneaking back in.
+ENTRY_POINTS = {
+    "main": (2500, 200),
+    "pages.dashboard": (2500, 200),
+    "pages.patients": (2500, 200),
+    "pages.appointments": (2500, 200),
+    "pages.staff": (2500, 200),
+    "api.server": (400, 60),
+    "utils.scheduler": (300, 50),
+}
+
+# must not be imported just by loading an entry point
+LAZY_MODULES = ("matplotlib", "pandas", "cryptography", "sqlalchemy", "pyarrow")
+
+PROBE = r"""
+import importlib, json, sys, time
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    import resource
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+name, lazy = sys.argv[1], sys.argv[2].split(",")
+before = rss_mb()
+started = time.perf_counter()
+importlib.import_module(name)
+elapsed = (time.perf_counter() - started) * 1000
+print(json.dumps({
+    "import_ms": elapsed,
+    "rss_mb": rss_mb(),
+    "rss_delta_mb": rss_mb() - before,
+    "eager_heavy_imports": [m for m in lazy if m in sys.modules],
+}))
+"""
+
+
+def measure(module: str, env: dict) -> dict:
+    proc = subprocess.run(
+        [sys.executable, "-c", PROBE, module, ",".join(LAZY_MODULES)],
+        cwd=SRC_DIR, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="*", help="entry points to measure")
+    args = parser.parse_args()
+
+    # keep the real database untouched while importing modules
+    env = dict(os.environ, PYTHONPATH=str(SRC_DIR),
+               HOSPITAL_DB_PATH=os.path.join(tempfile.mkdtemp(prefix="hms-startup-"), "startup.db"))
+    results, failures = {}, []
+    for module, (max_ms, max_mb) in ENTRY_POINTS.items():
+        if args.only and module not in args.only:
+            continue
+        runs = [measure(module, env) for _ in range(args.repeat)]
+        errors = [r["error"] for r in runs if "error" in r]
+        if errors:
+            results[module] = {"error": errors[0]}
+            failures.append(f"{module}: {errors[0]}")
+            continue
+        summary = {
+            "import_ms": round(statistics.median(r["import_ms"] for r in runs), 1),
+            "rss_mb": round(statistics.median(r["rss_mb"] for r in runs), 1),
+            "rss_delta_mb": round(statistics.median(r["rss_delta_mb"] for r in runs), 1),
+            "eager_heavy_imports": runs[0]["eager_heavy_imports"],
+            "budget": {"import_ms": max_ms, "rss_mb": max_mb},
+        }
+        results[module] = summary
+        if summary["import_ms"] > max_ms:
+            failures.append(f"{module}: import {summary['import_ms']}ms > {max_ms}ms")
+        if summary["rss_mb"] > max_mb:
+            failures.append(f"{module}: RSS {summary['rss_mb']}MB > {max_mb}MB")
+        if summary["eager_heavy_imports"]:
+            failures.append(f"{module}: eagerly imports {', '.join(summary['eager_heavy_imports'])}")
+
+    print(json.dumps({"results": results, "failures": failures}, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
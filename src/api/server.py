@@ -0,0 +1,432 @@
+"""
+Headless JSON HTTP API over the data layer for machine clients (lab systems, kiosks).
+
+Run from the src directory:
+    python -m api.server --host 127.0.0.1 --port 8600
+
+Blocking SQLite work runs on a bounded thread pool so the asyncio loop only
+parses requests and writes responses.
+
+Requests work on the caller's home site shard (database/shards.py); admins can
+address another site with an X-Hospital-Site header.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+from config import Config
+from database.connection import (
+    get_patients, get_patient, add_patient, anonymize_patient, anonymize_all_patients,
+    get_appointments, add_appointment, get_logs, log_action, UnitOfWork,
+)
+from database.access_log import get_access_sessions, log_accesses
+from database.changes import changes_since, DEFAULT_PAGE, MAX_PAGE
+from database.notes import add_note, list_notes, open_note, UnknownPatient
+from database.scheduling import book_appointment, find_free_slots, validate_slot, InvalidSlot, SchedulingConflict
+from database.records import Record
+from database.shards import PRIMARY_SITE, UnknownSite, use_site
+from utils.rbac import has_permission, project_patient
+from api.tokens import issue_token, verify_token
+
+MAX_BODY_BYTES = 1024 * 1024
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+           404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def _json_default(value):
+    return value.as_dict() if isinstance(value, Record) else str(value)
+
+
+class StreamBody:
+    """Response body copied from a file object in chunks (note content) instead of JSON."""
+
+    def __init__(self, fileobj, content_type: str, length: int):
+        self.fileobj = fileobj
+        self.content_type = content_type
+        self.length = length
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _request_site(user, headers: Dict) -> str:
+    home = user["site"] or PRIMARY_SITE
+    requested = headers.get("x-hospital-site", "").strip() or home
+    if requested != home and user["role"] != "admin":
+        raise ApiError(403, "only admins may address another site")
+    return requested
+
+def _in_site(site, func, *args):
+    # worker threads do not inherit context variables; pin the site per call
+    with use_site(site):
+        return func(*args)
+
+
+# Handlers run on the worker pool. Each receives the authenticated user (or None),
+# the path match groups, the parsed query string and the decoded JSON body.
+
+def _int_param(query: Dict, name: str, default: int, maximum: int) -> int:
+    try:
+        value = int(query.get(name, [default])[0])
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+    return max(0, min(value, maximum))
+
+def _require(body: Dict, *fields) -> None:
+    missing = [f for f in fields if not str(body.get(f) or "").strip()]
+    if missing:
+        raise ApiError(400, "missing fields: " + ", ".join(missing))
+
+def _require_text(body: Dict, *fields) -> None:
+    # JSON numbers, lists and objects pass _require but are not text
+    _require(body, *fields)
+    wrong = [f for f in fields if not isinstance(body[f], str)]
+    if wrong:
+        raise ApiError(400, "must be strings: " + ", ".join(wrong))
+
+def handle_token(user, params, query, body):
+    _require_text(body, "username", "password")
+    token = issue_token(body["username"], body["password"])
+    if not token:
+        raise ApiError(401, "invalid credentials")
+    log_action(token["user_id"], token["role"], "api_login", f"user {body['username']} issued API token")
+    return 200, token
+
+def handle_health(user, params, query, body):
+    return 200, {"status": "ok"}
+
+def handle_list_patients(user, params, query, body):
+    limit = _int_param(query, "limit", 100, 1000)
+    offset = _int_param(query, "offset", 0, 10 ** 9)
+    patients = get_patients(role=user["role"])[offset:offset + limit]
+    log_action(user["user_id"], user["role"], "api_list_patients", f"listed {len(patients)} patients offset={offset}")
+    return 200, {"patients": [project_patient(p, user["role"]) for p in patients]}
+
+def handle_get_patient(user, params, query, body):
+    pid = int(params[0])
+    patient = get_patient(pid, role=user["role"])
+    if not patient:
+        raise ApiError(404, "patient not found")
+    log_accesses(user["user_id"], user["role"], "api_view_patient", [pid], details="viewed patient_id={patient_id}")
+    return 200, project_patient(patient, user["role"])
+
+def handle_add_patient(user, params, query, body):
+    _require_text(body, "name", "contact", "diagnosis")
+    pid = add_patient(body["name"].strip(), body["contact"].strip(), body["diagnosis"].strip(),
+                      added_by_user_id=user["user_id"], role=user["role"])
+    return 201, {"patient_id": pid}
+
+def handle_anonymize_patient(user, params, query, body):
+    pid = int(params[0])
+    with UnitOfWork() as uow:
+        found = anonymize_patient(pid, uow)
+        if found:
+            uow.log(user["user_id"], user["role"], "anonymize_patient", f"anonymized patient_id={pid}", patient_id=pid)
+    if not found:
+        raise ApiError(404, "patient not found")
+    return 200, {"patient_id": pid, "anonymized": True}
+
+def handle_anonymize_all(user, params, query, body):
+    anonymize_all_patients(triggered_by_user_id=user["user_id"], role=user["role"])
+    return 200, {"anonymized": True}
+
+def handle_list_appointments(user, params, query, body):
+    limit = _int_param(query, "limit", 100, 1000)
+    raw = has_permission(user["role"], "view_raw_appointment_names")
+    rows = get_appointments()[:limit]
+    if not raw:
+        for r in rows:
+            r["patient_name"] = None
+    return 200, {"appointments": rows}
+
+def handle_add_appointment(user, params, query, body):
+    _require(body, "patient_id")
+    _require_text(body, "date", "time")
+    try:
+        pid = int(body["patient_id"])
+    except (TypeError, ValueError):
+        raise ApiError(400, "patient_id must be an integer")
+    try:
+        duration = int(body["duration_minutes"]) if body.get("duration_minutes") is not None else 30
+        provider_id = int(body["provider_id"]) if body.get("provider_id") is not None else None
+    except (TypeError, ValueError):
+        raise ApiError(400, "provider_id and duration_minutes must be integers")
+    status = body.get("status") or "Scheduled"
+    if not isinstance(status, str):
+        raise ApiError(400, "must be strings: status")
+    try:
+        # also for appointments without a provider, which are stored as given
+        validate_slot(body["date"], body["time"], duration)
+    except InvalidSlot as e:
+        raise ApiError(400, str(e))
+    patient = get_patient(pid)
+    if not patient:
+        raise ApiError(404, "patient not found")
+    try:
+        with UnitOfWork() as uow:
+            if provider_id is not None:
+                appointment_id = book_appointment(pid, patient["name"], provider_id, body["date"], body["time"],
+                                                  duration_minutes=duration, status=status,
+                                                  created_by=user["user_id"], uow=uow)
+            else:
+                appointment_id = add_appointment(patient["name"], body["date"], body["time"], status,
+                                                 created_by=user["user_id"], patient_id=pid,
+                                                 duration_minutes=duration, uow=uow)
+            uow.log(user["user_id"], user["role"], "create_appointment",
+                    f"appointment_id={appointment_id} patient_id={pid}", patient_id=pid)
+    except SchedulingConflict as e:
+        raise ApiError(409, str(e))
+    return 201, {"appointment_id": appointment_id}
+
+def handle_free_slots(user, params, query, body):
+    n = _int_param(query, "n", 5, 100)
+    duration = _int_param(query, "duration", 30, 480) or 30
+    providers = [int(p) for p in query.get("provider_id", []) if p.isdigit()] or None
+    return 200, {"slots": find_free_slots(n, duration, provider_ids=providers)}
+
+def handle_audit_logs(user, params, query, body):
+    limit = _int_param(query, "limit", 200, 1000)
+    return 200, {"logs": get_logs(limit)}
+
+def handle_list_notes(user, params, query, body):
+    pid = int(params[0])
+    notes = list_notes(pid, limit=_int_param(query, "limit", 100, 1000))
+    log_accesses(user["user_id"], user["role"], "api_list_notes", [pid], details="listed notes of patient_id={patient_id}")
+    return 200, {"notes": notes}
+
+def handle_add_note(user, params, query, body):
+    _require_text(body, "text")
+    if body.get("title") is not None and not isinstance(body["title"], str):
+        raise ApiError(400, "must be strings: title")
+    pid = int(params[0])
+    try:
+        note_id = add_note(pid, body["text"], body.get("title"), created_by=user["user_id"], role=user["role"])
+    except UnknownPatient:
+        raise ApiError(404, "patient not found")
+    return 201, {"note_id": note_id}
+
+def handle_note_content(user, params, query, body):
+    note, f = open_note(int(params[0]))
+    if note is None:
+        raise ApiError(404, "note not found")
+    log_accesses(user["user_id"], user["role"], "api_read_note", [note["patient_id"]],
+                 details=f"read note_id={note['note_id']} of patient_id={{patient_id}}")
+    return 200, StreamBody(f, note["content_type"], note["size"])
+
+def handle_access_sessions(user, params, query, body):
+    # coalesced patient accesses (database/access_log.py); since/until are ISO timestamps
+    filters = {name: _int_param(query, name, 0, 2 ** 63 - 1) for name in ("user_id", "patient_id") if name in query}
+    sessions = get_access_sessions(action=query.get("action", [None])[0], since=query.get("since", [None])[0],
+                                   until=query.get("until", [None])[0], limit=_int_param(query, "limit", 200, 1000),
+                                   **filters)
+    return 200, {"sessions": sessions}
+
+def handle_changes(user, params, query, body):
+    since = _int_param(query, "since", 0, 2 ** 63 - 1)
+    limit = _int_param(query, "limit", DEFAULT_PAGE, MAX_PAGE)
+    identifiers = query.get("identifiers", ["0"])[0] in ("1", "true")
+    try:
+        page = changes_since(since, limit, query.get("table") or None, include_identifiers=identifiers)
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    log_action(user["user_id"], user["role"], "api_read_changes",
+               f"read {len(page['changes'])} changes since token {since} identifiers={identifiers}")
+    return 200, page
+
+
+# (method, path regex, handler, permission). permission None = any authenticated user,
+# "public" = no token required.
+ROUTES = [
+    ("GET", r"/health", handle_health, "public"),
+    ("POST", r"/auth/token", handle_token, "public"),
+    ("GET", r"/patients", handle_list_patients, "view_patients"),
+    ("POST", r"/patients", handle_add_patient, "add_patient"),
+    ("POST", r"/patients/anonymize", handle_anonymize_all, "anonymize_all"),
+    ("GET", r"/patients/(\d+)", handle_get_patient, "view_patients"),
+    ("GET", r"/patients/(\d+)/notes", handle_list_notes, "view_notes"),
+    ("POST", r"/patients/(\d+)/notes", handle_add_note, "add_note"),
+    ("GET", r"/notes/(\d+)/content", handle_note_content, "view_notes"),
+    ("POST", r"/patients/(\d+)/anonymize", handle_anonymize_patient, "anonymize_patient"),
+    ("GET", r"/appointments", handle_list_appointments, "view_appointments"),
+    ("POST", r"/appointments", handle_add_appointment, "create_appointment"),
+    ("GET", r"/appointments/slots", handle_free_slots, "view_appointments"),
+    ("GET", r"/audit", handle_audit_logs, "view_audit_logs"),
+    ("GET", r"/audit/access", handle_access_sessions, "view_audit_logs"),
+    ("GET", r"/changes", handle_changes, "read_changes"),
+]
+_COMPILED = [(m, re.compile(p + r"/?"), h, perm) for m, p, h, perm in ROUTES]
+
+
+class ApiServer:
+    def __init__(self, host: str = None, port: int = None, workers: int = None):
+        self.host = host or Config.API_HOST
+        self.port = port if port is not None else Config.API_PORT
+        self.workers = workers or Config.API_WORKERS
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="api-db")
+        # cap queued work so a burst gets 503s instead of an unbounded backlog
+        self.slots = asyncio.Semaphore(self.workers * 8)
+        self.server = None
+
+    def _route(self, method: str, path: str):
+        allowed = False
+        for m, pattern, handler, perm in _COMPILED:
+            match = pattern.fullmatch(path)
+            if match:
+                if m == method:
+                    return handler, perm, match.groups()
+                allowed = True
+        raise ApiError(405 if allowed else 404, "method not allowed" if allowed else "not found")
+
+    async def _run(self, func, *args):
+        if self.slots.locked():
+            raise ApiError(503, "server busy")
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def dispatch(self, method: str, target: str, headers: Dict, body: bytes) -> Tuple[int, Dict]:
+        try:
+            url = urlsplit(target)
+            handler, perm, params = self._route(method, url.path)
+            query = parse_qs(url.query)
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                raise ApiError(400, "body must be JSON")
+            if not isinstance(payload, dict):
+                raise ApiError(400, "body must be a JSON object")
+
+            user = None
+            if perm != "public":
+                auth = headers.get("authorization", "")
+                if not auth.lower().startswith("bearer "):
+                    raise ApiError(401, "missing bearer token")
+                user = await self._run(verify_token, auth[7:].strip())
+                if not user:
+                    raise ApiError(401, "invalid or expired token")
+                if perm and not has_permission(user["role"], perm):
+                    raise ApiError(403, f"role '{user['role']}' may not {perm}")
+            site = _request_site(user, headers) if user else None
+            return await self._run(_in_site, site, handler, user, params, query, payload)
+        except ApiError as e:
+            return e.status, {"error": e.message}
+        except UnknownSite as e:
+            return 400, {"error": f"unknown site {e}"}
+        except Exception as e:
+            return 500, {"error": str(e) if Config.DEBUG else "internal error"}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._write(writer, 400, {"error": "bad request line"}, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    await self._write(writer, 400, {"error": "bad content-length"}, keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._write(writer, 413, {"error": "body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status, payload = await self.dispatch(method.upper(), target, headers, body)
+                await self._write(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _write(self, writer, status: int, payload, keep_alive: bool):
+        if isinstance(payload, StreamBody):
+            return await self._write_stream(writer, status, payload, keep_alive)
+        data = json.dumps(payload, default=_json_default).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    async def _write_stream(self, writer, status: int, body: StreamBody, keep_alive: bool):
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {body.content_type}\r\n"
+            f"Content-Length: {body.length}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1"))
+        loop = asyncio.get_running_loop()
+        try:
+            # reads (and decompression) run on the pool; one chunk in memory at a time
+            while True:
+                chunk = await loop.run_in_executor(self.executor, body.fileobj.read, 64 * 1024)
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            body.fileobj.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        return self.server
+
+    async def serve_forever(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.server:
+            self.server.close()
+        self.executor.shutdown(wait=False)
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Hospital management JSON API")
+    parser.add_argument("--host", default=Config.API_HOST)
+    parser.add_argument("--port", type=int, default=Config.API_PORT)
+    parser.add_argument("--workers", type=int, default=Config.API_WORKERS)
+    args = parser.parse_args(argv)
+    server = ApiServer(args.host, args.port, args.workers)
+    print(f"Serving API on http://{args.host}:{args.port} with {args.workers} DB workers")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
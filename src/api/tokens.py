@@ -0,0 +1,63 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Optional, Dict
+
+from config import Config
+from database.connection import get_db_connection
+from database.shards import PRIMARY_SITE
+from utils.passwords import check_user_password
+
+# Stateless bearer tokens: base64(payload).hmac-sha256(payload, SECRET_KEY).
+# The payload only carries the user id and expiry; role is always re-read from
+# the users table so a role change or deleted account takes effect immediately.
+
+def _sign(payload: bytes) -> str:
+    return hmac.new(Config.SECRET_KEY.encode("utf-8"), payload, hashlib.sha256).hexdigest()
+
+def _get_user(where: str, value) -> Optional[Dict]:
+    conn = get_db_connection(PRIMARY_SITE)
+    cur = conn.cursor()
+    cur.execute(f"SELECT user_id, username, password_hash, role, site FROM users WHERE {where} = ?", (value,))
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def issue_token(username: str, password: str) -> Optional[Dict]:
+    """
+    Check credentials against the users table and return a signed token.
+    Returns None when the username/password pair is invalid.
+    """
+    user = _get_user("username", username)
+    if not check_user_password(user, password):
+        return None
+    expires_at = int(time.time()) + Config.API_TOKEN_TTL
+    payload = json.dumps({"uid": user["user_id"], "exp": expires_at}, separators=(",", ":")).encode("utf-8")
+    token = base64.urlsafe_b64encode(payload).decode("ascii") + "." + _sign(payload)
+    return {"token": token, "expires_at": expires_at, "user_id": user["user_id"], "role": user["role"]}
+
+def verify_token(token: str) -> Optional[Dict]:
+    """
+    Validate signature and expiry, then load the user it belongs to.
+    Returns the user row (without password hash) or None.
+    """
+    try:
+        encoded, signature = token.split(".", 1)
+        payload = base64.urlsafe_b64decode(encoded.encode("ascii"))
+    except (ValueError, UnicodeEncodeError):
+        return None
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        claims = json.loads(payload)
+    except ValueError:
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    user = _get_user("user_id", claims.get("uid"))
+    if not user:
+        return None
+    user.pop("password_hash", None)
+    return user
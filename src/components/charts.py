@@ -1,8 +1,12 @@
-from matplotlib import pyplot as plt
-import pandas as pd
 import streamlit as st
 
+from components.rendering import DEFAULT_MAX_POINTS, chart_cache, data_version, lttb, render_trend_png
+
+# matplotlib and pandas are imported inside the chart functions: pages import this
+# module at startup, but most sessions never render a chart.
+
 def plot_patient_statistics(patient_data):
+    import pandas as pd
     df = pd.DataFrame(patient_data)
     if df.empty:
         st.info("No patient statistics available.")
@@ -12,17 +16,58 @@ def plot_patient_statistics(patient_data):
     st.bar_chart(df, x="category", y="count")
     
 
-def plot_appointment_trends(appointment_data):
-    df = pd.DataFrame(appointment_data)
+# Charts below are cached by data version (components/rendering.py): pass `version`
+# (e.g. a rollup high-water mark) to skip hashing the data on every rerun.
+
+def _render_appointment_trends(appointment_data, max_points):
+    import pandas as pd
+    df = pd.DataFrame(appointment_data).sort_values("date")
+    return render_trend_png(df["date"].tolist(), df["appointments"].tolist(), "Appointments Over Time",
+                            "Date", "Number of Appointments", max_points)
+
+def plot_appointment_trends(appointment_data, version=None, max_points: int = DEFAULT_MAX_POINTS):
     st.subheader("Appointment Trends")
-    fig, ax = plt.subplots()
-    ax.plot(df['date'], df['appointments'], marker='o')
-    ax.set_title('Appointments Over Time')
-    ax.set_xlabel('Date')
-    ax.set_ylabel('Number of Appointments')
-    st.pyplot(fig)
-
-def plot_staff_performance(staff_data):
+    key = ("appointment_trends", version or data_version(appointment_data), max_points)
+    st.image(chart_cache.get_or_render(key, lambda: _render_appointment_trends(appointment_data, max_points)))
+
+def _staff_performance_frame(staff_data, max_points):
+    import pandas as pd
     df = pd.DataFrame(staff_data)
+    keep = lttb(range(len(df)), df["performance"].fillna(0).tolist(), max_points)
+    return df.iloc[keep] if len(keep) < len(df) else df
+
+def plot_staff_performance(staff_data, version=None, max_points: int = DEFAULT_MAX_POINTS):
     st.subheader("Staff Performance")
-    st.line_chart(df['performance'], x=df['staff_member'])
\ No newline at end of file
+    key = ("staff_performance", version or data_version(staff_data), max_points)
+    df = chart_cache.get_or_render(key, lambda: _staff_performance_frame(staff_data, max_points))
+    st.line_chart(df, x="staff_member", y="performance")
+
+# Time series fed from database.rollups (pre-aggregated, so cheap regardless of history).
+
+def plot_patients_added(rows):
+    import pandas as pd
+    df = pd.DataFrame(rows)
+    st.subheader("Patients Added per Day")
+    if df.empty:
+        st.info("No patient activity yet.")
+        return
+    st.bar_chart(df, x="day", y="added")
+
+def plot_log_activity(rows):
+    import pandas as pd
+    df = pd.DataFrame(rows)
+    st.subheader("Audit Activity per Hour")
+    if df.empty:
+        st.info("No audit activity in this period.")
+        return
+    st.line_chart(df.pivot_table(index="hour", columns="role", values="count", fill_value=0))
+
+def plot_data_access(rows):
+    import pandas as pd
+    df = pd.DataFrame(rows)
+    st.subheader("Data Access Events per User")
+    if df.empty:
+        st.info("No data access events in this period.")
+        return
+    df["user"] = df["username"].fillna(df["user_id"].astype(str))
+    st.bar_chart(df.pivot_table(index="day", columns="user", values="count", fill_value=0))
@@ -0,0 +1,131 @@
+"""
+Chart rendering without Streamlit, for components.charts and benchmarks/charts.py.
+
+Long series are reduced with LTTB (largest-triangle-three-buckets), which keeps
+the peaks and troughs a plain every-nth-point sample would drop. Rendered
+output is kept in a small in-process LRU cache keyed by a hash of the data, so
+a Streamlit rerun with unchanged data costs a dictionary lookup instead of a
+matplotlib render. Figures are built with matplotlib.figure.Figure rather than
+pyplot: pyplot keeps every figure it creates alive until it is closed, which is
+what leaked memory across reruns.
+"""
+import datetime
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Sequence
+
+DEFAULT_MAX_POINTS = 500
+CACHE_ENTRIES = 64
+MARKER_MAX_POINTS = 60  # draw point markers only on short series
+
+
+def data_version(*parts) -> str:
+    """Stable hash of chart input (lists, dicts, pandas objects) for cache keys."""
+    digest = hashlib.sha1()
+    for part in parts:
+        if hasattr(part, "to_json"):
+            part = part.to_json()
+        digest.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """
+    Indices of at most `threshold` points that preserve the shape of the series
+    (Steinarsson's largest-triangle-three-buckets). xs must be ascending numbers.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    kept = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        if next_start >= next_end:
+            avg_x, avg_y = xs[-1], ys[-1]
+        else:
+            count = next_end - next_start
+            avg_x = sum(xs[next_start:next_end]) / count
+            avg_y = sum(ys[next_start:next_end]) / count
+        ax, ay = xs[a], ys[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        kept.append(best)
+        a = best
+    kept.append(n - 1)
+    return kept
+
+def _as_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+def render_trend_png(dates: Sequence, values: Sequence[float], title: str, xlabel: str, ylabel: str,
+                     max_points: int = DEFAULT_MAX_POINTS, size=(8, 4), dpi: int = 100) -> bytes:
+    """Line chart of a daily series as PNG bytes, downsampled to max_points."""
+    from matplotlib import dates as mdates
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    days = [_as_date(d) for d in dates]
+    values = [float(v or 0) for v in values]
+    keep = lttb([d.toordinal() for d in days], values, max_points)
+    fig = Figure(figsize=size, dpi=dpi)
+    try:
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.plot([days[i] for i in keep], [values[i] for i in keep],
+                marker="o" if len(keep) <= MARKER_MAX_POINTS else None)
+        # concise labels ("2024", "Feb", ...) lay out faster than rotated full dates
+        locator = mdates.AutoDateLocator()
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png")
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+
+class RenderCache:
+    """Thread-safe LRU of rendered charts (Streamlit runs sessions on threads of one process)."""
+
+    def __init__(self, entries: int = CACHE_ENTRIES):
+        self.entries = entries
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get_or_render(self, key: Hashable, render: Callable):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+        # render outside the lock; two sessions racing on the same key both render once
+        value = render()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.entries:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+
+chart_cache = RenderCache()
@@ -6,6 +6,27 @@ class Config:
     DEBUG = os.getenv("DEBUG", "False") == "True"
     ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "").split(",") if os.getenv("ALLOWED_HOSTS") else []
     GDPR_COMPLIANCE = True  # Ensure GDPR compliance is enabled
+    API_HOST = os.getenv("API_HOST", "127.0.0.1")
+    API_PORT = int(os.getenv("API_PORT", "8600"))
+    API_WORKERS = int(os.getenv("API_WORKERS", "4"))  # threads for blocking SQLite work
+    API_TOKEN_TTL = int(os.getenv("API_TOKEN_TTL", "3600"))  # seconds
+    SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "True") == "True"  # run jobs inside the Streamlit process
+    SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "2"))  # max jobs running at once, all workers
+    SCHEDULER_TICK = float(os.getenv("SCHEDULER_TICK", "5"))  # seconds between polls
+    BACKUP_DIR = os.getenv("BACKUP_DIR", "")  # empty: data/backups next to hospital.db
+    BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))  # snapshots kept after rotation
+    BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "256"))  # pages copied per backup step
+    BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.005"))  # seconds writers get between steps
+    BLOB_DIR = os.getenv("BLOB_DIR", "")  # empty: data/blobs next to hospital.db (notes and attachments)
+    SHARDS = os.getenv("HOSPITAL_SHARDS", "")  # "site=file.db,..." besides the primary site (database/shards.py)
+    SHARD_FANOUT_WORKERS = int(os.getenv("SHARD_FANOUT_WORKERS", "8"))  # threads for cross-site reports
+    PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 15)))  # cost; tune with python -m utils.passwords calibrate
+    PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+    PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))  # concurrent password verifications
+    ACCESS_SESSION_WINDOW = int(os.getenv("ACCESS_SESSION_WINDOW", "900"))  # seconds; repeated views within it are one audit entry
+    QUERY_CACHE_ENTRIES = int(os.getenv("QUERY_CACHE_ENTRIES", "16"))  # results kept per cached read helper; 0 disables (database/cache.py)
+    CHANGE_RETENTION_DAYS = int(os.getenv("CHANGE_RETENTION_DAYS", "30"))  # change-feed history kept uncompacted
 
     @staticmethod
     def init_app(app):
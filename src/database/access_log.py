@@ -0,0 +1,139 @@
+"""
+Coalesced access logging.
+
+Pages list the same patients on every Streamlit rerun, so logging each viewed
+record as its own audit entry adds thousands of near-identical rows per user
+per hour. Instead, repeated (user, action, patient) events are folded into one
+access_sessions row with first_seen, last_seen and count. A session stays open
+while events keep arriving within Config.ACCESS_SESSION_WINDOW seconds of its
+last_seen; the next event after a longer gap opens a new one.
+
+Opening a session also writes one ordinary audit entry (hash-chained, linked
+to the patient through log_subjects, redacted on erasure); extending it is a
+single UPDATE. So the chained log still records every window in which a user
+accessed a patient, and access_sessions holds the exact counts and the full
+set of subjects accessed (get_accessed_subjects). Audit-log based rollups
+(database/rollups.py) count sessions opened, not individual views.
+"""
+import datetime
+from typing import Dict, Iterable, List, Optional
+
+from config import Config
+from database.connection import get_db_connection, ensure_schema, UnitOfWork, note_log_failure
+
+_CHUNK = 500  # ids per IN (...) list
+
+
+def _create_access_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS access_sessions (
+        session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        role TEXT,
+        action TEXT NOT NULL,
+        patient_id INTEGER NOT NULL,
+        first_seen TEXT NOT NULL,
+        last_seen TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 1,
+        log_id INTEGER
+    )""")
+    # open-session lookup on every rerun; also serves per-user queries
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_access_sessions_open "
+                "ON access_sessions(user_id, action, patient_id, last_seen)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_access_sessions_patient ON access_sessions(patient_id, first_seen)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_access_sessions_last_seen ON access_sessions(last_seen)")
+    conn.commit()
+
+def _connect():
+    conn = get_db_connection()
+    ensure_schema(conn, "access_log", _create_access_tables)
+    return conn
+
+def record_accesses(user_id, role, action: str, patient_ids: Iterable[int], details: str = "patient_id={patient_id}",
+                    uow: Optional[UnitOfWork] = None, window: Optional[int] = None) -> Dict[str, int]:
+    """
+    Record that the user performed `action` on each patient, in one transaction
+    (the caller's unit of work, if given). Patients with an open session have it
+    extended; the others get a new session and one audit entry each, with
+    `details` formatted with the patient id. Returns {"opened": n, "extended": n}.
+    """
+    ids = list(dict.fromkeys(int(pid) for pid in patient_ids if pid is not None))
+    if not ids:
+        return {"opened": 0, "extended": 0}
+    if uow is None:
+        with UnitOfWork() as own:
+            return record_accesses(user_id, role, action, ids, details, own, window)
+    ensure_schema(uow.conn, "access_log", _create_access_tables)
+    now = datetime.datetime.utcnow()
+    stamp = now.isoformat()
+    cutoff = (now - datetime.timedelta(seconds=Config.ACCESS_SESSION_WINDOW if window is None else window)).isoformat()
+
+    open_sessions = {}
+    for i in range(0, len(ids), _CHUNK):
+        chunk = ids[i:i + _CHUNK]
+        open_sessions.update((r[0], r[1]) for r in uow.execute(
+            f"SELECT patient_id, MAX(session_id) FROM access_sessions WHERE user_id IS ? AND action = ? "
+            f"AND patient_id IN ({','.join('?' * len(chunk))}) AND last_seen >= ? GROUP BY patient_id",
+            (user_id, action, *chunk, cutoff)
+        ))
+    uow.executemany("UPDATE access_sessions SET last_seen = ?, count = count + 1 WHERE session_id = ?",
+                    [(stamp, session_id) for session_id in open_sessions.values()])
+
+    opened = [pid for pid in ids if pid not in open_sessions]
+    for pid in opened:
+        log_id = uow.log(user_id, role, action, details.format(patient_id=pid), patient_id=pid)
+        uow.execute(
+            "INSERT INTO access_sessions (user_id, role, action, patient_id, first_seen, last_seen, count, log_id) "
+            "VALUES (?,?,?,?,?,?,1,?)", (user_id, role, action, pid, stamp, stamp, log_id)
+        )
+    return {"opened": len(opened), "extended": len(open_sessions)}
+
+def log_accesses(user_id, role, action: str, patient_ids: Iterable[int], details: str = "patient_id={patient_id}"):
+    """record_accesses for page renders: like log_action, failures are counted instead of raised."""
+    try:
+        return record_accesses(user_id, role, action, patient_ids, details)
+    except Exception:
+        note_log_failure()
+        return None
+
+def get_access_sessions(user_id: Optional[int] = None, patient_id: Optional[int] = None,
+                        action: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                        limit: int = 1000) -> List[Dict]:
+    """Access sessions overlapping [since, until] (ISO timestamps), most recently active first."""
+    query = "SELECT * FROM access_sessions WHERE 1 = 1"
+    params = []
+    for column, value in (("user_id", user_id), ("patient_id", patient_id), ("action", action)):
+        if value is not None:
+            query += f" AND {column} = ?"
+            params.append(value)
+    if since:
+        query += " AND last_seen >= ?"
+        params.append(since)
+    if until:
+        query += " AND first_seen <= ?"
+        params.append(until)
+    conn = _connect()
+    rows = conn.execute(query + " ORDER BY last_seen DESC, session_id DESC LIMIT ?", (*params, limit)).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def get_accessed_subjects(user_id: int, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+    """
+    Every patient the user accessed in [since, until], with first and last access,
+    the number of events and the actions involved. Covers the current site.
+    """
+    query = ("SELECT patient_id, MIN(first_seen) AS first_seen, MAX(last_seen) AS last_seen, "
+             "SUM(count) AS accesses, COUNT(*) AS sessions, group_concat(DISTINCT action) AS actions "
+             "FROM access_sessions WHERE user_id = ?")
+    params = [user_id]
+    if since:
+        query += " AND last_seen >= ?"
+        params.append(since)
+    if until:
+        query += " AND first_seen <= ?"
+        params.append(until)
+    conn = _connect()
+    rows = conn.execute(query + " GROUP BY patient_id ORDER BY patient_id", params).fetchall()
+    conn.close()
+    return [dict(r, actions=sorted(r["actions"].split(","))) for r in rows]
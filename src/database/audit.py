@@ -0,0 +1,193 @@
+"""
+Tamper-evident audit log.
+
+Each row in `logs` is chained to its predecessor at insert time
+(trg_logs_chain in database.connection): entry_hash = sha256(prev_hash, log_id,
+user_id, role, action, timestamp, details_hash). Editing, inserting or deleting
+a row breaks the chain at that point.
+
+Checkpoints pin the chain head with an HMAC (Config.SECRET_KEY), so a verifier
+only has to re-hash the rows written since the last checkpoint, and a full
+verification can check the ranges between checkpoints independently, in
+parallel processes. Rows redacted by erasure (database.erasure) keep their
+details_hash, so they stay verifiable; they are counted separately.
+
+The chain cannot detect rows removed from the tail after the last checkpoint,
+which is why checkpoints are taken regularly by the scheduler.
+"""
+import datetime
+import hashlib
+import hmac
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from database import shards
+from database.connection import get_db_connection, ensure_schema, chain_hash, details_digest, GENESIS_HASH
+from database.erasure import REDACTED_DETAILS
+
+VERIFY_BATCH = 5000
+
+
+def _create_audit_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS audit_checkpoints (
+        checkpoint_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        last_log_id INTEGER NOT NULL,
+        entry_hash TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        created_by INTEGER,
+        signature TEXT NOT NULL
+    )""")
+    conn.commit()
+
+def _connect():
+    conn = get_db_connection()
+    ensure_schema(conn, "audit", _create_audit_tables)
+    return conn
+
+def _sign(last_log_id: int, entry_hash: str, created_at: str) -> str:
+    message = f"{last_log_id}:{entry_hash}:{created_at}".encode("utf-8")
+    return hmac.new(Config.SECRET_KEY.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+def _checkpoint_problem(cur, checkpoint) -> Optional[str]:
+    if not hmac.compare_digest(checkpoint["signature"],
+                               _sign(checkpoint["last_log_id"], checkpoint["entry_hash"], checkpoint["created_at"])):
+        return f"checkpoint {checkpoint['checkpoint_id']} has an invalid signature"
+    cur.execute("SELECT entry_hash FROM logs WHERE log_id = ?", (checkpoint["last_log_id"],))
+    row = cur.fetchone()
+    if row is None or row["entry_hash"] != checkpoint["entry_hash"]:
+        return f"log {checkpoint['last_log_id']} no longer matches checkpoint {checkpoint['checkpoint_id']}"
+    return None
+
+
+def verify_range(after_log_id: int = 0, prev_hash: str = GENESIS_HASH, until_log_id: Optional[int] = None) -> Dict:
+    """
+    Re-hash rows with after_log_id < log_id <= until_log_id, starting from the
+    trusted hash of row after_log_id. Stops at the first broken row.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(
+        "SELECT log_id, user_id, role, action, timestamp, details, details_hash, prev_hash, entry_hash "
+        "FROM logs WHERE log_id > ? AND log_id <= ? ORDER BY log_id",
+        (after_log_id, until_log_id if until_log_id is not None else 2 ** 63 - 1)
+    )
+    result = {"ok": True, "checked": 0, "redacted": 0, "last_log_id": after_log_id, "error": None}
+    try:
+        while True:
+            rows = cur.fetchmany(VERIFY_BATCH)
+            if not rows:
+                break
+            for log_id, user_id, role, action, timestamp, details, d_hash, stored_prev, stored_entry in rows:
+                if details == REDACTED_DETAILS:
+                    result["redacted"] += 1
+                elif details_digest(details) != d_hash:
+                    result.update(ok=False, error=f"log {log_id}: details were modified")
+                    return result
+                if stored_prev != prev_hash:
+                    result.update(ok=False, error=f"log {log_id}: chain broken (entry before it was changed or removed)")
+                    return result
+                prev_hash = chain_hash(prev_hash, log_id, user_id, role, action, timestamp, d_hash)
+                if stored_entry != prev_hash:
+                    result.update(ok=False, error=f"log {log_id}: entry was modified")
+                    return result
+                result["checked"] += 1
+                result["last_log_id"] = log_id
+    finally:
+        conn.close()
+    result["entry_hash"] = prev_hash
+    return result
+
+def get_checkpoints(limit: int = 100) -> List[Dict]:
+    conn = _connect()
+    rows = conn.execute("SELECT * FROM audit_checkpoints ORDER BY checkpoint_id DESC LIMIT ?", (limit,)).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def _latest_checkpoint(cur) -> Tuple[Optional[Dict], Optional[str]]:
+    cur.execute("SELECT * FROM audit_checkpoints ORDER BY checkpoint_id DESC LIMIT 1")
+    row = cur.fetchone()
+    if row is None:
+        return None, None
+    return dict(row), _checkpoint_problem(cur, row)
+
+def verify_incremental() -> Dict:
+    """Check the newest checkpoint, then only the rows appended after it."""
+    conn = _connect()
+    checkpoint, problem = _latest_checkpoint(conn.cursor())
+    conn.close()
+    if problem:
+        return {"ok": False, "checked": 0, "redacted": 0, "error": problem, "checkpoint_id": checkpoint["checkpoint_id"]}
+    if checkpoint is None:
+        result = verify_range()
+    else:
+        result = verify_range(checkpoint["last_log_id"], checkpoint["entry_hash"])
+    result["checkpoint_id"] = checkpoint["checkpoint_id"] if checkpoint else None
+    return result
+
+def create_checkpoint(created_by: Optional[int] = None) -> Dict:
+    """
+    Verify the rows since the last checkpoint and, if the chain is intact,
+    sign the current head. Nothing is written when there are no new rows.
+    """
+    result = verify_incremental()
+    if not result["ok"] or result["checked"] == 0:
+        return result
+    created_at = datetime.datetime.utcnow().isoformat()
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO audit_checkpoints (last_log_id, entry_hash, created_at, created_by, signature) VALUES (?,?,?,?,?)",
+        (result["last_log_id"], result["entry_hash"], created_at, created_by,
+         _sign(result["last_log_id"], result["entry_hash"], created_at))
+    )
+    result["checkpoint_id"] = cur.lastrowid
+    conn.commit()
+    conn.close()
+    return result
+
+def _verify_range_job(args) -> Dict:
+    # runs in a worker process, which does not see the caller's current site
+    site, *bounds = args
+    with shards.use_site(site):
+        return verify_range(*bounds)
+
+def verify_full(workers: Optional[int] = None) -> Dict:
+    """
+    Verify the whole log. Every checkpoint is validated and anchors the start of
+    the next range, so ranges are re-hashed concurrently in worker processes.
+    """
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM audit_checkpoints ORDER BY last_log_id")
+    checkpoints = cur.fetchall()
+    problems = [p for p in (_checkpoint_problem(cur, c) for c in checkpoints) if p]
+    conn.close()
+    if problems:
+        return {"ok": False, "checked": 0, "redacted": 0, "ranges": 0, "error": problems[0]}
+
+    bounds = [(0, GENESIS_HASH)] + [(c["last_log_id"], c["entry_hash"]) for c in checkpoints]
+    bounds = list(dict.fromkeys(bounds))
+    ranges = [(start, prev, end) for (start, prev), (end, _) in zip(bounds, bounds[1:])]
+    ranges.append((bounds[-1][0], bounds[-1][1], None))
+
+    workers = workers or min(len(ranges), os.cpu_count() or 1)
+    if workers > 1 and len(ranges) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            site = shards.resolve()
+            results = list(pool.map(_verify_range_job, [(site, *r) for r in ranges]))
+    else:
+        results = [verify_range(*r) for r in ranges]
+
+    failed = next((r for r in results if not r["ok"]), None)
+    return {
+        "ok": failed is None,
+        "checked": sum(r["checked"] for r in results),
+        "redacted": sum(r["redacted"] for r in results),
+        "ranges": len(ranges),
+        "error": failed["error"] if failed else None,
+    }
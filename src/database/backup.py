@@ -0,0 +1,212 @@
+"""
+Online backups of hospital.db.
+
+Snapshots are taken with SQLite's online backup API, a few hundred pages per
+step with a short pause in between, so readers and writers keep running while
+the copy is made (copying the file directly can capture a half-written page).
+The database runs in WAL mode and the copy reads from one pinned snapshot:
+without that, every commit by another connection restarts a stepped backup,
+which then never finishes under steady write traffic.
+Every copy is checked with PRAGMA integrity_check before it is gzip-compressed
+into the backup directory; older snapshots are rotated out. Each site shard
+(database/shards.py) is backed up on its own, into backups/<site> for sites
+other than the primary.
+
+    cd src
+    python -m database.backup create
+    python -m database.backup --site north create
+    python -m database.backup list
+    python -m database.backup restore data/backups/hospital-20240101T020000Z.db.gz
+"""
+import argparse
+import datetime
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from config import Config
+from database import cache, connection, shards
+
+SNAPSHOT_PREFIX = "hospital-"
+SNAPSHOT_SUFFIX = ".db.gz"
+
+
+class BackupError(Exception):
+    pass
+
+
+def backup_dir(site: Optional[str] = None) -> Path:
+    """Snapshot directory of the site (default: the current one)."""
+    base = Path(Config.BACKUP_DIR) if Config.BACKUP_DIR else Path(connection.DB_PATH).parent / "backups"
+    site = shards.resolve(site)
+    return base if site == shards.PRIMARY_SITE else base / site
+
+def _integrity_problem(path: Path) -> Optional[str]:
+    conn = sqlite3.connect(path)
+    try:
+        rows = [r[0] for r in conn.execute("PRAGMA integrity_check").fetchall()]
+    finally:
+        conn.close()
+    return None if rows == ["ok"] else "; ".join(rows[:5])
+
+def _copy_online(source: Path, dest: Path, pages: int, pause: float, progress: Optional[Callable] = None):
+    src = sqlite3.connect(source, isolation_level=None)
+    dst = sqlite3.connect(dest)
+    if src.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+        # pin a read snapshot; in WAL mode this does not block writers
+        src.execute("BEGIN")
+        src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+
+    def step(status, remaining, total):
+        if progress and total:
+            progress((total - remaining) / total, f"copied {total - remaining}/{total} pages")
+        if pause and remaining:
+            time.sleep(pause)  # lets writers take the lock between steps
+
+    try:
+        src.backup(dst, pages=pages, progress=step)
+    finally:
+        dst.close()
+        src.close()
+
+def _compress(path: Path, target: Path):
+    with open(path, "rb") as raw, gzip.open(target, "wb", compresslevel=6) as packed:
+        shutil.copyfileobj(raw, packed, 1024 * 1024)
+
+def _decompress(snapshot: Path, target: Path):
+    with gzip.open(snapshot, "rb") as packed, open(target, "wb") as raw:
+        shutil.copyfileobj(packed, raw, 1024 * 1024)
+
+def list_backups(directory: Optional[Path] = None) -> List[Dict]:
+    """Snapshots in the backup directory, newest first."""
+    directory = Path(directory or backup_dir())
+    if not directory.exists():
+        return []
+    snapshots = sorted(directory.glob(f"{SNAPSHOT_PREFIX}*{SNAPSHOT_SUFFIX}"), reverse=True)
+    return [{"path": str(p), "name": p.name, "bytes": p.stat().st_size} for p in snapshots]
+
+def rotate_backups(keep: int = None, directory: Optional[Path] = None) -> List[str]:
+    keep = Config.BACKUP_KEEP if keep is None else keep
+    removed = []
+    for snapshot in list_backups(directory)[keep:]:
+        os.remove(snapshot["path"])
+        removed.append(snapshot["name"])
+    return removed
+
+def create_backup(directory: Optional[Path] = None, label: str = "", keep: int = None, rotate: bool = True,
+                  pages: int = None, pause: float = None, progress: Optional[Callable] = None) -> Dict:
+    """
+    Copy the live database into a verified, compressed snapshot and rotate old ones.
+    Raises BackupError if the copy fails the integrity check.
+    """
+    directory = Path(directory or backup_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    pages = Config.BACKUP_STEP_PAGES if pages is None else pages
+    pause = Config.BACKUP_STEP_PAUSE if pause is None else pause
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+    name = f"{SNAPSHOT_PREFIX}{stamp}{'-' + label if label else ''}{SNAPSHOT_SUFFIX}"
+
+    fd, tmp = tempfile.mkstemp(prefix=".backup-", suffix=".db", dir=directory)
+    os.close(fd)
+    tmp = Path(tmp)
+    try:
+        started = time.perf_counter()
+        _copy_online(shards.shard_path(), tmp, pages, pause, progress)
+        copy_seconds = time.perf_counter() - started
+        problem = _integrity_problem(tmp)
+        if problem:
+            raise BackupError(f"backup copy failed integrity check: {problem}")
+        _compress(tmp, directory / (name + ".part"))
+        os.replace(directory / (name + ".part"), directory / name)
+        result = {
+            "path": str(directory / name),
+            "db_bytes": tmp.stat().st_size,
+            "bytes": (directory / name).stat().st_size,
+            "copy_seconds": round(copy_seconds, 3),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+    finally:
+        tmp.unlink(missing_ok=True)
+        (directory / (name + ".part")).unlink(missing_ok=True)
+    result["rotated"] = rotate_backups(keep, directory) if rotate else []
+    return result
+
+def verify_backup(snapshot) -> Dict:
+    snapshot = Path(snapshot)
+    fd, tmp = tempfile.mkstemp(prefix=".verify-", suffix=".db", dir=snapshot.parent)
+    os.close(fd)
+    try:
+        _decompress(snapshot, Path(tmp))
+        problem = _integrity_problem(Path(tmp))
+    finally:
+        os.remove(tmp)
+    return {"path": str(snapshot), "ok": problem is None, "error": problem}
+
+def restore_backup(snapshot, safety_copy: bool = True) -> Dict:
+    """
+    Replace the current site's database contents with a snapshot. The snapshot
+    is verified first, and the current database is itself backed up (label
+    "pre-restore") unless safety_copy is False. The copy goes through the backup API into the
+    live file, so open connections see a consistent switch, not a torn file.
+    """
+    snapshot = Path(snapshot)
+    fd, tmp = tempfile.mkstemp(prefix=".restore-", suffix=".db", dir=snapshot.parent)
+    os.close(fd)
+    tmp = Path(tmp)
+    try:
+        _decompress(snapshot, tmp)
+        problem = _integrity_problem(tmp)
+        if problem:
+            raise BackupError(f"snapshot {snapshot.name} failed integrity check: {problem}")
+        live = shards.shard_path()
+        safety = create_backup(label="pre-restore", rotate=False) if safety_copy and live.exists() else None
+        versions = cache.max_version() if live.exists() else 0
+        _copy_online(tmp, live, pages=-1, pause=0)
+    finally:
+        tmp.unlink(missing_ok=True)
+    # the snapshot's version counters may repeat values that other processes cached results under
+    cache.advance_versions(above=versions)
+    # in-process caches built from the old contents
+    from database import scheduling
+    scheduling._indexes.pop(shards.resolve(), None)
+    return {"restored": str(snapshot), "safety_backup": safety["path"] if safety else None}
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Hospital database backups")
+    parser.add_argument("--site", default=None, help="site shard to operate on (default: the primary)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    create = sub.add_parser("create", help="take a verified, compressed snapshot")
+    create.add_argument("--keep", type=int, default=Config.BACKUP_KEEP)
+    create.add_argument("--pages", type=int, default=Config.BACKUP_STEP_PAGES)
+    sub.add_parser("list", help="list snapshots, newest first")
+    verify = sub.add_parser("verify", help="run an integrity check on a snapshot")
+    verify.add_argument("snapshot")
+    restore = sub.add_parser("restore", help="restore the live database from a snapshot")
+    restore.add_argument("snapshot")
+    restore.add_argument("--no-safety-copy", action="store_true")
+    args = parser.parse_args(argv)
+    with shards.use_site(args.site):
+        _run_command(args)
+
+def _run_command(args):
+    if args.command == "create":
+        print(create_backup(keep=args.keep, pages=args.pages))
+    elif args.command == "list":
+        for snapshot in list_backups():
+            print(f"{snapshot['name']}  {snapshot['bytes']} bytes")
+    elif args.command == "verify":
+        result = verify_backup(args.snapshot)
+        print("ok" if result["ok"] else f"FAILED: {result['error']}")
+        raise SystemExit(0 if result["ok"] else 1)
+    elif args.command == "restore":
+        print(restore_backup(args.snapshot, safety_copy=not args.no_safety_copy))
+
+
+if __name__ == "__main__":
+    main()
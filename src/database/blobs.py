@@ -0,0 +1,235 @@
+"""
+Content-addressed blob store for clinical notes and attachments (database/notes.py).
+
+Each site keeps a blob once, named by the SHA-256 of its content:
+
+    data/blobs[/<site>]/3f/3fa9...e1.gz     gzip-compressed
+    data/blobs[/<site>]/3f/3fa9...e1        stored raw (can be memory-mapped)
+
+Content is compressed unless a sample of its first chunk does not shrink
+(scans, JPEG, most PDFs). The blobs table keeps size, codec and a reference
+count, so identical uploads share one file and only bump the count.
+
+Writes take two steps. stage() streams an upload into a staging file while
+hashing and compressing it, without holding a database lock. commit() then,
+inside the caller's write transaction (which holds the write lock), moves the file
+into place unless the content is already stored and counts the reference.
+collect_garbage() removes files whose count dropped to zero under the same
+lock, so it cannot race with a commit of the same content. A transaction that
+rolls back after commit() leaves an unreferenced file behind; the garbage
+collector removes those too once they are older than STAGING_GRACE.
+"""
+import datetime
+import gzip
+import hashlib
+import itertools
+import mmap
+import os
+import tempfile
+import time
+import zlib
+from collections import namedtuple
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional
+
+from config import Config
+from database import connection, shards
+from database.connection import get_db_connection, ensure_schema, UnitOfWork
+
+CHUNK = 64 * 1024
+COMPRESSIBLE_RATIO = 0.9      # store raw when the sampled gzip output is larger than this share
+STAGING_GRACE = 24 * 3600     # seconds before abandoned staging files and unreferenced blobs are removed
+
+StagedBlob = namedtuple("StagedBlob", "digest size stored_size codec path site")
+
+
+def _create_blob_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS blobs (
+        digest TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        stored_size INTEGER NOT NULL,
+        codec TEXT NOT NULL,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs(refcount) WHERE refcount <= 0")
+    conn.commit()
+
+def _connect(site: Optional[str] = None):
+    conn = get_db_connection(site)
+    ensure_schema(conn, "blobs", _create_blob_tables)
+    return conn
+
+def blob_dir(site: Optional[str] = None) -> Path:
+    """Blob directory of the site (default: the current one)."""
+    base = Path(Config.BLOB_DIR) if Config.BLOB_DIR else Path(connection.DB_PATH).parent / "blobs"
+    site = shards.resolve(site)
+    return base if site == shards.PRIMARY_SITE else base / site
+
+def blob_path(digest: str, codec: str, site: Optional[str] = None) -> Path:
+    return blob_dir(site) / digest[:2] / (digest + (".gz" if codec == "gzip" else ""))
+
+def _chunks(source) -> Iterator[bytes]:
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for i in range(0, len(view), CHUNK):
+            yield bytes(view[i:i + CHUNK])
+        return
+    while True:
+        chunk = source.read(CHUNK)
+        if not chunk:
+            return
+        yield chunk
+
+def stage(source, site: Optional[str] = None) -> StagedBlob:
+    """
+    Stream content (bytes, str or a binary file object) into a staging file,
+    hashing it and compressing it when that pays off. Memory use is one chunk.
+    """
+    site = shards.resolve(site)
+    staging = blob_dir(site) / "staging"
+    staging.mkdir(parents=True, exist_ok=True)
+    chunks = _chunks(source)
+    first = next(chunks, b"")
+    codec = "gzip" if first and len(zlib.compress(first, 1)) < COMPRESSIBLE_RATIO * len(first) else "raw"
+    fd, path = tempfile.mkstemp(dir=staging, suffix=".part")
+    digest, size = hashlib.sha256(), 0
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            # mtime=0: the same content always compresses to the same bytes
+            out = gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) if codec == "gzip" else raw
+            for chunk in itertools.chain([first], chunks):
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+            if out is not raw:
+                out.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+    except BaseException:
+        os.unlink(path)
+        raise
+    return StagedBlob(digest.hexdigest(), size, os.path.getsize(path), codec, path, site)
+
+def discard(staged: StagedBlob):
+    """Drop a staging file that was not committed (no-op after commit)."""
+    try:
+        os.unlink(staged.path)
+    except FileNotFoundError:
+        pass
+
+def commit(staged: StagedBlob, cur, references: int = 1) -> str:
+    """
+    Store a staged blob (or reuse the stored copy) and add `references` to its
+    count, on the cursor of a write transaction on the site it was staged for.
+    """
+    ensure_schema(cur.connection, "blobs", _create_blob_tables)
+    final = blob_path(staged.digest, staged.codec, staged.site)
+    if final.exists():
+        discard(staged)
+    else:
+        final.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(staged.path, final)
+    cur.execute(
+        "INSERT INTO blobs (digest, size, stored_size, codec, refcount, created_at) VALUES (?,?,?,?,?,?) "
+        "ON CONFLICT(digest) DO UPDATE SET refcount = refcount + excluded.refcount",
+        (staged.digest, staged.size, staged.stored_size, staged.codec, references,
+         datetime.datetime.utcnow().isoformat())
+    )
+    return staged.digest
+
+def release(cur, digests: Dict[str, int]):
+    """Drop references (digest -> count) on the caller's cursor; files go at the next collect_garbage()."""
+    cur.executemany("UPDATE blobs SET refcount = refcount - ? WHERE digest = ?",
+                    [(count, digest) for digest, count in digests.items()])
+
+def get_blob(digest: str, site: Optional[str] = None) -> Optional[Dict]:
+    conn = _connect(site)
+    row = conn.execute("SELECT * FROM blobs WHERE digest = ?", (digest,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def _stored_path(digest: str, site: Optional[str]) -> Path:
+    for codec in ("gzip", "raw"):
+        path = blob_path(digest, codec, site)
+        if path.exists():
+            return path
+    raise FileNotFoundError(f"blob {digest} is not stored on site {shards.resolve(site)}")
+
+def open_blob(digest: str, site: Optional[str] = None) -> BinaryIO:
+    """The blob's content as a binary file object, decompressed as it is read."""
+    path = _stored_path(digest, site)
+    return gzip.open(path, "rb") if path.suffix == ".gz" else open(path, "rb")
+
+def iter_blob(digest: str, site: Optional[str] = None, chunk: int = CHUNK) -> Iterator[bytes]:
+    with open_blob(digest, site) as f:
+        while True:
+            data = f.read(chunk)
+            if not data:
+                return
+            yield data
+
+def map_blob(digest: str, site: Optional[str] = None) -> mmap.mmap:
+    """Read-only memory map of a raw-stored blob (use open_blob for compressed ones)."""
+    path = _stored_path(digest, site)
+    if path.suffix == ".gz":
+        raise ValueError(f"blob {digest} is compressed; stream it with open_blob()")
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _unlink(path: Path) -> int:
+    try:
+        size = path.stat().st_size
+        path.unlink()
+        return size
+    except FileNotFoundError:
+        return 0
+
+def collect_garbage(digests: Optional[Iterable[str]] = None, site: Optional[str] = None,
+                    grace: int = STAGING_GRACE) -> Dict[str, int]:
+    """
+    Delete blobs nobody references. With `digests`, only those (right after an
+    erasure); otherwise every unreferenced blob, plus staging leftovers and files
+    without a row that are older than `grace` seconds.
+    """
+    site = shards.resolve(site)
+    result = {"blobs": 0, "orphans": 0, "staging": 0, "bytes": 0}
+    old = time.time() - grace
+    candidates = []
+    if digests is None:
+        root = blob_dir(site)
+        for part in (root / "staging").glob("*.part"):
+            if part.stat().st_mtime < old:
+                result["bytes"] += _unlink(part)
+                result["staging"] += 1
+        # digest-named files only: a two-letter site directory also matches ??/*
+        candidates = [p for p in root.glob("??/*") if len(p.name.split(".")[0]) == 64 and p.is_file()
+                      and p.stat().st_mtime < old]
+    with UnitOfWork(site) as uow:
+        ensure_schema(uow.conn, "blobs", _create_blob_tables)
+        if digests is None:
+            rows = uow.execute("SELECT digest, codec FROM blobs WHERE refcount <= 0").fetchall()
+        else:
+            wanted, rows = list(dict.fromkeys(digests)), []
+            for i in range(0, len(wanted), 500):
+                chunk = wanted[i:i + 500]
+                rows += uow.execute(f"SELECT digest, codec FROM blobs WHERE refcount <= 0 "
+                                    f"AND digest IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+        for row in rows:
+            result["bytes"] += _unlink(blob_path(row["digest"], row["codec"], site))
+        uow.executemany("DELETE FROM blobs WHERE digest = ? AND refcount <= 0", [(r["digest"],) for r in rows])
+        result["blobs"] = len(rows)
+        for i in range(0, len(candidates), 500):
+            chunk = {p.name.split(".")[0]: p for p in candidates[i:i + 500]}
+            known = {r[0] for r in uow.execute(
+                f"SELECT digest FROM blobs WHERE digest IN ({','.join('?' * len(chunk))})", list(chunk)
+            )}
+            for digest, path in chunk.items():
+                if digest not in known:
+                    result["bytes"] += _unlink(path)
+                    result["orphans"] += 1
+    return result
@@ -0,0 +1,244 @@
+"""
+In-process caches of read helpers that stay correct across worker processes.
+
+Several Streamlit (or API) processes share one SQLite file per site, so a
+result cached by one process goes stale when another one writes. Instead of
+an external invalidation service, the database itself carries the signal:
+
+- triggers keep a version counter per tracked table in `table_versions`,
+  bumped by every insert, update and delete, in the writing transaction,
+  whichever process or tool (erasure, rebalance, the sqlite3 CLI) wrote it;
+- each process keeps one idle connection per site and polls
+  `PRAGMA data_version`, which changes whenever another connection committed.
+  Only then does it re-read the few counters.
+
+A cached entry remembers the versions of the tables it was computed from and
+is dropped as soon as one of them moves, so a new patient invalidates patient
+lists but not the staff list:
+
+    @cached("patients")
+    def get_patients(role=None, columns=None): ...
+
+The versions are read before the function runs, so a write racing with it can
+only cause an extra miss, never a stale hit. Cached values are shared between
+callers; treat them as read-only (the `copy` argument hands out shallow copies).
+"""
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from config import Config
+from database import shards
+
+TRACKED_TABLES = ("patients", "appointments", "users", "logs")
+
+_MISS = object()
+
+
+def _create_version_tables(conn):
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE IF NOT EXISTS table_versions (table_name TEXT PRIMARY KEY, version INTEGER NOT NULL) "
+                "WITHOUT ROWID")
+    # only write what is missing: once set up, this runs without the write lock, so a
+    # connection opened inside another one's unit of work does not wait for it
+    present = {r[0] for r in cur.execute("SELECT table_name FROM table_versions")}
+    for table in TRACKED_TABLES:
+        if table not in present:
+            cur.execute("INSERT OR IGNORE INTO table_versions (table_name, version) VALUES (?, 0)", (table,))
+        for event in ("insert", "update", "delete"):
+            # IF NOT EXISTS: re-creating would change the schema under every other connection
+            cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event} AFTER {event.upper()} ON {table} BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+            END""")
+    conn.commit()
+
+def _connect(site: Optional[str] = None):
+    # imported here: database.connection decorates its own helpers with cached()
+    from database import connection
+    conn = connection.get_db_connection(site)
+    ensure_versions(conn)
+    return conn
+
+def ensure_versions(conn):
+    from database import connection
+    connection.ensure_schema(conn, "table_versions", _create_version_tables)
+
+
+class _Watcher:
+    """One idle connection per site that tells whether anything was committed since the last look."""
+
+    def __init__(self, site: str):
+        self.site = site
+        self.pid = os.getpid()
+        self._conn = _connect(site)
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._versions: Dict[str, int] = {}
+
+    def versions(self) -> Optional[Dict[str, int]]:
+        with self._lock:
+            try:
+                # data_version first: a commit landing in between only causes another re-read
+                data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != self._data_version:
+                    self._versions = dict(self._conn.execute("SELECT table_name, version FROM table_versions"))
+                    self._data_version = data_version
+            except sqlite3.Error:
+                # e.g. a snapshot without the table was just restored; serve uncached meanwhile
+                self._data_version = None
+                return None
+            return self._versions
+
+
+_watchers: Dict[str, _Watcher] = {}
+_watchers_lock = threading.Lock()
+
+def _watcher(site: str) -> _Watcher:
+    watcher = _watchers.get(site)
+    # a forked child must not share its parent's connection
+    if watcher is None or watcher.pid != os.getpid():
+        with _watchers_lock:
+            watcher = _watchers.get(site)
+            if watcher is None or watcher.pid != os.getpid():
+                watcher = _watchers[site] = _Watcher(site)
+    return watcher
+
+def table_versions(tables: Sequence[str], site: Optional[str] = None) -> Optional[Tuple[int, ...]]:
+    """Current versions of `tables` on the site, or None when they cannot be read."""
+    versions = _watcher(shards.resolve(site)).versions()
+    if versions is None:
+        return None
+    return tuple(versions.get(t, 0) for t in tables)
+
+def advance_versions(site: Optional[str] = None, above: int = 0):
+    """
+    Move every counter past `above` and any value it had. After the database
+    file was replaced (backup restore), counters may have gone back to values
+    other processes cached entries under.
+    """
+    from database import connection
+    conn = connection.get_db_connection(site)
+    _create_version_tables(conn)
+    conn.execute("UPDATE table_versions SET version = MAX(version, ?) + 1", (above,))
+    conn.commit()
+    conn.close()
+
+def max_version(site: Optional[str] = None) -> int:
+    conn = _connect(site)
+    row = conn.execute("SELECT MAX(version) FROM table_versions").fetchone()
+    conn.close()
+    return row[0] or 0
+
+
+class QueryCache:
+    """LRU of one helper's results, each tagged with (site, versions of its tables)."""
+
+    def __init__(self, name: str, tables: Sequence[str], max_age: Optional[float] = None,
+                 entries: Optional[int] = None):
+        unknown = set(tables) - set(TRACKED_TABLES)
+        if unknown:
+            raise ValueError(f"tables without version triggers: {', '.join(sorted(unknown))}")
+        self.name = name
+        self.tables = tuple(tables)
+        self.max_age = max_age
+        self.entries = entries
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.invalidated = 0
+
+    def get(self, key, versions):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if item[0] == versions and (self.max_age is None or time.monotonic() - item[1] < self.max_age):
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return item[2]
+                self._drop_outdated(key[0], versions)
+            self.misses += 1
+            return _MISS
+
+    def _drop_outdated(self, site, versions):
+        # everything this helper cached for the site under older versions is unusable too
+        outdated = [k for k, item in self._items.items() if k[0] == site and item[0] != versions]
+        for k in outdated:
+            del self._items[k]
+        self.invalidated += len(outdated)
+
+    def put(self, key, versions, value):
+        limit = Config.QUERY_CACHE_ENTRIES if self.entries is None else self.entries
+        with self._lock:
+            self._items[key] = (versions, time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > limit:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = self.invalidated = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            calls = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "invalidated": self.invalidated,
+                    "entries": len(self._items), "hit_rate": round(self.hits / calls, 3) if calls else None}
+
+
+_caches: Dict[str, QueryCache] = {}
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    hash(value)
+    return value
+
+def cached(*tables: str, site: Optional[str] = None, max_age: Optional[float] = None,
+           copy: Optional[Callable] = None, entries: Optional[int] = None):
+    """
+    Cache a read helper's results per site and arguments until one of `tables`
+    changes on that site (or after max_age seconds, for results that also
+    depend on the clock). `site` pins helpers that always read one site, such
+    as the user accounts in the primary. QUERY_CACHE_ENTRIES=0 disables caching.
+    """
+    def decorate(func):
+        cache = _caches[f"{func.__module__}.{func.__qualname__}"] = QueryCache(
+            f"{func.__module__}.{func.__qualname__}", tables, max_age, entries)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if Config.QUERY_CACHE_ENTRIES <= 0:
+                return func(*args, **kwargs)
+            where = shards.resolve(site)
+            try:
+                key = (where, _freeze(args), _freeze(kwargs))
+            except TypeError:
+                return func(*args, **kwargs)
+            versions = table_versions(cache.tables, where)
+            value = _MISS if versions is None else cache.get(key, versions)
+            if value is _MISS:
+                value = func(*args, **kwargs)
+                if versions is not None:
+                    cache.put(key, versions, value)
+            return copy(value) if copy is not None else value
+
+        wrapper.cache = cache
+        return wrapper
+    return decorate
+
+def cache_stats() -> Dict[str, Dict]:
+    """Hits, misses and invalidations of every cached helper in this process."""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+def clear_caches():
+    for cache in _caches.values():
+        cache.clear()
@@ -0,0 +1,191 @@
+"""
+Change feed for incremental sync of patients and appointments.
+
+Triggers (connection._ensure_change_capture) append one entry per insert,
+update, anonymization and delete to the `changes` table and stamp the row with
+its change_seq and updated_at. A consumer keeps the last token it saw and asks
+for what happened since:
+
+    page = changes_since(token)        # {"changes": [...], "next_token": ..., "has_more": ..., "reset": ...}
+
+Entries come in change order and carry the row as it is now (deleted rows are
+tombstones with row=None), so applying them in order as upserts/deletes
+converges on the current tables. Patients are pseudonymized unless identifiers
+are asked for. Token 0 replays every row that still exists. Tokens are
+per site shard.
+
+compact_changes() keeps the table from growing without bound: entries older
+than the retention window are dropped when a later entry for the same row
+exists, and old tombstones are dropped altogether. A consumer whose token is
+older than the dropped tombstones gets reset=True and must start again from 0.
+
+    cd src
+    python -m database.changes --since 0 --out changes.jsonl
+"""
+import argparse
+import datetime
+import json
+import sys
+from typing import Dict, IO, Iterator, List, Optional, Sequence
+
+from config import Config
+from database.connection import get_db_connection, ensure_schema, CHANGE_TRACKED_COLUMNS
+
+DEFAULT_PAGE = 1000
+MAX_PAGE = 10000
+TABLES = tuple(CHANGE_TRACKED_COLUMNS)
+
+ROW_COLUMNS = {
+    "patients": ("patient_id", "anonymized_name", "anonymized_contact", "diagnosis", "date_added", "anon_version",
+                 "change_seq", "updated_at"),
+    "appointments": ("appointment_id", "patient_id", "provider_id", "date", "time", "duration_minutes", "status",
+                     "created_by", "created_at", "change_seq", "updated_at"),
+}
+IDENTIFIER_COLUMNS = {"patients": ("name", "contact"), "appointments": ("patient_name",)}
+_KEYS = {"patients": "patient_id", "appointments": "appointment_id"}
+
+
+def _create_change_state(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS change_feed_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.commit()
+
+def _connect():
+    conn = get_db_connection()
+    ensure_schema(conn, "changes", _create_change_state)
+    return conn
+
+def _state(cur, name: str) -> int:
+    row = cur.execute("SELECT value FROM change_feed_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def latest_token() -> int:
+    """Token of the newest change on the current site; a consumer starting from a snapshot begins here."""
+    conn = _connect()
+    row = conn.execute("SELECT MAX(change_seq) FROM changes").fetchone()
+    conn.close()
+    return row[0] or 0
+
+def _rows(cur, table: str, ids: Sequence[int], include_identifiers: bool) -> Dict[int, Dict]:
+    columns = ROW_COLUMNS[table] + (IDENTIFIER_COLUMNS[table] if include_identifiers else ())
+    rows = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cur.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {_KEYS[table]} IN ({','.join('?' * len(chunk))})",
+                    chunk)
+        for r in cur.fetchall():
+            rows[r[0]] = dict(zip(columns, r))
+    return rows
+
+def changes_since(token: int = 0, limit: int = DEFAULT_PAGE, tables: Optional[Sequence[str]] = None,
+                  include_identifiers: bool = False) -> Dict:
+    """
+    Up to `limit` changes after `token` on the current site, oldest first.
+    Pass next_token back in to continue; has_more says whether to ask again now.
+    """
+    tables = tuple(tables or TABLES)
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        raise ValueError(f"no change feed for {', '.join(sorted(unknown))}")
+    token, limit = max(0, int(token)), max(1, min(int(limit), MAX_PAGE))
+    conn = _connect()
+    cur = conn.cursor()
+    cur.row_factory = None
+    try:
+        # read the page and the rows in one snapshot
+        cur.execute("BEGIN")
+        latest = cur.execute("SELECT MAX(change_seq) FROM changes").fetchone()[0] or 0
+        # a token older than dropped tombstones, or newer than the feed (restored backup)
+        if (token and token < _state(cur, "tombstones_dropped_through")) or token > latest:
+            return {"changes": [], "next_token": 0, "has_more": latest > 0, "reset": True}
+        # "+table_name": walk the primary key in order rather than idx_changes_row plus a sort
+        cur.execute(
+            f"SELECT change_seq, table_name, row_id, op, changed_at FROM changes WHERE change_seq > ? "
+            f"AND +table_name IN ({','.join('?' * len(tables))}) ORDER BY change_seq LIMIT ?",
+            (token, *tables, limit)
+        )
+        entries = cur.fetchall()
+        rows = {table: _rows(cur, table, sorted({e[2] for e in entries if e[1] == table and e[3] != "delete"}),
+                             include_identifiers)
+                for table in tables}
+    finally:
+        conn.rollback()
+        conn.close()
+    changes = [{"seq": seq, "table": table, "id": row_id, "op": op, "changed_at": changed_at,
+                "row": None if op == "delete" else rows[table].get(row_id)}
+               for seq, table, row_id, op, changed_at in entries]
+    next_token = entries[-1][0] if entries else token
+    return {"changes": changes, "next_token": next_token, "has_more": len(entries) == limit, "reset": False}
+
+def iter_changes(token: int = 0, page: int = DEFAULT_PAGE, tables: Optional[Sequence[str]] = None,
+                 include_identifiers: bool = False) -> Iterator[Dict]:
+    """Pages from changes_since until the feed is drained; stops after a reset page."""
+    while True:
+        result = changes_since(token, page, tables, include_identifiers)
+        yield result
+        if result["reset"] or not result["has_more"]:
+            return
+        token = result["next_token"]
+
+def export_jsonl(out: IO[str], token: int = 0, page: int = DEFAULT_PAGE, tables: Optional[Sequence[str]] = None,
+                 include_identifiers: bool = False) -> Dict:
+    """Write the changes after `token` to `out`, one JSON object per line, a page at a time."""
+    written, next_token, reset = 0, token, False
+    for result in iter_changes(token, page, tables, include_identifiers):
+        for change in result["changes"]:
+            out.write(json.dumps(change, separators=(",", ":")) + "\n")
+        written += len(result["changes"])
+        next_token, reset = result["next_token"], result["reset"]
+    out.flush()
+    return {"written": written, "since": token, "next_token": next_token, "reset": reset}
+
+def compact_changes(keep_days: Optional[int] = None) -> Dict[str, int]:
+    """
+    Drop entries older than keep_days that a later entry for the same row
+    supersedes, and tombstones older than keep_days.
+    """
+    keep_days = Config.CHANGE_RETENTION_DAYS if keep_days is None else keep_days
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=keep_days)).isoformat()
+    conn = _connect()
+    cur = conn.cursor()
+    row = cur.execute("SELECT MAX(change_seq) FROM changes WHERE changed_at < ?", (cutoff,)).fetchone()
+    horizon = row[0] or 0
+    cur.execute("""
+    DELETE FROM changes WHERE change_seq <= ? AND change_seq < (
+        SELECT MAX(c.change_seq) FROM changes c WHERE c.table_name = changes.table_name AND c.row_id = changes.row_id
+    )""", (horizon,))
+    superseded = cur.rowcount
+    cur.execute("DELETE FROM changes WHERE change_seq <= ? AND op = 'delete'", (horizon,))
+    tombstones = cur.rowcount
+    if tombstones:
+        cur.execute(
+            "INSERT INTO change_feed_state (name, value) VALUES ('tombstones_dropped_through', ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)", (horizon,)
+        )
+    conn.commit()
+    conn.close()
+    return {"superseded": superseded, "tombstones": tombstones, "horizon": horizon}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Export the change feed as JSON lines")
+    parser.add_argument("--since", type=int, default=0, help="token from the previous export (0: everything)")
+    parser.add_argument("--out", default="-", help="file to append to, '-' for stdout")
+    parser.add_argument("--tables", default=",".join(TABLES))
+    parser.add_argument("--page", type=int, default=DEFAULT_PAGE)
+    parser.add_argument("--site", default=None)
+    parser.add_argument("--identifiers", action="store_true", help="include patient names and contacts")
+    args = parser.parse_args(argv)
+    from database.shards import use_site
+    tables = [t.strip() for t in args.tables.split(",") if t.strip()]
+    with use_site(args.site):
+        if args.out == "-":
+            result = export_jsonl(sys.stdout, args.since, args.page, tables, args.identifiers)
+        else:
+            with open(args.out, "a", encoding="utf-8") as out:
+                result = export_jsonl(out, args.since, args.page, tables, args.identifiers)
+    # the summary goes to stderr so stdout stays pure JSON lines
+    print(json.dumps(result), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,25 +3,170 @@ from pathlib import Path
 import hashlib
 import datetime
 import csv
-from typing import List, Dict
+import os
+import re
+import threading
+from typing import List, Dict, Optional, Sequence
+
+from database import shards
+from database.records import PatientRecord, LogRecord, LOG_COLUMNS, patient_columns
+from utils.passwords import hash_password
+from database.cache import cached
 
 # project root (two levels up from this file: src/database -> project root)
 BASE_DIR = Path(__file__).resolve().parents[2]
 DATA_DIR = BASE_DIR / "data"
-DB_PATH = DATA_DIR / "hospital.db"
+# HOSPITAL_DB_PATH lets tools (API server, load tests) point at another database file;
+# this is the primary site, other sites get their own files (database/shards.py)
+DB_PATH = Path(os.getenv("HOSPITAL_DB_PATH", DATA_DIR / "hospital.db"))
+# seconds a connection waits on a locked database before "database is locked"
+DB_TIMEOUT = float(os.getenv("HOSPITAL_DB_TIMEOUT", "5"))
+
+# schema creation runs once per database file per process, not on every connection.
+# _schema_lock only guards the set: it is never held while waiting for SQLite's write
+# lock, which a thread inside a UnitOfWork already holds when it asks for a schema
+_schema_lock = threading.Lock()
+_schema_ready = set()
 
-def _hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+# bump when anonymize_name/mask_contact/name_key/contact_key change so
+# repair_anonymization recomputes the derived columns of older rows
+ANON_VERSION = 2
 
-def get_db_connection():
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+def get_db_connection(site: Optional[str] = None):
+    # site defaults to the one pinned with shards.use_site(), else the primary
+    site = shards.resolve(site)
+    db_path = shards.shard_path(site)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=DB_TIMEOUT, check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    _ensure_tables(conn)
+    _register_functions(conn)
+    key = str(db_path.resolve())
+    if key not in _schema_ready:
+        # idempotent and serialized by its own write transaction; two threads racing
+        # here both run it, one after the other
+        _ensure_tables(conn, site)
+        with _schema_lock:
+            _schema_ready.add(key)
     return conn
 
-def _ensure_tables(conn):
+def ensure_schema(conn, name: str, create):
+    """
+    Run create(conn) once per database file per process. Subsystems that own
+    extra tables use this instead of re-running CREATE statements on every call.
+    """
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    key = f"{path}:{name}"
+    if key in _schema_ready:
+        return
+    # no lock held here: the creators only use CREATE ... IF NOT EXISTS and
+    # INSERT OR IGNORE, so threads and processes racing here all succeed, each
+    # statement waiting for SQLite's write lock only when it has something to write
+    if conn.in_transaction:
+        # inside a unit of work the DDL joins the open transaction instead
+        # of committing it halfway; a rollback forgets the mark (UnitOfWork)
+        create(_NoCommit(conn))
+    else:
+        create(conn)
+    with _schema_lock:
+        _schema_ready.add(key)
+
+class _NoCommit:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        pass
+
+
+class UnitOfWork:
+    """
+    One connection and one transaction for a group of writes and the audit
+    entries describing them, so a user action costs one commit and its audit
+    row cannot go missing:
+
+        with UnitOfWork() as uow:
+            patient_id = uow.execute("INSERT INTO patients ...", params).lastrowid
+            uow.log(user_id, role, "add_patient", f"patient_id={patient_id}", patient_id=patient_id)
+
+    The write lock is taken up front (BEGIN IMMEDIATE), so the transaction cannot
+    fail halfway with a lock upgrade error. Leaving the block commits; an
+    exception rolls everything back, audit entries included. Callbacks
+    registered with after_commit (e.g. in-memory index updates) run only after
+    a successful commit.
+    """
+
+    def __init__(self, site: Optional[str] = None):
+        self.site = shards.resolve(site)
+        self.conn = None
+        self.cur = None
+        self._after_commit = []
+
+    def __enter__(self) -> "UnitOfWork":
+        self.conn = get_db_connection(self.site)
+        self.conn.isolation_level = None
+        self.cur = self.conn.cursor()
+        self.cur.execute("BEGIN IMMEDIATE")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.cur.execute("COMMIT")
+            elif self.conn.in_transaction:
+                self.cur.execute("ROLLBACK")
+                _forget_schemas(self.conn)
+        finally:
+            self.conn.close()
+        if exc_type is None:
+            for callback in self._after_commit:
+                callback()
+        return False
+
+    def execute(self, sql: str, params: Sequence = ()):
+        return self.cur.execute(sql, params)
+
+    def executemany(self, sql: str, rows):
+        return self.cur.executemany(sql, rows)
+
+    def log(self, user_id, role, action, details="", patient_id=None) -> int:
+        return write_log(self.cur, user_id, role, action, details, patient_id)
+
+    def after_commit(self, callback):
+        self._after_commit.append(callback)
+
+def _forget_schemas(conn):
+    # subsystem tables created inside a rolled-back transaction are gone again
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    with _schema_lock:
+        _schema_ready.difference_update({k for k in _schema_ready if k.startswith(f"{path}:")})
+
+def _register_functions(conn):
+    # used by the anonymization triggers; connections that skip get_db_connection
+    # (e.g. the sqlite3 CLI) cannot insert into patients
+    conn.create_function("anonymize_name", 2, lambda name, pid: anonymize_name(name or "", pid), deterministic=True)
+    conn.create_function("mask_contact", 1, lambda contact: mask_contact(contact or ""), deterministic=True)
+    conn.create_function("name_key", 1, name_key, deterministic=True)
+    conn.create_function("contact_key", 1, contact_key, deterministic=True)
+    # used by the audit chain trigger, so rows inserted outside the app cannot be chained
+    conn.create_function("audit_digest", 1, details_digest, deterministic=True)
+    conn.create_function("audit_chain_hash", 7, chain_hash, deterministic=True)
+
+def _ensure_column(cur, table: str, column: str, definition: str):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [r[1] for r in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _ensure_tables(conn, site: str = shards.PRIMARY_SITE):
     cur = conn.cursor()
+    # persistent; readers no longer block writers, and online backups can copy
+    # from a stable snapshot (database/backup.py)
+    cur.execute("PRAGMA journal_mode=WAL")
+    # one transaction: worker processes starting together would otherwise interleave
+    # the DROP/CREATE TRIGGER pairs below and fail with "trigger already exists"
+    cur.execute("BEGIN IMMEDIATE")
     cur.execute("""
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -48,8 +193,230 @@ def _ensure_tables(conn):
         timestamp TEXT,
         details TEXT
     )""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS appointments (
+        appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_name TEXT,
+        date TEXT,
+        time TEXT,
+        status TEXT,
+        created_by INTEGER,
+        created_at TEXT
+    )""")
+    # home site of a staff account (database/shards.py); NULL is the primary
+    _ensure_column(cur, "users", "site", "TEXT")
+    _ensure_column(cur, "patients", "anon_version", "INTEGER NOT NULL DEFAULT 0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_patients_anon_version ON patients(anon_version)")
+    # blocking keys for duplicate detection (see database/dedup.py)
+    _ensure_column(cur, "patients", "name_key", "TEXT")
+    _ensure_column(cur, "patients", "contact_key", "TEXT")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_patients_name_key ON patients(name_key)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_patients_contact_key ON patients(contact_key)")
+    _ensure_anonymize_triggers(cur)
+    _ensure_column(cur, "appointments", "patient_id", "INTEGER")
+    _ensure_column(cur, "appointments", "provider_id", "INTEGER")
+    _ensure_column(cur, "appointments", "duration_minutes", "INTEGER NOT NULL DEFAULT 30")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_appointments_provider_date ON appointments(provider_id, date)")
+    # lookups that were full scans (see database/query_plans.py): exact-name search on
+    # the appointments page, retention cut-offs, per-user audit export, recent-activity counts
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_patients_name_lower ON patients(lower(name))")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_patients_date_added ON patients(date_added)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_logs_user ON logs(user_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)")
+    _ensure_subject_references(cur)
+    _ensure_audit_chain(cur)
+    _ensure_change_capture(cur)
+    _ensure_id_range(cur, shards.id_base(site))
+    # the query caches' version counters (database/cache.py) exist before any unit of
+    # work: a cached read inside one would otherwise wait on that unit's write lock
+    from database.cache import _create_version_tables
+    _create_version_tables(_NoCommit(conn))
     conn.commit()
-    _seed_users(conn)
+    if site == shards.PRIMARY_SITE:
+        # accounts are shared by all sites and live in the primary only
+        _seed_users(conn)
+
+# tables whose ids must be unique across shards (see database/shards.py)
+SHARDED_ID_TABLES = ("patients", "appointments", "logs")
+
+def _ensure_id_range(cur, base: int):
+    # start AUTOINCREMENT at the shard's range; never moves a sequence backwards
+    if not base:
+        return
+    for table in SHARDED_ID_TABLES:
+        cur.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, base))
+        elif row["seq"] < base:
+            cur.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (base, table))
+
+def next_id(table: str) -> str:
+    """
+    SQL for the next id of `table` from the site's own AUTOINCREMENT sequence.
+    AUTOINCREMENT alone continues after the largest id in the table, which is in
+    another site's range once a patient from that site was moved in
+    (database/rebalance.py). Without a sequence row yet (an empty table on the
+    primary) the expression is NULL and AUTOINCREMENT picks the id.
+    """
+    return f"(SELECT seq + 1 FROM sqlite_sequence WHERE name = '{table}')"
+
+def _table_exists(cur, kind: str, name: str) -> bool:
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?", (kind, name))
+    return cur.fetchone() is not None
+
+_LEGACY_SUBJECT_PATTERN = re.compile(r"\b(?:patient_id|pid)=(\d+)")
+
+def _ensure_subject_references(cur):
+    # Indexed patient references, so erasure can find a patient's appointments and
+    # audit entries without string-scanning appointments.patient_name or logs.details.
+    if not _table_exists(cur, "index", "idx_appointments_patient"):
+        cur.execute("CREATE INDEX idx_appointments_patient ON appointments(patient_id)")
+        # one-time link of legacy appointments that only stored an unambiguous name
+        cur.execute("""
+        UPDATE appointments SET patient_id = (
+            SELECT MIN(p.patient_id) FROM patients p WHERE p.name = appointments.patient_name
+            HAVING COUNT(*) = 1
+        ) WHERE patient_id IS NULL""")
+    if not _table_exists(cur, "table", "log_subjects"):
+        cur.execute("""
+        CREATE TABLE log_subjects (
+            patient_id INTEGER NOT NULL,
+            log_id INTEGER NOT NULL,
+            PRIMARY KEY (patient_id, log_id)
+        ) WITHOUT ROWID""")
+        # one-time backfill from the details strings written before this table existed
+        cur.execute("SELECT log_id, details FROM logs WHERE details LIKE '%id=%'")
+        cur.executemany(
+            "INSERT OR IGNORE INTO log_subjects (patient_id, log_id) VALUES (?,?)",
+            [(int(m.group(1)), r["log_id"]) for r in cur.fetchall()
+             for m in _LEGACY_SUBJECT_PATTERN.finditer(r["details"] or "")]
+        )
+
+def _ensure_anonymize_triggers(cur):
+    # pseudonyms and blocking keys are written in the same transaction as the
+    # insert/update that needs them; recreated on startup so the stamped version
+    # always matches ANON_VERSION
+    set_clause = f"""
+        UPDATE patients SET
+            anonymized_name = anonymize_name(NEW.name, NEW.patient_id),
+            anonymized_contact = mask_contact(NEW.contact),
+            name_key = name_key(NEW.name),
+            contact_key = contact_key(NEW.contact),
+            anon_version = {ANON_VERSION}
+        WHERE patient_id = NEW.patient_id;"""
+    cur.execute("DROP TRIGGER IF EXISTS trg_patients_anonymize_insert")
+    cur.execute(f"""
+    CREATE TRIGGER trg_patients_anonymize_insert AFTER INSERT ON patients
+    BEGIN{set_clause}
+    END""")
+    cur.execute("DROP TRIGGER IF EXISTS trg_patients_anonymize_update")
+    cur.execute(f"""
+    CREATE TRIGGER trg_patients_anonymize_update AFTER UPDATE OF name, contact ON patients
+    BEGIN{set_clause}
+    END""")
+
+GENESIS_HASH = "0" * 64
+
+def details_digest(details) -> str:
+    return hashlib.sha256((details or "").encode("utf-8")).hexdigest()
+
+def chain_hash(prev_hash, log_id, user_id, role, action, timestamp, details_hash) -> str:
+    """Hash of one audit entry; details enter via their digest so they can be redacted later."""
+    fields = (prev_hash, log_id, user_id, role, action, timestamp, details_hash)
+    return hashlib.sha256("\x1f".join("" if v is None else str(v) for v in fields).encode("utf-8")).hexdigest()
+
+def _ensure_audit_chain(cur):
+    # Every log row stores the hash of its predecessor and its own hash
+    # (see database/audit.py). The trigger fills them inside the inserting
+    # statement, which holds the write lock, so concurrent writers cannot fork the chain.
+    cur.execute("PRAGMA table_info(logs)")
+    migrate = "entry_hash" not in [r[1] for r in cur.fetchall()]
+    _ensure_column(cur, "logs", "details_hash", "TEXT")
+    _ensure_column(cur, "logs", "prev_hash", "TEXT")
+    _ensure_column(cur, "logs", "entry_hash", "TEXT")
+    if migrate:
+        prev = GENESIS_HASH
+        cur.execute("SELECT log_id, user_id, role, action, timestamp, details FROM logs ORDER BY log_id")
+        updates = []
+        for r in cur.fetchall():
+            digest = details_digest(r["details"])
+            entry = chain_hash(prev, r["log_id"], r["user_id"], r["role"], r["action"], r["timestamp"], digest)
+            updates.append((digest, prev, entry, r["log_id"]))
+            prev = entry
+        cur.executemany("UPDATE logs SET details_hash = ?, prev_hash = ?, entry_hash = ? WHERE log_id = ?", updates)
+    previous = f"""COALESCE((SELECT entry_hash FROM logs WHERE log_id < NEW.log_id ORDER BY log_id DESC LIMIT 1),
+                            '{GENESIS_HASH}')"""
+    cur.execute("DROP TRIGGER IF EXISTS trg_logs_chain")
+    cur.execute(f"""
+    CREATE TRIGGER trg_logs_chain AFTER INSERT ON logs
+    BEGIN
+        UPDATE logs SET
+            details_hash = audit_digest(NEW.details),
+            prev_hash = {previous},
+            entry_hash = audit_chain_hash({previous}, NEW.log_id, NEW.user_id, NEW.role,
+                                          NEW.action, NEW.timestamp, audit_digest(NEW.details))
+        WHERE log_id = NEW.log_id;
+    END""")
+
+# Change capture (read through database/changes.py). Columns whose change is
+# recorded; the derived pseudonym columns are not, except when anon_version moves
+# a row to a newer anonymization scheme.
+CHANGE_TRACKED_COLUMNS = {
+    "patients": ("name", "contact", "diagnosis", "date_added"),
+    "appointments": ("patient_id", "patient_name", "provider_id", "date", "time", "duration_minutes", "status"),
+}
+_CHANGE_KEYS = {"patients": "patient_id", "appointments": "appointment_id"}
+_NOW_SQL = "strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+
+def _ensure_change_capture(cur):
+    # Every insert, update and delete of a patient or appointment appends to
+    # `changes` in the same statement, and stamps the row with its change_seq and
+    # updated_at, so incremental sync reads only what changed. The first run
+    # records every existing row as an insert, so a feed read from token 0 is a
+    # complete copy.
+    backfill = not _table_exists(cur, "table", "changes")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS changes (
+        change_seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        changed_at TEXT NOT NULL
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_changes_row ON changes(table_name, row_id)")
+    for table, key in _CHANGE_KEYS.items():
+        _ensure_column(cur, table, "change_seq", "INTEGER")
+        _ensure_column(cur, table, "updated_at", "TEXT")
+        if backfill:
+            cur.execute(f"INSERT INTO changes (table_name, row_id, op, changed_at) "
+                        f"SELECT '{table}', {key}, 'insert', {_NOW_SQL} FROM {table} ORDER BY {key}")
+            cur.execute(f"""
+            UPDATE {table} SET updated_at = {_NOW_SQL}, change_seq = (
+                SELECT MAX(change_seq) FROM changes WHERE table_name = '{table}' AND row_id = {table}.{key}
+            )""")
+
+        stamp = f"""
+            INSERT INTO changes (table_name, row_id, op, changed_at) VALUES ('{table}', NEW.{key}, {{op}}, {_NOW_SQL});
+            UPDATE {table} SET change_seq = last_insert_rowid(), updated_at = {_NOW_SQL} WHERE {key} = NEW.{key};"""
+        columns = CHANGE_TRACKED_COLUMNS[table]
+        changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in columns)
+        op = "'update'"
+        watched = columns
+        if table == "patients":
+            # pseudonyms refreshed under a newer ANON_VERSION (not the first fill after an insert)
+            changed += " OR (OLD.anon_version > 0 AND OLD.anon_version != NEW.anon_version)"
+            unchanged = " AND ".join(f"OLD.{c} IS NEW.{c}" for c in columns)
+            op = f"CASE WHEN {unchanged} THEN 'anonymize' ELSE 'update' END"
+            watched = columns + ("anon_version",)
+        for event, body in (
+            ("insert", f"AFTER INSERT ON {table} BEGIN{stamp.format(op=repr('insert'))}"),
+            ("update", f"AFTER UPDATE OF {', '.join(watched)} ON {table} WHEN {changed} BEGIN{stamp.format(op=op)}"),
+            ("delete", f"AFTER DELETE ON {table} BEGIN INSERT INTO changes (table_name, row_id, op, changed_at) "
+                       f"VALUES ('{table}', OLD.{key}, 'delete', {_NOW_SQL});"),
+        ):
+            cur.execute(f"DROP TRIGGER IF EXISTS trg_{table}_changes_{event}")
+            cur.execute(f"CREATE TRIGGER trg_{table}_changes_{event} {body}\n    END")
 
 def _seed_users(conn):
     cur = conn.cursor()
@@ -64,23 +431,44 @@ def _seed_users(conn):
         for username, pwd, role in users:
             cur.execute(
                 "INSERT OR IGNORE INTO users (username, password_hash, role) VALUES (?,?,?)",
-                (username, _hash_password(pwd), role)
+                (username, hash_password(pwd), role)
             )
         conn.commit()
 
-def log_action(user_id, role, action, details=""):
+def write_log(cur, user_id, role, action, details="", patient_id=None) -> int:
+    # insert an audit row on the caller's cursor; patient_id is recorded in
+    # log_subjects so erasure can locate the entry through an index
+    timestamp = datetime.datetime.utcnow().isoformat()
+    cur.execute(
+        "INSERT INTO logs (user_id, role, action, timestamp, details) VALUES (?,?,?,?,?)",
+        (user_id, role, action, timestamp, details)
+    )
+    log_id = cur.lastrowid
+    if patient_id is not None:
+        cur.execute("INSERT OR IGNORE INTO log_subjects (patient_id, log_id) VALUES (?,?)", (patient_id, log_id))
+    return log_id
+
+# audit entries dropped by log_action since process start (e.g. lock timeouts)
+_log_failures = 0
+_log_failures_lock = threading.Lock()
+
+def log_failure_count() -> int:
+    return _log_failures
+
+def note_log_failure():
+    global _log_failures
+    with _log_failures_lock:
+        _log_failures += 1
+
+def log_action(user_id, role, action, details="", patient_id=None):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        timestamp = datetime.datetime.utcnow().isoformat()
-        cur.execute(
-            "INSERT INTO logs (user_id, role, action, timestamp, details) VALUES (?,?,?,?,?)",
-            (user_id, role, action, timestamp, details)
-        )
+        write_log(cur, user_id, role, action, details, patient_id)
         conn.commit()
         conn.close()
     except Exception:
-        pass  # keep UI stable on logging errors
+        note_log_failure()  # keep UI stable on logging errors, but keep count
 
 # Patient helpers
 
@@ -97,46 +485,154 @@ def anonymize_name(name: str, patient_id: int) -> str:
     h = hashlib.sha256(f"{patient_id}:{name}".encode("utf-8")).hexdigest()
     return f"ANON_{h[:8]}"
 
-def add_patient(name: str, contact: str, diagnosis: str, added_by_user_id=None, role=None) -> int:
+_SOUNDEX_CODES = {c: d for d, letters in (("1", "BFPV"), ("2", "CGJKQSXZ"), ("3", "DT"),
+                                          ("4", "L"), ("5", "MN"), ("6", "R")) for c in letters}
+
+def soundex(word: str) -> str:
+    letters = [c for c in (word or "").upper() if "A" <= c <= "Z"]
+    if not letters:
+        return ""
+    code, prev = letters[0], _SOUNDEX_CODES.get(letters[0], "")
+    for c in letters[1:]:
+        digit = _SOUNDEX_CODES.get(c, "")
+        if digit and digit != prev:
+            code += digit
+            if len(code) == 4:
+                break
+        if c not in "HW":
+            prev = digit
+    return code.ljust(4, "0")
+
+def name_key(name: str) -> Optional[str]:
+    # phonetic surname code + first initial, e.g. "Jon Smyth" -> "S530J"
+    tokens = [t for t in "".join(c if c.isalpha() else " " for c in (name or "")).split() if soundex(t)]
+    if not tokens:
+        return None
+    key = soundex(tokens[-1])
+    if len(tokens) > 1:
+        key += soundex(tokens[0])[0]
+    return key
+
+def contact_key(contact: str) -> Optional[str]:
+    digits = "".join(c for c in (contact or "") if c.isdigit())
+    return digits[-4:] if len(digits) >= 4 else None
+
+def _derived_columns(patient_id: int, name: str, contact: str) -> tuple:
+    # same values the anonymization trigger writes, in UPDATE column order
+    return (anonymize_name(name or "", patient_id), mask_contact(contact or ""),
+            name_key(name), contact_key(contact), ANON_VERSION)
+
+_DERIVED_SET = "anonymized_name = ?, anonymized_contact = ?, name_key = ?, contact_key = ?, anon_version = ?"
+
+def add_patient(name: str, contact: str, diagnosis: str, added_by_user_id=None, role=None,
+                uow: Optional[UnitOfWork] = None) -> int:
+    # pass uow to make the insert part of a larger unit of work
+    if uow is None:
+        with UnitOfWork() as own:
+            return add_patient(name, contact, diagnosis, added_by_user_id, role, own)
+    from database.dedup import flag_duplicates
+    patient_id = uow.execute(
+        f"INSERT INTO patients (patient_id, name, contact, diagnosis, date_added) VALUES ({next_id('patients')},?,?,?,?)",
+        (name, contact, diagnosis, datetime.datetime.utcnow().isoformat())
+    ).lastrowid
+    flag_duplicates(uow.conn, patient_id, name, contact)
+    uow.log(added_by_user_id, role, "add_patient", f"patient_id={patient_id}", patient_id=patient_id)
+    return patient_id
+
+def import_patients(records: List[Dict], added_by_user_id=None, role=None) -> int:
+    """
+    Insert many patients in one transaction; the anonymization trigger fills the
+    pseudonyms as part of the same transaction.
+    """
+    timestamp = datetime.datetime.utcnow().isoformat()
+    with UnitOfWork() as uow:
+        uow.executemany(
+            f"INSERT INTO patients (patient_id, name, contact, diagnosis, date_added) VALUES ({next_id('patients')},?,?,?,?)",
+            [(r.get("name"), r.get("contact"), r.get("diagnosis"), r.get("date_added") or timestamp) for r in records]
+        )
+        uow.log(added_by_user_id, role, "import_patients", f"imported {len(records)} patients")
+    return len(records)
+
+def import_patients_csv(path: str, added_by_user_id=None, role=None) -> int:
+    with open(path, newline="", encoding="utf-8") as f:
+        records = list(csv.DictReader(f))
+    return import_patients(records, added_by_user_id=added_by_user_id, role=role)
+
+@cached("patients", copy=list)
+def get_patients(role: Optional[str] = None, columns: Optional[Sequence[str]] = None) -> List[PatientRecord]:
+    # only the columns the role may see are selected (see utils.rbac / database.records);
+    # cached per site until patients change in any process (database/cache.py), records are shared
+    cols = patient_columns(role, columns)
     conn = get_db_connection()
     cur = conn.cursor()
-    timestamp = datetime.datetime.utcnow().isoformat()
-    cur.execute(
-        "INSERT INTO patients (name, contact, diagnosis, date_added) VALUES (?,?,?,?)",
-        (name, contact, diagnosis, timestamp)
-    )
-    patient_id = cur.lastrowid
-    conn.commit()
+    cur.row_factory = None  # plain tuples; PatientRecord stores them in slots
+    cur.execute(f"SELECT {', '.join(cols)} FROM patients ORDER BY patient_id DESC")
+    rows = cur.fetchall()
     conn.close()
-    log_action(added_by_user_id, role, "add_patient", f"patient_id={patient_id}")
-    return patient_id
+    return PatientRecord.from_rows(rows, cols)
 
-def get_patients() -> List[Dict]:
+def get_patient(patient_id: int, role: Optional[str] = None) -> Optional[PatientRecord]:
+    cols = patient_columns(role)
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM patients ORDER BY patient_id DESC")
-    rows = cur.fetchall()
+    cur.row_factory = None
+    cur.execute(f"SELECT {', '.join(cols)} FROM patients WHERE patient_id = ?", (patient_id,))
+    row = cur.fetchone()
     conn.close()
-    return [dict(r) for r in rows]
+    return PatientRecord.from_row(row, cols) if row else None
 
-def anonymize_all_patients(triggered_by_user_id=None, role=None):
+@cached("patients", copy=dict)
+def count_patients() -> Dict[str, int]:
+    # totals for summaries and reports, without loading the rows
+    conn = get_db_connection()
+    row = conn.execute("SELECT COUNT(*) AS total, COUNT(anonymized_name) AS anonymized FROM patients").fetchone()
+    conn.close()
+    return {"total": row["total"], "anonymized": row["anonymized"]}
+
+def anonymize_patient(patient_id: int, uow: Optional[UnitOfWork] = None) -> bool:
+    if uow is None:
+        with UnitOfWork() as own:
+            return anonymize_patient(patient_id, own)
+    row = uow.execute("SELECT name, contact FROM patients WHERE patient_id = ?", (patient_id,)).fetchone()
+    if not row:
+        return False
+    uow.execute(
+        f"UPDATE patients SET {_DERIVED_SET} WHERE patient_id = ?",
+        (*_derived_columns(patient_id, row["name"], row["contact"]), patient_id)
+    )
+    return True
+
+def repair_anonymization(batch_size: int = 500) -> int:
+    """
+    Recompute pseudonyms for rows that are missing them or were stamped by an older
+    ANON_VERSION. Walks idx_patients_anon_version, so the cost is proportional to the
+    number of stale rows rather than the table size. Commits per batch.
+    """
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT patient_id, name, contact FROM patients")
-    rows = cur.fetchall()
-    for r in rows:
-        pid = r["patient_id"]
-        name = r["name"] or ""
-        contact = r["contact"] or ""
-        anon_name = anonymize_name(name, pid)
-        anon_contact = mask_contact(contact)
+    repaired = 0
+    while True:
         cur.execute(
-            "UPDATE patients SET anonymized_name = ?, anonymized_contact = ? WHERE patient_id = ?",
-            (anon_name, anon_contact, pid)
+            "SELECT patient_id, name, contact FROM patients WHERE anon_version < ? LIMIT ?",
+            (ANON_VERSION, batch_size)
         )
-    conn.commit()
+        rows = cur.fetchall()
+        if not rows:
+            break
+        cur.executemany(
+            f"UPDATE patients SET {_DERIVED_SET} WHERE patient_id = ?",
+            [(*_derived_columns(r["patient_id"], r["name"], r["contact"]), r["patient_id"]) for r in rows]
+        )
+        conn.commit()
+        repaired += len(rows)
     conn.close()
-    log_action(triggered_by_user_id, role, "anonymize_all", "anonymized all patients")
+    return repaired
+
+def anonymize_all_patients(triggered_by_user_id=None, role=None):
+    # new and edited rows are anonymized by trigger; this only has to catch stale ones
+    repaired = repair_anonymization()
+    log_action(triggered_by_user_id, role, "anonymize_all", f"anonymized all patients ({repaired} repaired)")
+    return repaired
 
 def export_patients_csv(path: str) -> str:
     rows = get_patients()
@@ -146,4 +642,58 @@ def export_patients_csv(path: str) -> str:
         writer.writeheader()
         for r in rows:
             writer.writerow({k: r.get(k, "") for k in fieldnames})
-    return str(path)
\ No newline at end of file
+    return str(path)
+
+# Staff helpers
+
+@cached("users", site=shards.PRIMARY_SITE, copy=list)
+def get_staff() -> List[Dict]:
+    # user accounts double as the staff registry (shared by all sites)
+    conn = get_db_connection(shards.PRIMARY_SITE)
+    rows = conn.execute("SELECT user_id, username, role, site FROM users ORDER BY role, username").fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+# Appointment helpers
+
+def get_appointments() -> List[Dict]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT appointment_id, patient_id, patient_name, provider_id, date, time, duration_minutes, status "
+        "FROM appointments ORDER BY appointment_id DESC"
+    )
+    rows = cur.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def add_appointment(patient_name: str, date: str, time: str, status: str, created_by=None,
+                    patient_id=None, provider_id=None, duration_minutes: int = 30,
+                    uow: Optional[UnitOfWork] = None) -> int:
+    # no overlap checking here; use database.scheduling.book_appointment for provider slots.
+    # pass uow to make the insert part of a larger unit of work
+    if uow is None:
+        with UnitOfWork() as own:
+            return add_appointment(patient_name, date, time, status, created_by, patient_id, provider_id,
+                                   duration_minutes, own)
+    return uow.execute(
+        "INSERT INTO appointments (appointment_id, patient_name, date, time, status, created_by, created_at, patient_id, "
+        f"provider_id, duration_minutes) VALUES ({next_id('appointments')},?,?,?,?,?,?,?,?,?)",
+        (patient_name, date, time, status, created_by, datetime.datetime.utcnow().isoformat(), patient_id, provider_id,
+         duration_minutes)
+    ).lastrowid
+
+# Audit log helpers
+
+def get_logs(limit: int = 200, user_id: Optional[int] = None) -> List[LogRecord]:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.row_factory = None
+    select = f"SELECT {', '.join(LOG_COLUMNS)} FROM logs"
+    if user_id is not None:
+        cur.execute(select + " WHERE user_id = ? ORDER BY log_id DESC LIMIT ?", (user_id, limit))
+    else:
+        cur.execute(select + " ORDER BY log_id DESC LIMIT ?", (limit,))
+    rows = cur.fetchall()
+    conn.close()
+    return LogRecord.from_rows(rows, LOG_COLUMNS)
@@ -0,0 +1,264 @@
+"""
+Duplicate-patient detection.
+
+Every patient row carries two blocking keys written by the anonymization
+trigger in database.connection: name_key (Soundex of the surname plus first
+initial) and contact_key (last four contact digits), both indexed. Candidate
+lookups only read rows that share a key, so checking a new patient costs a
+bounded number of comparisons, and the batch scan compares rows within blocks
+instead of all pairs.
+"""
+import datetime
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+from database.connection import get_db_connection, ensure_schema, name_key, contact_key
+
+MAX_CANDIDATES = 50       # rows fetched per blocking key when checking one patient
+DUPLICATE_THRESHOLD = 0.8
+MAX_BLOCK_SIZE = 200      # larger blocks fall back to a sorted-neighbourhood window
+NEIGHBOURHOOD_WINDOW = 20
+FLAG_WRITE_BATCH = 500    # scan flags stored per short write transaction
+
+
+def _create_dedup_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS duplicate_flags (
+        patient_id INTEGER NOT NULL,
+        candidate_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        source TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'open',
+        flagged_at TEXT,
+        PRIMARY KEY (patient_id, candidate_id)
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_duplicate_flags_candidate ON duplicate_flags(candidate_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_duplicate_flags_status ON duplicate_flags(status)")
+    conn.commit()
+
+def _connect():
+    conn = get_db_connection()
+    ensure_schema(conn, "dedup", _create_dedup_tables)
+    return conn
+
+def _normalize_name(name: str) -> str:
+    tokens = "".join(c.lower() if c.isalpha() else " " for c in (name or "")).split()
+    return " ".join(sorted(tokens))
+
+def _digits(contact: str) -> str:
+    return "".join(c for c in (contact or "") if c.isdigit())
+
+def _contact_similarity(da: str, db: str) -> float:
+    if da and da == db:
+        return 1.0
+    if len(da) >= 4 and da[-4:] == db[-4:]:
+        return 0.5
+    return 0.0
+
+def _combined_score(na: str, da: str, nb: str, db: str, threshold: float = 0.0) -> Optional[float]:
+    # na/nb are normalized names, da/db contact digits. Returns None as soon as the
+    # threshold is out of reach, using the cheap contact term and difflib's upper bounds.
+    contact_sim = _contact_similarity(da, db)
+    needed = (threshold - 0.3 * contact_sim) / 0.7
+    if needed > 1.0 or not (na and nb):
+        return None if threshold > 0.3 * contact_sim else round(0.3 * contact_sim, 3)
+    matcher = SequenceMatcher(None, na, nb)
+    if matcher.real_quick_ratio() < needed or matcher.quick_ratio() < needed:
+        return None
+    score = round(0.7 * matcher.ratio() + 0.3 * contact_sim, 3)
+    return score if score >= threshold else None
+
+def match_score(name_a: str, contact_a: str, name_b: str, contact_b: str) -> float:
+    """
+    Similarity in [0, 1]: 70% normalized-name similarity, 30% contact agreement
+    (full digit match counts fully, matching last four digits counts half).
+    A name match alone stays below DUPLICATE_THRESHOLD; some contact agreement is required.
+    """
+    return _combined_score(_normalize_name(name_a), _digits(contact_a), _normalize_name(name_b), _digits(contact_b))
+
+def _candidate_rows(cur, name: str, contact: str, exclude_id: Optional[int], limit: int) -> List:
+    nk, ck = name_key(name), contact_key(contact)
+    rows = {}
+    for column, key in (("name_key", nk), ("contact_key", ck)):
+        if not key:
+            continue
+        cur.execute(
+            f"SELECT patient_id, name, contact FROM patients WHERE {column} = ? AND patient_id != ? "
+            "ORDER BY patient_id DESC LIMIT ?",
+            (key, exclude_id or -1, limit)
+        )
+        for r in cur.fetchall():
+            rows[r["patient_id"]] = r
+    return list(rows.values())
+
+def find_duplicate_candidates(name: str, contact: str, exclude_id: Optional[int] = None,
+                              threshold: float = DUPLICATE_THRESHOLD, limit: int = MAX_CANDIDATES) -> List[Dict]:
+    """
+    Existing patients that probably are the same person, best match first.
+    At most `limit` rows per blocking key are compared.
+    """
+    conn = _connect()
+    cur = conn.cursor()
+    matches = _score_candidates(_candidate_rows(cur, name, contact, exclude_id, limit), name, contact, threshold)
+    conn.close()
+    return matches
+
+def _score_candidates(rows, name, contact, threshold) -> List[Dict]:
+    matches = []
+    na, da = _normalize_name(name), _digits(contact)
+    for r in rows:
+        score = _combined_score(na, da, _normalize_name(r["name"]), _digits(r["contact"]), threshold)
+        if score is not None:
+            matches.append({"patient_id": r["patient_id"], "name": r["name"], "score": score})
+    return sorted(matches, key=lambda m: -m["score"])
+
+def flag_duplicates(conn, patient_id: int, name: str, contact: str) -> List[Dict]:
+    """
+    Record probable duplicates of a just-inserted patient. Runs on the caller's
+    connection so the flags commit together with the insert.
+    """
+    ensure_schema(conn, "dedup", _create_dedup_tables)
+    cur = conn.cursor()
+    matches = _score_candidates(_candidate_rows(cur, name, contact, patient_id, MAX_CANDIDATES),
+                                name, contact, DUPLICATE_THRESHOLD)
+    now = datetime.datetime.utcnow().isoformat()
+    cur.executemany(
+        "INSERT OR IGNORE INTO duplicate_flags (patient_id, candidate_id, score, source, flagged_at) VALUES (?,?,?,?,?)",
+        [(patient_id, m["patient_id"], m["score"], "insert", now) for m in matches]
+    )
+    return matches
+
+def search_patients_by_name(query: str, limit: int = 10, min_similarity: float = 0.6) -> List[Dict]:
+    """
+    Phonetic name lookup for forms: reads only the query's name_key block
+    instead of a LIKE '%...%' scan over every patient.
+    """
+    key = name_key(query)
+    if not key:
+        return []
+    conn = _connect()
+    rows = conn.execute(
+        "SELECT patient_id, name FROM patients WHERE name_key = ? ORDER BY patient_id DESC LIMIT ?",
+        (key, MAX_CANDIDATES)
+    ).fetchall()
+    conn.close()
+    target = _normalize_name(query)
+    scored = []
+    for r in rows:
+        similarity = SequenceMatcher(None, target, _normalize_name(r["name"])).ratio()
+        if similarity >= min_similarity:
+            scored.append({"patient_id": r["patient_id"], "name": r["name"], "similarity": round(similarity, 3)})
+    return sorted(scored, key=lambda m: -m["similarity"])[:limit]
+
+def get_duplicate_flags(patient_id: Optional[int] = None, status: str = "open", limit: int = 100) -> List[Dict]:
+    conn = _connect()
+    if patient_id is not None:
+        # "+status" keeps the planner off the low-selectivity status index, so both
+        # sides of the OR are keyed lookups (database/query_plans.py)
+        rows = conn.execute(
+            "SELECT * FROM duplicate_flags WHERE (patient_id = ? OR candidate_id = ?) AND +status = ? "
+            "ORDER BY score DESC LIMIT ?",
+            (patient_id, patient_id, status, limit)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT * FROM duplicate_flags WHERE status = ? ORDER BY flagged_at DESC LIMIT ?", (status, limit)
+        ).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def set_flag_status(patient_id: int, candidate_id: int, status: str) -> bool:
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE duplicate_flags SET status = ? WHERE patient_id = ? AND candidate_id = ?",
+        (status, patient_id, candidate_id)
+    )
+    conn.commit()
+    conn.close()
+    return cur.rowcount == 1
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        root = self.parent.setdefault(x, x)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while x != root:  # path compression
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def _block_pairs(block: List):
+    if len(block) <= MAX_BLOCK_SIZE:
+        for i in range(len(block)):
+            for j in range(i + 1, len(block)):
+                yield block[i], block[j]
+    else:
+        ordered = sorted(block, key=lambda r: r[1])
+        for i in range(len(ordered)):
+            for j in range(i + 1, min(i + 1 + NEIGHBOURHOOD_WINDOW, len(ordered))):
+                yield ordered[i], ordered[j]
+
+def _store_scan_flags(conn, flags: List[Tuple]):
+    # after the read is done, in short transactions: add_patient and the API can write in between
+    for start in range(0, len(flags), FLAG_WRITE_BATCH):
+        conn.executemany(
+            "INSERT OR IGNORE INTO duplicate_flags (patient_id, candidate_id, score, source, flagged_at) VALUES (?,?,?,?,?)",
+            flags[start:start + FLAG_WRITE_BATCH]
+        )
+        conn.commit()
+
+def find_duplicate_clusters(threshold: float = DUPLICATE_THRESHOLD, progress=None) -> List[List[int]]:
+    """
+    Batch scan of the whole registry. Rows are streamed in blocking-key order and
+    only compared within a block, so the work is O(n * block size) rather than
+    O(n^2). Probable pairs are stored as 'scan' flags and merged into clusters.
+    The scan only reads; each pass stores its flags when it is done.
+    """
+    conn = _connect()
+    read = conn.cursor()
+    uf = _UnionFind()
+    compared = set()
+    now = datetime.datetime.utcnow().isoformat()
+    for step, column in enumerate(("name_key", "contact_key")):
+        read.execute(f"SELECT patient_id, name, contact, {column} AS k FROM patients WHERE {column} IS NOT NULL ORDER BY {column}")
+        block, block_key = [], None
+        flags = []
+        while True:
+            rows = read.fetchmany(1000)
+            for r in rows + ([None] if not rows else []):
+                if r is not None and r["k"] == block_key:
+                    block.append((r["patient_id"], _normalize_name(r["name"]), _digits(r["contact"])))
+                    continue
+                for a, b in _block_pairs(block):
+                    pair = (min(a[0], b[0]), max(a[0], b[0]))
+                    if pair in compared:
+                        continue
+                    compared.add(pair)
+                    score = _combined_score(a[1], a[2], b[1], b[2], threshold)
+                    if score is not None:
+                        uf.union(*pair)
+                        flags.append((pair[1], pair[0], score, "scan", now))
+                if r is not None:
+                    block, block_key = [(r["patient_id"], _normalize_name(r["name"]), _digits(r["contact"]))], r["k"]
+            if not rows:
+                break
+        _store_scan_flags(conn, flags)
+        if progress:
+            progress((step + 1) / 2, f"scanned {column} blocks")
+    conn.close()
+
+    clusters = {}
+    for pid in list(uf.parent):
+        clusters.setdefault(uf.find(pid), []).append(pid)
+    return sorted((sorted(c) for c in clusters.values() if len(c) > 1), key=lambda c: c[0])
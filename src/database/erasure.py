@@ -0,0 +1,201 @@
+"""
+Cascading erasure for GDPR Article 17 requests.
+
+A patient is referenced from appointments (appointments.patient_id) and from
+audit entries (log_subjects, written by connection.write_log), both indexed, so
+erasing a subject is a handful of keyed deletes rather than scans over
+patient_name or logs.details. Audit rows themselves are kept for accountability
+but their details are redacted; coalesced access sessions (access_log.py) and
+clinical notes are deleted, and note content no other record shares is removed
+from the blob store right after the commit. A batch of subjects is erased in one write
+transaction, and every subject gets a receipt stored in erasure_receipts.
+
+With site shards, erase_patients_everywhere() also reaches the shards a patient
+was moved away from, where their earlier audit entries stay.
+"""
+import datetime
+import hashlib
+import json
+from typing import Dict, Iterable, List, Optional
+
+from database import shards
+from database.connection import get_db_connection, ensure_schema, UnitOfWork
+from database.blobs import collect_garbage
+from database.notes import drop_patient_notes
+
+REDACTED_DETAILS = "[erased]"
+
+
+def _create_erasure_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS erasure_receipts (
+        receipt_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER NOT NULL,
+        requested_by INTEGER,
+        erased_at TEXT NOT NULL,
+        counts TEXT NOT NULL,
+        receipt_hash TEXT NOT NULL
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_erasure_receipts_patient ON erasure_receipts(patient_id)")
+    conn.commit()
+
+def _connect():
+    conn = get_db_connection()
+    ensure_schema(conn, "erasure", _create_erasure_tables)
+    return conn
+
+def _has_table(cur, name: str) -> bool:
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cur.fetchone() is not None
+
+def _erase_one(cur, patient_id: int, has_flags: bool, has_sessions: bool, has_notes: bool) -> Dict:
+    counts = {}
+    cur.execute("SELECT 1 FROM patients WHERE patient_id = ?", (patient_id,))
+    found = cur.fetchone() is not None
+
+    cur.execute(
+        "SELECT appointment_id, provider_id, date FROM appointments WHERE patient_id = ?", (patient_id,)
+    )
+    appointments = [tuple(r) for r in cur.fetchall()]
+    cur.execute("DELETE FROM appointments WHERE patient_id = ?", (patient_id,))
+    counts["appointments"] = cur.rowcount
+
+    cur.execute(
+        "UPDATE logs SET details = ? WHERE log_id IN (SELECT log_id FROM log_subjects WHERE patient_id = ?)",
+        (REDACTED_DETAILS, patient_id)
+    )
+    counts["log_entries_redacted"] = cur.rowcount
+    cur.execute("DELETE FROM log_subjects WHERE patient_id = ?", (patient_id,))
+
+    counts["access_sessions"] = 0
+    if has_sessions:
+        cur.execute("DELETE FROM access_sessions WHERE patient_id = ?", (patient_id,))
+        counts["access_sessions"] = cur.rowcount
+
+    counts["clinical_notes"], released = 0, []
+    if has_notes:
+        counts["clinical_notes"], released = drop_patient_notes(cur, [patient_id])
+
+    counts["duplicate_flags"] = 0
+    if has_flags:
+        cur.execute("DELETE FROM duplicate_flags WHERE patient_id = ? OR candidate_id = ?", (patient_id, patient_id))
+        counts["duplicate_flags"] = cur.rowcount
+
+    cur.execute("DELETE FROM patients WHERE patient_id = ?", (patient_id,))
+    counts["patients"] = cur.rowcount
+    return {"patient_id": patient_id, "found": found, "counts": counts, "_appointments": appointments,
+            "_blobs": released}
+
+def _receipt_hash(receipt: Dict) -> str:
+    body = {k: receipt[k] for k in ("patient_id", "found", "counts", "erased_at", "requested_by")}
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+
+def erase_patients(patient_ids: Iterable[int], requested_by: Optional[int] = None,
+                   role: Optional[str] = None, uow: Optional[UnitOfWork] = None) -> List[Dict]:
+    """
+    Erase each patient and everything that references them, in a single transaction
+    (the caller's unit of work, if given). Returns one receipt per requested id (in
+    request order, duplicates collapsed); ids that no longer exist still get a
+    receipt with found=False.
+    """
+    ids = list(dict.fromkeys(int(pid) for pid in patient_ids))
+    if not ids:
+        return []
+    if uow is None:
+        with UnitOfWork() as own:
+            return erase_patients(ids, requested_by, role, own)
+    ensure_schema(uow.conn, "erasure", _create_erasure_tables)
+    erased_at = datetime.datetime.utcnow().isoformat()
+    cur = uow.cur
+    has_flags = _has_table(cur, "duplicate_flags")
+    has_sessions = _has_table(cur, "access_sessions")
+    has_notes = _has_table(cur, "clinical_notes")
+    receipts, appointments, released = [], [], []
+    for pid in ids:
+        receipt = _erase_one(cur, pid, has_flags, has_sessions, has_notes)
+        appointments.extend(receipt.pop("_appointments"))
+        released.extend(receipt.pop("_blobs"))
+        receipt.update(erased_at=erased_at, requested_by=requested_by)
+        receipt["receipt_hash"] = _receipt_hash(receipt)
+        receipt["receipt_id"] = uow.execute(
+            "INSERT INTO erasure_receipts (patient_id, requested_by, erased_at, counts, receipt_hash) VALUES (?,?,?,?,?)",
+            (pid, requested_by, erased_at, json.dumps(receipt["counts"], sort_keys=True), receipt["receipt_hash"])
+        ).lastrowid
+        # deliberately not linked through log_subjects: this entry must survive later erasures;
+        # written for scheduled purges too (no user, role "system")
+        uow.log(requested_by, role or "system", "right_to_be_forgotten",
+                f"erasure receipt {receipt['receipt_id']} per GDPR Article 17")
+        receipts.append(receipt)
+    uow.after_commit(lambda: _drop_from_availability_index(uow.site, appointments))
+    if released:
+        # note content must not outlive the erasure: remove unreferenced blob files right away
+        uow.after_commit(lambda: collect_garbage(released, site=uow.site))
+    return receipts
+
+def _referenced_ids(conn, ids: List[int]) -> List[int]:
+    found = set()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        found.update(r[0] for r in conn.execute(
+            f"SELECT patient_id FROM patients WHERE patient_id IN ({marks}) "
+            f"UNION SELECT patient_id FROM appointments WHERE patient_id IN ({marks}) "
+            f"UNION SELECT patient_id FROM log_subjects WHERE patient_id IN ({marks})",
+            chunk * 3
+        ))
+    return [pid for pid in ids if pid in found]
+
+def erase_patients_everywhere(patient_ids: Iterable[int], requested_by: Optional[int] = None,
+                              role: Optional[str] = None, uow: Optional[UnitOfWork] = None) -> List[Dict]:
+    """
+    erase_patients on the current site (in the caller's unit of work, if given)
+    and, in parallel, on every other shard that still references the patients.
+    Other shards commit on their own, so a rollback of the caller's unit of work
+    leaves them erased; erasure is idempotent and can simply be repeated. Each
+    shard stores its own receipts; the returned receipts (one per patient, from
+    the current site) carry counts summed over all sites and the list of sites.
+    """
+    ids = list(dict.fromkeys(int(pid) for pid in patient_ids))
+    if not ids or not shards.is_sharded():
+        return erase_patients(ids, requested_by, role, uow)
+    home = uow.site if uow is not None else shards.resolve()
+
+    def erase_on(site):
+        conn = _connect()
+        present = _referenced_ids(conn, ids)
+        conn.close()
+        return erase_patients(present, requested_by, role) if present else []
+
+    elsewhere = shards.fan_out(erase_on, [site for site in shards.sites() if site != home])
+    merged = {r["patient_id"]: dict(r, counts=dict(r["counts"]),
+                                    sites=[home] if r["found"] or any(r["counts"].values()) else [])
+              for r in erase_patients(ids, requested_by, role, uow)}
+    for site, receipts in elsewhere.items():
+        for receipt in receipts:
+            target = merged[receipt["patient_id"]]
+            target["found"] = target["found"] or receipt["found"]
+            for key, value in receipt["counts"].items():
+                target["counts"][key] = target["counts"].get(key, 0) + value
+            target["sites"].append(site)
+    return [merged[pid] for pid in ids]
+
+def _drop_from_availability_index(site, appointments):
+    from database import scheduling
+    index = scheduling._indexes.get(site)
+    if index is None:
+        return
+    for appointment_id, provider_id, date in appointments:
+        if provider_id is not None:
+            index.remove(provider_id, date, appointment_id)
+
+def get_erasure_receipts(patient_id: Optional[int] = None, limit: int = 100) -> List[Dict]:
+    conn = _connect()
+    if patient_id is not None:
+        rows = conn.execute(
+            "SELECT * FROM erasure_receipts WHERE patient_id = ? ORDER BY receipt_id DESC LIMIT ?", (patient_id, limit)
+        ).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM erasure_receipts ORDER BY receipt_id DESC LIMIT ?", (limit,)).fetchall()
+    conn.close()
+    return [dict(r, counts=json.loads(r["counts"])) for r in rows]
@@ -0,0 +1,218 @@
+"""
+Clinical notes and attachments.
+
+Long free text and uploaded documents stay out of the patients table. A
+clinical_notes row is only a reference (kind, title, content type, size, a
+short preview for text notes and the blob digest); the content lives in the
+content-addressed blob store (database/blobs.py), compressed and deduplicated.
+List queries (list_notes, note_counts) read references only; content is
+streamed on demand with open_note() / iter_note(). patients.diagnosis remains
+the short summary the patient lists show.
+
+Notes follow their patient: erasure deletes them and releases their blobs,
+and database/rebalance.py moves them (and copies their blobs) between sites.
+"""
+import datetime
+from collections import Counter
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from database import blobs, shards
+from database.connection import get_db_connection, ensure_schema, next_id, UnitOfWork
+
+NOTE_KINDS = ("note", "attachment")
+PREVIEW_CHARS = 160
+MAX_TITLE_CHARS = 200
+REFERENCE_COLUMNS = ("note_id", "patient_id", "kind", "title", "content_type", "size", "digest", "preview",
+                     "created_by", "created_at")
+
+
+class UnknownPatient(ValueError):
+    pass
+
+
+def _create_notes_tables(conn, site: Optional[str] = None):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS clinical_notes (
+        note_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        title TEXT,
+        content_type TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        digest TEXT NOT NULL,
+        preview TEXT,
+        created_by INTEGER,
+        created_at TEXT NOT NULL
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_clinical_notes_patient ON clinical_notes(patient_id, note_id)")
+    # note ids are unique across shards, like patient ids, so notes can move with their patient
+    base = shards.id_base(site)
+    if base:
+        cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'clinical_notes'")
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('clinical_notes', ?)", (base,))
+        elif row[0] < base:
+            cur.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'clinical_notes'", (base,))
+    conn.commit()
+
+def _ensure(conn, site: Optional[str] = None):
+    ensure_schema(conn, "blobs", blobs._create_blob_tables)
+    ensure_schema(conn, "notes", lambda c: _create_notes_tables(c, site))
+
+def _connect():
+    conn = get_db_connection()
+    _ensure(conn, shards.resolve())
+    return conn
+
+def _add(patient_id: int, kind: str, source, title: Optional[str], content_type: str, preview: Optional[str],
+         created_by, role, uow: Optional[UnitOfWork]) -> int:
+    # the upload is hashed and compressed before the write lock is taken
+    staged = blobs.stage(source, uow.site if uow is not None else None)
+    try:
+        if uow is None:
+            with UnitOfWork() as own:
+                return _insert(own, staged, patient_id, kind, title, content_type, preview, created_by, role)
+        return _insert(uow, staged, patient_id, kind, title, content_type, preview, created_by, role)
+    finally:
+        blobs.discard(staged)
+
+def _insert(uow: UnitOfWork, staged, patient_id, kind, title, content_type, preview, created_by, role) -> int:
+    _ensure(uow.conn, uow.site)
+    if uow.execute("SELECT 1 FROM patients WHERE patient_id = ?", (patient_id,)).fetchone() is None:
+        raise UnknownPatient(f"patient {patient_id} not found on site {uow.site}")
+    digest = blobs.commit(staged, uow.cur)
+    note_id = uow.execute(
+        "INSERT INTO clinical_notes (note_id, patient_id, kind, title, content_type, size, digest, preview, created_by, "
+        f"created_at) VALUES ({next_id('clinical_notes')},?,?,?,?,?,?,?,?,?)",
+        (patient_id, kind, (title or "")[:MAX_TITLE_CHARS] or None, content_type, staged.size, digest, preview,
+         created_by, datetime.datetime.utcnow().isoformat())
+    ).lastrowid
+    uow.log(created_by, role, f"add_{kind}", f"note_id={note_id} patient_id={patient_id} bytes={staged.size}",
+            patient_id=patient_id)
+    return note_id
+
+def add_note(patient_id: int, text: str, title: Optional[str] = None, created_by=None, role=None,
+             uow: Optional[UnitOfWork] = None) -> int:
+    """Store a free-text clinical note for a patient of the current site. Returns the note id."""
+    preview = " ".join(text.split())[:PREVIEW_CHARS]
+    return _add(patient_id, "note", text, title, "text/plain; charset=utf-8", preview, created_by, role, uow)
+
+def add_attachment(patient_id: int, source, filename: str, content_type: str = "application/octet-stream",
+                   created_by=None, role=None, uow: Optional[UnitOfWork] = None) -> int:
+    """
+    Store an uploaded document (bytes or a binary file object, read in chunks)
+    for a patient of the current site. Returns the note id.
+    """
+    # served back as a response header (api/server.py)
+    content_type = "".join(c for c in content_type if c.isprintable())[:100] or "application/octet-stream"
+    return _add(patient_id, "attachment", source, filename, content_type, None, created_by, role, uow)
+
+def list_notes(patient_id: int, kind: Optional[str] = None, limit: int = 100) -> List[Dict]:
+    """References to a patient's notes and attachments, newest first (no content)."""
+    query = f"SELECT {', '.join(REFERENCE_COLUMNS)} FROM clinical_notes WHERE patient_id = ?"
+    params = [patient_id]
+    if kind is not None:
+        query += " AND kind = ?"
+        params.append(kind)
+    conn = _connect()
+    rows = conn.execute(query + " ORDER BY note_id DESC LIMIT ?", (*params, limit)).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def note_counts(patient_ids: Iterable[int]) -> Dict[int, int]:
+    """Number of notes and attachments per patient, for list views."""
+    ids = list(dict.fromkeys(int(pid) for pid in patient_ids))
+    counts = {}
+    conn = _connect()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        counts.update((r[0], r[1]) for r in conn.execute(
+            f"SELECT patient_id, COUNT(*) FROM clinical_notes WHERE patient_id IN ({','.join('?' * len(chunk))}) "
+            f"GROUP BY patient_id", chunk
+        ))
+    conn.close()
+    return counts
+
+def get_note(note_id: int) -> Optional[Dict]:
+    conn = _connect()
+    row = conn.execute(f"SELECT {', '.join(REFERENCE_COLUMNS)} FROM clinical_notes WHERE note_id = ?",
+                       (note_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def open_note(note_id: int) -> Tuple[Optional[Dict], Optional[BinaryIO]]:
+    """(reference, file object streaming the content), or (None, None) for an unknown note."""
+    note = get_note(note_id)
+    if note is None:
+        return None, None
+    return note, blobs.open_blob(note["digest"])
+
+def iter_note(note_id: int, chunk: int = blobs.CHUNK) -> Iterator[bytes]:
+    note = get_note(note_id)
+    if note is None:
+        raise KeyError(note_id)
+    return blobs.iter_blob(note["digest"], chunk=chunk)
+
+def read_note_text(note_id: int) -> Optional[str]:
+    note, f = open_note(note_id)
+    if note is None:
+        return None
+    with f:
+        return f.read().decode("utf-8", errors="replace")
+
+def delete_note(note_id: int, deleted_by=None, role=None, uow: Optional[UnitOfWork] = None) -> bool:
+    if uow is None:
+        with UnitOfWork() as own:
+            return delete_note(note_id, deleted_by, role, own)
+    _ensure(uow.conn, uow.site)
+    row = uow.execute("SELECT patient_id, kind, digest FROM clinical_notes WHERE note_id = ?", (note_id,)).fetchone()
+    if row is None:
+        return False
+    uow.execute("DELETE FROM clinical_notes WHERE note_id = ?", (note_id,))
+    blobs.release(uow.cur, {row["digest"]: 1})
+    uow.log(deleted_by, role, f"delete_{row['kind']}", f"note_id={note_id} patient_id={row['patient_id']}",
+            patient_id=row["patient_id"])
+    site = uow.site
+    uow.after_commit(lambda: blobs.collect_garbage([row["digest"]], site=site))
+    return True
+
+def drop_patient_notes(cur, patient_ids: Iterable[int]) -> Tuple[int, List[str]]:
+    """
+    Delete the notes of the given patients on the caller's cursor and release
+    their blobs. Returns (notes deleted, released digests) so the caller can
+    collect the blobs after commit.
+    """
+    ids = list(patient_ids)
+    marks = ",".join("?" * len(ids))
+    cur.execute(f"SELECT digest FROM clinical_notes WHERE patient_id IN ({marks})", ids)
+    references = Counter(r[0] for r in cur.fetchall())
+    cur.execute(f"DELETE FROM clinical_notes WHERE patient_id IN ({marks})", ids)
+    blobs.release(cur, references)
+    return sum(references.values()), list(references)
+
+def copy_patient_notes(src_cur, dst_cur, source: str, target: str, patient_ids: List[int]) -> int:
+    """
+    Copy the notes of the given patients, and the blob files they need, from
+    `source` to `target` inside open write transactions on both (database/rebalance.py).
+    Notes already present on the target (a repeated move) are not counted twice.
+    """
+    marks = ",".join("?" * len(patient_ids))
+    src_cur.execute(f"SELECT {', '.join(REFERENCE_COLUMNS)} FROM clinical_notes WHERE patient_id IN ({marks})",
+                    patient_ids)
+    rows = [tuple(r) for r in src_cur.fetchall()]
+    if not rows:
+        return 0
+    ids = [r[0] for r in rows]
+    dst_cur.execute(f"SELECT note_id FROM clinical_notes WHERE note_id IN ({','.join('?' * len(ids))})", ids)
+    present = {r[0] for r in dst_cur.fetchall()}
+    references = Counter(r[REFERENCE_COLUMNS.index("digest")] for r in rows if r[0] not in present)
+    for digest, count in references.items():
+        with blobs.open_blob(digest, source) as f:
+            blobs.commit(blobs.stage(f, target), dst_cur, references=count)
+    dst_cur.executemany(
+        f"INSERT OR REPLACE INTO clinical_notes ({', '.join(REFERENCE_COLUMNS)}) "
+        f"VALUES ({','.join('?' * len(REFERENCE_COLUMNS))})", rows
+    )
+    return len(rows)
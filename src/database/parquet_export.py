@@ -0,0 +1,262 @@
+"""
+Columnar export for offline analysis.
+
+Streams `logs` (and optionally patients and appointments) into Hive-partitioned,
+compressed Parquet files that pandas, pyarrow.dataset, DuckDB or Spark can read
+directly:
+
+    <out>/logs/date=2024-05-01/part-000001201-000004800.parquet
+    <out>/patients/added_month=2024-05/part-...parquet
+    <out>/appointments/month=2024-05/part-...parquet
+
+Rows are read with fetchmany in chunks and written per chunk, so memory stays
+bounded by the chunk size, not the table size. Logs are exported incrementally
+from the last exported log_id, recorded in <out>/_export_state.json and in the
+files themselves: each names its chunk's log_id range and records how many files
+the chunk has, so a run that stopped before saving the state resumes after its
+last complete chunk instead of exporting those rows again. Audit
+details are not exported: erasure (database/erasure.py) redacts them in place,
+which an append-only copy would never see; log_id and entry_hash tie an
+exported row back to the live, verifiable entry. Patients and appointments change in place and are
+rewritten in full on every export; by default they carry only pseudonymized
+patient fields.
+
+pyarrow is imported on first use, like pandas/matplotlib in components.charts.
+
+    cd src
+    python -m database.parquet_export --out ../data/exports --tables logs,patients
+"""
+import argparse
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from database.connection import get_db_connection, DATA_DIR
+
+DEFAULT_CHUNK_ROWS = 100000
+DEFAULT_COMPRESSION = "zstd"
+STATE_FILE = "_export_state.json"
+UNKNOWN_PARTITION = "unknown"
+CHUNK_FILES_KEY = b"chunk_files"   # parquet metadata: files written for the file's chunk
+
+# column name -> arrow type name
+LOG_SCHEMA = [("log_id", "int64"), ("user_id", "int64"), ("role", "string"), ("action", "string"),
+              ("timestamp", "string"), ("entry_hash", "string")]
+PATIENT_SCHEMA = [("patient_id", "int64"), ("anonymized_name", "string"), ("anonymized_contact", "string"),
+                  ("diagnosis", "string"), ("date_added", "string"), ("anon_version", "int64")]
+PATIENT_IDENTIFIERS = [("name", "string"), ("contact", "string")]
+APPOINTMENT_SCHEMA = [("appointment_id", "int64"), ("patient_id", "int64"), ("provider_id", "int64"),
+                      ("date", "string"), ("time", "string"), ("duration_minutes", "int64"),
+                      ("status", "string"), ("created_by", "int64"), ("created_at", "string")]
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+    return pa.schema([(name, getattr(pa, kind)()) for name, kind in columns])
+
+def _load_state(out_dir: Path) -> Dict:
+    path = out_dir / STATE_FILE
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return {}
+
+def _save_state(out_dir: Path, state: Dict):
+    tmp = out_dir / (STATE_FILE + ".tmp")
+    tmp.write_text(json.dumps(state, indent=2), encoding="utf-8")
+    os.replace(tmp, out_dir / STATE_FILE)
+
+def _exported_through(dataset_dir: Path, after: int) -> int:
+    """
+    The last log_id of the complete chunks in dataset_dir past `after`. The state
+    file is saved after the files, so a run that stopped in between left them
+    behind; a chunk missing some of its partition files is removed.
+    """
+    import pyarrow.parquet as pq
+
+    for leftover in dataset_dir.glob("*/*.parquet.tmp"):
+        leftover.unlink()
+    chunks: Dict[Tuple[int, int], List[Path]] = {}
+    for path in dataset_dir.glob("*/part-*.parquet"):
+        first, last = (int(n) for n in path.stem.split("-")[1:3])
+        if last > after:
+            chunks.setdefault((first, last), []).append(path)
+    for (first, last), paths in sorted(chunks.items()):
+        expected = (pq.read_schema(paths[0]).metadata or {}).get(CHUNK_FILES_KEY)
+        if expected is None:
+            continue  # a filtered extract, which never moves the mark
+        if int(expected) != len(paths):
+            for path in paths:
+                path.unlink()
+            break
+        after = last
+    return after
+
+def _write_chunks(cursor, columns, key_column: str, partition_name: str, partition_of: Callable,
+                  dataset_dir: Path, chunk_rows: int, compression: str, mark_chunks: bool = False) -> Dict:
+    """
+    Write the cursor's rows chunk by chunk; one file per (chunk, partition).
+    mark_chunks records each chunk's file count for _exported_through.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(columns)
+    names = [name for name, _ in columns]
+    key_index = names.index(key_column)
+    stats = {"rows": 0, "files": 0, "last_id": None}
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+        partitions: Dict[str, List] = {}
+        for row in rows:
+            partitions.setdefault(partition_of(row) or UNKNOWN_PARTITION, []).append(row)
+        first, last = rows[0][key_index], rows[-1][key_index]
+        for value, part_rows in partitions.items():
+            target_dir = dataset_dir / f"{partition_name}={value}"
+            target_dir.mkdir(parents=True, exist_ok=True)
+            table = pa.Table.from_pydict(
+                {name: [r[i] for r in part_rows] for i, name in enumerate(names)}, schema=schema
+            )
+            if mark_chunks:
+                table = table.replace_schema_metadata({CHUNK_FILES_KEY: str(len(partitions))})
+            target = target_dir / f"part-{first:09d}-{last:09d}.parquet"
+            pq.write_table(table, str(target) + ".tmp", compression=compression)
+            os.replace(str(target) + ".tmp", target)
+            stats["files"] += 1
+        stats["rows"] += len(rows)
+        stats["last_id"] = last
+    return stats
+
+def _time_filter(column: str, since: Optional[str], until: Optional[str]):
+    clauses, params = [], []
+    if since:
+        clauses.append(f"{column} >= ?")
+        params.append(since)
+    if until:
+        clauses.append(f"{column} < ?")
+        params.append(until)
+    return clauses, params
+
+def export_logs(out_dir, since: Optional[str] = None, until: Optional[str] = None, incremental: bool = True,
+                chunk_rows: int = DEFAULT_CHUNK_ROWS, compression: str = DEFAULT_COMPRESSION) -> Dict:
+    """
+    Export audit entries, partitioned by day. since/until are ISO timestamps
+    (until exclusive). Incremental runs start after the last exported log_id;
+    a non-incremental run without filters rebuilds the dataset. The mark only
+    advances on runs without a time filter, so a filtered extract never causes
+    later rows to be skipped (write filtered extracts to their own out_dir).
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    state = _load_state(out_dir)
+    columns = [name for name, _ in LOG_SCHEMA]
+    if state.get("logs_columns") != columns and not (since or until):
+        # written with other columns (older exports carried details, possibly since erased): rebuild
+        incremental = False
+    if not incremental and not (since or until):
+        shutil.rmtree(out_dir / "logs", ignore_errors=True)
+        state.pop("logs_last_log_id", None)
+    start_after = _exported_through(out_dir / "logs", state.get("logs_last_log_id", 0)) if incremental else 0
+    clauses, params = _time_filter("timestamp", since, until)
+    clauses.insert(0, "log_id > ?")
+    params.insert(0, start_after)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(
+        f"SELECT {', '.join(name for name, _ in LOG_SCHEMA)} FROM logs WHERE {' AND '.join(clauses)} ORDER BY log_id",
+        params
+    )
+    try:
+        stats = _write_chunks(cur, LOG_SCHEMA, "log_id", "date", lambda r: (r[4] or "")[:10],
+                              out_dir / "logs", chunk_rows, compression, mark_chunks=not (since or until))
+    finally:
+        conn.close()
+    if not (since or until):
+        state["logs_columns"] = columns
+        state["logs_last_log_id"] = stats["last_id"] if stats["last_id"] is not None else start_after
+        _save_state(out_dir, state)
+    stats["started_after_log_id"] = start_after
+    return stats
+
+def _export_snapshot(out_dir: Path, name: str, query: str, params: Sequence, columns, key_column: str,
+                     partition_name: str, partition_of: Callable, chunk_rows: int, compression: str) -> Dict:
+    # rewrite into a fresh directory and swap it in, so readers never see a half-written snapshot
+    final_dir = out_dir / name
+    staging = out_dir / f".{name}.staging"
+    shutil.rmtree(staging, ignore_errors=True)
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(query, params)
+    try:
+        stats = _write_chunks(cur, columns, key_column, partition_name, partition_of, staging, chunk_rows, compression)
+    finally:
+        conn.close()
+    staging.mkdir(parents=True, exist_ok=True)
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(staging, final_dir)
+    return stats
+
+def export_patients(out_dir, since: Optional[str] = None, until: Optional[str] = None,
+                    include_identifiers: bool = False, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                    compression: str = DEFAULT_COMPRESSION) -> Dict:
+    """Full snapshot of patients, partitioned by the month they were added."""
+    columns = PATIENT_SCHEMA + (PATIENT_IDENTIFIERS if include_identifiers else [])
+    clauses, params = _time_filter("date_added", since, until)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    date_index = [name for name, _ in columns].index("date_added")
+    return _export_snapshot(
+        Path(out_dir), "patients",
+        f"SELECT {', '.join(name for name, _ in columns)} FROM patients{where} ORDER BY patient_id", params,
+        columns, "patient_id", "added_month", lambda r: (r[date_index] or "")[:7], chunk_rows, compression
+    )
+
+def export_appointments(out_dir, since: Optional[str] = None, until: Optional[str] = None,
+                        chunk_rows: int = DEFAULT_CHUNK_ROWS, compression: str = DEFAULT_COMPRESSION) -> Dict:
+    """Full snapshot of appointments (without patient_name), partitioned by appointment month."""
+    clauses, params = _time_filter("date", since[:10] if since else None, until[:10] if until else None)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return _export_snapshot(
+        Path(out_dir), "appointments",
+        f"SELECT {', '.join(name for name, _ in APPOINTMENT_SCHEMA)} FROM appointments{where} ORDER BY appointment_id",
+        params, APPOINTMENT_SCHEMA, "appointment_id", "month", lambda r: (r[3] or "")[:7], chunk_rows, compression
+    )
+
+def export_all(out_dir, tables: Iterable[str] = ("logs",), since: Optional[str] = None, until: Optional[str] = None,
+               incremental: bool = True, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+               compression: str = DEFAULT_COMPRESSION) -> Dict:
+    results = {}
+    for table in tables:
+        if table == "logs":
+            results[table] = export_logs(out_dir, since, until, incremental, chunk_rows, compression)
+        elif table == "patients":
+            results[table] = export_patients(out_dir, since, until, chunk_rows=chunk_rows, compression=compression)
+        elif table == "appointments":
+            results[table] = export_appointments(out_dir, since, until, chunk_rows, compression)
+        else:
+            raise ValueError(f"unknown export table: {table}")
+    return results
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Export audit data to partitioned Parquet")
+    parser.add_argument("--out", default=str(DATA_DIR / "exports"))
+    parser.add_argument("--tables", default="logs", help="comma-separated: logs,patients,appointments")
+    parser.add_argument("--since", help="ISO date/time, inclusive")
+    parser.add_argument("--until", help="ISO date/time, exclusive")
+    parser.add_argument("--full", action="store_true", help="re-export all logs instead of appending")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--compression", default=DEFAULT_COMPRESSION)
+    args = parser.parse_args(argv)
+    results = export_all(args.out, [t.strip() for t in args.tables.split(",") if t.strip()], args.since, args.until,
+                         incremental=not args.full, chunk_rows=args.chunk_rows, compression=args.compression)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
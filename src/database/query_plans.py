@@ -0,0 +1,275 @@
+"""
+Registry of the data layer's SQL statements and their expected query plans.
+
+Every statement the app runs against a site database is listed here with the
+index SQLite should use for it. check_plans() runs EXPLAIN QUERY PLAN for each
+one and reports those that no longer use their index, so a schema change, a
+rewritten WHERE clause or a dropped index shows up before it turns a keyed
+lookup into a full scan at 100k rows. Statements that legitimately read a whole
+table (listings, totals, exports, one-off migrations) are listed with
+index=None and a note saying why.
+
+    cd src
+    python -m database.query_plans            # check the configured database
+    python -m database.query_plans --site north
+
+benchmarks/query_plans.py seeds a throwaway database at realistic size and also
+holds each hot statement to its time budget. Add new statements here when you
+add them to the code.
+"""
+import argparse
+import json
+import sys
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+from database import shards
+from database.connection import get_db_connection
+
+# index: expected in the plan as "USING INDEX <name>" / "USING COVERING INDEX <name>",
+#        or "PRIMARY KEY" for rowid lookups and ranges; None for deliberate scans
+# budget_ms: median time allowed on the 100k-row benchmark database (None: not timed)
+Statement = namedtuple("Statement", "name sql params index budget_ms note")
+Statement.__new__.__defaults__ = (None, None, "")
+
+PRIMARY_KEY = "PRIMARY KEY"
+
+STATEMENTS = [
+    # patients
+    Statement("patients.by_id", "SELECT * FROM patients WHERE patient_id = ?", (42,), PRIMARY_KEY, 1),
+    Statement("patients.by_name_ci", "SELECT patient_id, name FROM patients WHERE lower(name) = lower(?)",
+              ("Patient 4242",), "idx_patients_name_lower", 1, "exact-name lookup on the appointments page"),
+    Statement("patients.by_name_key",
+              "SELECT patient_id, name, contact FROM patients WHERE name_key = ? AND patient_id != ? "
+              "ORDER BY patient_id DESC LIMIT ?", ("P350", -1, 50), "idx_patients_name_key", 2),
+    Statement("patients.by_contact_key",
+              "SELECT patient_id, name, contact FROM patients WHERE contact_key = ? AND patient_id != ? "
+              "ORDER BY patient_id DESC LIMIT ?", ("3001234567", -1, 50), "idx_patients_contact_key", 2),
+    Statement("patients.search_name_key",
+              "SELECT patient_id, name FROM patients WHERE name_key = ? ORDER BY patient_id DESC LIMIT ?",
+              ("P350", 50), "idx_patients_name_key", 2),
+    Statement("patients.stale_anonymization",
+              "SELECT patient_id, name, contact FROM patients WHERE anon_version < ? LIMIT ?", (1, 500),
+              "idx_patients_anon_version", 2),
+    Statement("patients.expired_count", "SELECT COUNT(*) as count FROM patients WHERE date_added < ?",
+              ("2015-03-01",), "idx_patients_date_added", 2, "retention check"),
+    Statement("patients.expired",
+              "SELECT patient_id, name, date_added FROM patients WHERE date_added < ? ORDER BY date_added ASC",
+              ("2015-03-01",), "idx_patients_date_added", 5),
+    Statement("patients.rollup_fold",
+              "SELECT substr(p.date_added, 1, 10), COUNT(*) FROM changes c JOIN patients p ON p.patient_id = c.row_id "
+              "WHERE c.change_seq > ? AND c.change_seq <= ? AND +c.table_name = 'patients' AND c.op = 'insert' "
+              "AND (p.change_seq = c.change_seq OR NOT EXISTS (SELECT 1 FROM changes d WHERE d.table_name = 'patients' "
+              "AND d.row_id = c.row_id AND d.change_seq > c.change_seq AND d.op IN ('insert', 'delete'))) GROUP BY 1",
+              (0, 5000), PRIMARY_KEY, 10, "rollups, one batch of insert entries"),
+    Statement("patients.rollup_boundary",
+              "SELECT change_seq AS m FROM changes WHERE change_seq > ? AND +table_name = 'patients' AND op = 'insert' "
+              "ORDER BY change_seq LIMIT 1 OFFSET ?", (0, 4999), PRIMARY_KEY, 5),
+    Statement("patients.rollup_moved",
+              "SELECT MAX(change_seq) FROM changes WHERE table_name = 'patients' AND row_id = ? AND op = 'insert'",
+              (42,), "idx_changes_row", 1, "rebalance: was the moved patient counted"),
+    Statement("patients.list", "SELECT * FROM patients ORDER BY patient_id DESC", (), None, None,
+              "patients page listing: reads every row by design"),
+    Statement("patients.count", "SELECT COUNT(*) AS total, COUNT(anonymized_name) AS anonymized FROM patients",
+              (), None, None, "compliance totals"),
+    Statement("patients.dedup_scan",
+              "SELECT patient_id, name, contact, name_key AS k FROM patients WHERE name_key IS NOT NULL "
+              "ORDER BY name_key", (), "idx_patients_name_key", None, "full duplicate scan, walked in key order"),
+
+    # logs
+    Statement("logs.recent", "SELECT * FROM logs ORDER BY log_id DESC LIMIT ?", (200,), None, 2,
+              "audit page: newest rows first, stops after the limit"),
+    Statement("logs.by_user", "SELECT * FROM logs WHERE user_id = ? ORDER BY log_id DESC LIMIT ?", (3, -1),
+              "idx_logs_user", 50, "export_user_data and the per-user audit filter"),
+    Statement("logs.count_since", "SELECT COUNT(*) as count FROM logs WHERE timestamp > ?",
+              ("2099-01-01T00:00:00",), "idx_logs_timestamp", 2, "compliance report, last 7 days"),
+    Statement("logs.chain_head", "SELECT entry_hash FROM logs WHERE log_id < ? ORDER BY log_id DESC LIMIT 1",
+              (10 ** 12,), PRIMARY_KEY, 1, "audit chain trigger, once per insert"),
+    Statement("logs.by_id", "SELECT entry_hash FROM logs WHERE log_id = ?", (42,), PRIMARY_KEY, 1),
+    Statement("logs.verify_range",
+              "SELECT log_id, user_id, role, action, timestamp, details, details_hash, prev_hash, entry_hash "
+              "FROM logs WHERE log_id > ? AND log_id <= ? ORDER BY log_id", (0, 5000), PRIMARY_KEY, 50),
+    Statement("logs.export_incremental", "SELECT * FROM logs WHERE log_id > ? ORDER BY log_id", (10 ** 12,),
+              PRIMARY_KEY, 1, "parquet export after the last exported id"),
+    Statement("logs.rollup_fold",
+              "SELECT substr(timestamp, 1, 13), COALESCE(role, ''), COALESCE(action, ''), COUNT(*) FROM logs "
+              "WHERE log_id > ? AND log_id <= ? GROUP BY 1, 2, 3", (0, 5000), PRIMARY_KEY, 50),
+    Statement("logs.rollup_boundary", "SELECT log_id AS m FROM logs WHERE log_id > ? ORDER BY log_id LIMIT 1 OFFSET ?",
+              (0, 4999), PRIMARY_KEY, 5),
+    Statement("logs.max_id", "SELECT MAX(log_id) AS m FROM logs", (), None, 1, "one seek to the end of the table"),
+    Statement("logs.redact_subject",
+              "UPDATE logs SET details = ? WHERE log_id IN (SELECT log_id FROM log_subjects WHERE patient_id = ?)",
+              ("[erased]", 42), PRIMARY_KEY, None, "erasure; also needs log_subjects' key, checked below"),
+    Statement("log_subjects.by_patient", "SELECT log_id FROM log_subjects WHERE patient_id = ?", (42,),
+              PRIMARY_KEY, 1),
+    Statement("logs.count", "SELECT COUNT(*) as count FROM logs", (), None, None, "compliance totals"),
+
+    # appointments
+    Statement("appointments.by_patient", "SELECT appointment_id, provider_id, date FROM appointments "
+              "WHERE patient_id = ?", (42,), "idx_appointments_patient", 1),
+    Statement("appointments.provider_day",
+              "SELECT appointment_id, time, duration_minutes FROM appointments WHERE provider_id = ? AND date = ? "
+              "AND status NOT IN (?, ?)", (2, "2031-01-06", "Cancelled", "No-show"),
+              "idx_appointments_provider_date", 1, "booking conflict check"),
+    Statement("appointments.list", "SELECT * FROM appointments ORDER BY date DESC, time DESC", (), None, None,
+              "appointments page listing"),
+    Statement("appointments.index_load",
+              "SELECT appointment_id, provider_id, date, time, duration_minutes FROM appointments "
+              "WHERE provider_id IS NOT NULL AND status NOT IN (?, ?)", ("Cancelled", "No-show"), None, None,
+              "availability index is built from all booked appointments once per process"),
+
+    # duplicate flags
+    Statement("duplicate_flags.by_patient",
+              "SELECT * FROM duplicate_flags WHERE (patient_id = ? OR candidate_id = ?) AND +status = ? "
+              "ORDER BY score DESC LIMIT ?", (42, 42, "open", 50), "idx_duplicate_flags_candidate", 2),
+    Statement("duplicate_flags.by_status",
+              "SELECT * FROM duplicate_flags WHERE status = ? ORDER BY flagged_at DESC LIMIT ?", ("open", 50),
+              "idx_duplicate_flags_status", 5),
+    Statement("duplicate_flags.delete_subject",
+              "DELETE FROM duplicate_flags WHERE patient_id = ? OR candidate_id = ?", (42, 42),
+              "idx_duplicate_flags_candidate", None, "erasure"),
+
+    # change feed
+    Statement("changes.since",
+              "SELECT change_seq, table_name, row_id, op, changed_at FROM changes WHERE change_seq > ? "
+              "AND +table_name IN (?, ?) ORDER BY change_seq LIMIT ?", (0, "patients", "appointments", 1000),
+              PRIMARY_KEY, 5, "one page of database/changes.py"),
+    Statement("changes.latest_for_row",
+              "SELECT MAX(c.change_seq) FROM changes c WHERE c.table_name = ? AND c.row_id = ?", ("patients", 42),
+              "idx_changes_row", 1, "compaction, per old entry"),
+
+    # coalesced access sessions
+    Statement("access_sessions.open",
+              "SELECT patient_id, MAX(session_id) FROM access_sessions WHERE user_id IS ? AND action = ? "
+              "AND patient_id IN (?, ?, ?) AND last_seen >= ? GROUP BY patient_id",
+              (3, "view_patient", 1, 2, 3, "2099-01-01T00:00:00"), "idx_access_sessions_open", 1,
+              "every page render that lists patients"),
+    Statement("access_sessions.extend", "UPDATE access_sessions SET last_seen = ?, count = count + 1 "
+              "WHERE session_id = ?", ("2099-01-01T00:00:00", 42), PRIMARY_KEY, None),
+    Statement("access_sessions.by_patient",
+              "SELECT * FROM access_sessions WHERE 1 = 1 AND patient_id = ? ORDER BY last_seen DESC, session_id DESC "
+              "LIMIT ?", (42, 1000),
+              "idx_access_sessions_patient", 2, "who accessed a patient"),
+    Statement("access_sessions.subjects_of_user",
+              "SELECT patient_id, MIN(first_seen), MAX(last_seen), SUM(count) FROM access_sessions "
+              "WHERE user_id = ? GROUP BY patient_id", (3,), "idx_access_sessions_open", 50,
+              "get_accessed_subjects; reads one user's sessions"),
+    Statement("access_sessions.since",
+              "SELECT * FROM access_sessions WHERE 1 = 1 AND last_seen >= ? ORDER BY last_seen DESC, session_id DESC "
+              "LIMIT ?",
+              ("2099-01-01T00:00:00", 1000), "idx_access_sessions_last_seen", 2),
+    Statement("access_sessions.delete_subject", "DELETE FROM access_sessions WHERE patient_id = ?", (42,),
+              "idx_access_sessions_patient", None, "erasure"),
+
+    # clinical notes and blobs
+    Statement("clinical_notes.by_patient",
+              "SELECT note_id, patient_id, kind, title, content_type, size, digest, preview, created_by, created_at "
+              "FROM clinical_notes WHERE patient_id = ? ORDER BY note_id DESC LIMIT ?", (42, 100),
+              "idx_clinical_notes_patient", 1, "note references for one patient, no content"),
+    Statement("clinical_notes.counts",
+              "SELECT patient_id, COUNT(*) FROM clinical_notes WHERE patient_id IN (?, ?, ?) GROUP BY patient_id",
+              (1, 2, 3), "idx_clinical_notes_patient", 1, "note counts on the patients list"),
+    Statement("clinical_notes.by_id", "SELECT * FROM clinical_notes WHERE note_id = ?", (42,), PRIMARY_KEY, 1),
+    Statement("blobs.by_digest", "SELECT * FROM blobs WHERE digest = ?", ("00" * 32,), PRIMARY_KEY, 1),
+    Statement("blobs.unreferenced", "SELECT digest, codec FROM blobs WHERE refcount <= 0", (),
+              "idx_blobs_unreferenced", 1, "garbage collection"),
+
+    # erasure, audit checkpoints, rollups
+    Statement("erasure_receipts.by_patient",
+              "SELECT * FROM erasure_receipts WHERE patient_id = ? ORDER BY receipt_id DESC LIMIT ?", (42, 100),
+              "idx_erasure_receipts_patient", 1),
+    Statement("audit_checkpoints.latest", "SELECT * FROM audit_checkpoints ORDER BY checkpoint_id DESC LIMIT 1",
+              (), None, 1, "reads the last row only"),
+    Statement("rollup_state.by_source", "SELECT high_water FROM rollup_state WHERE source = ?", ("logs",),
+              "sqlite_autoindex_rollup_state_1", 1),
+    Statement("rollup_log_actions_hourly.since",
+              "SELECT hour, role, SUM(count) AS count FROM rollup_log_actions_hourly WHERE hour >= ? "
+              "GROUP BY hour, role", ("2099-01-01",), PRIMARY_KEY, 2),
+    Statement("rollup_data_access_daily.since",
+              "SELECT day, user_id, count FROM rollup_data_access_daily WHERE day >= ?", ("2099-01-01",),
+              PRIMARY_KEY, 2),
+    # cache invalidation (database/cache.py), after PRAGMA data_version reports a commit
+    Statement("table_versions.all", "SELECT table_name, version FROM table_versions", (), None, 1,
+              "four counter rows"),
+]
+
+# primary site only: accounts and the job queue (database/shards.py)
+PRIMARY_STATEMENTS = [
+    Statement("users.by_username", "SELECT * FROM users WHERE username = ?", ("admin",),
+              "sqlite_autoindex_users_1", 1, "login"),
+    Statement("users.by_id", "SELECT user_id, username, role FROM users WHERE user_id = ?", (1,), PRIMARY_KEY, 1),
+    Statement("users.staff", "SELECT user_id, username, role, site FROM users ORDER BY role, username", (), None,
+              None, "staff registry, cached (database/cache.py)"),
+    Statement("job_runs.claim",
+              "SELECT * FROM job_runs WHERE status IN ('queued','retrying') AND run_after <= ? "
+              "ORDER BY run_id LIMIT 1", ("2099-01-01",), "idx_job_runs_status", 1, "scheduler worker poll"),
+    Statement("job_runs.active_for_job",
+              "SELECT 1 FROM job_runs WHERE job_name = ? AND status IN ('queued','retrying','running') LIMIT 1",
+              ("backup",), "idx_job_runs_status", 1),
+    Statement("jobs.due", "SELECT * FROM jobs WHERE enabled = 1 AND schedule IS NOT NULL AND next_run_at <= ?",
+              ("2099-01-01",), None, None, "a handful of job definitions"),
+]
+
+
+def _prepare(conn):
+    # subsystem tables are created on first use by each module's _connect()
+    from database import access_log, audit, blobs, cache, changes, dedup, erasure, notes, rollups, scheduling
+    for module in (access_log, audit, blobs, cache, changes, dedup, erasure, notes, rollups, scheduling):
+        module._connect().close()
+    if shards.resolve() == shards.PRIMARY_SITE:
+        from utils import scheduler
+        scheduler._connect().close()
+
+def statements(site: Optional[str] = None) -> List[Statement]:
+    """The statements that run against `site` (default: the current site)."""
+    if shards.resolve(site) == shards.PRIMARY_SITE:
+        return STATEMENTS + PRIMARY_STATEMENTS
+    return list(STATEMENTS)
+
+def explain(conn, sql: str, params=()) -> List[str]:
+    """EXPLAIN QUERY PLAN detail lines, e.g. 'SEARCH patients USING INDEX ...'."""
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def plan_problem(statement: Statement, plan: List[str]) -> Optional[str]:
+    """Why the plan does not match the statement's expectation, or None."""
+    if statement.index is None:
+        return None
+    text = "\n".join(plan)
+    if statement.index == PRIMARY_KEY:
+        if "INTEGER PRIMARY KEY" not in text and "PRIMARY KEY" not in text:
+            return "expected a primary-key lookup or range"
+    elif f"INDEX {statement.index}" not in text:
+        return f"expected index {statement.index}"
+    scans = [line for line in plan if line.startswith("SCAN ") and " USING " not in line
+             and not line.startswith("SCAN CONSTANT")]
+    if scans:
+        return f"full scan: {scans[0]}"
+    return None
+
+def check_plans(site: Optional[str] = None) -> List[Dict]:
+    """Explain every registered statement on `site`; one entry per statement, with 'problem' set on failures."""
+    with shards.use_site(site):
+        conn = get_db_connection()
+        _prepare(conn)
+        results = []
+        for statement in statements():
+            plan = explain(conn, statement.sql, statement.params)
+            results.append({"name": statement.name, "plan": plan, "problem": plan_problem(statement, plan)})
+        conn.close()
+    return results
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Check query plans of the data layer's statements")
+    parser.add_argument("--site", default=None)
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not only problems")
+    args = parser.parse_args(argv)
+    results = check_plans(args.site)
+    problems = [r for r in results if r["problem"]]
+    print(json.dumps(results if args.verbose else problems, indent=2))
+    print(f"{len(results)} statements, {len(problems)} problems", file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Move patients between site shards (database/shards.py).
+
+    cd src
+    python -m database.rebalance --from main --to north --ids 12,13,40
+    python -m database.rebalance --from main --to north --limit 5000 --batch 500
+
+A patient moves with their appointments and clinical notes (whose blobs are
+copied into the target's blob store), keeping their ids (ids are unique
+across shards). The target's id sequences are left where they were, so it
+keeps allocating from its own range. Duplicate flags are per shard and are dropped; the next
+duplicate scan on the target finds them again. Audit entries stay in the shard
+that wrote them, because each shard's hash chain must not change: both sides
+get a "rebalance" entry linked to the moved patients, so erasure
+(erasure.erase_patients_everywhere) still reaches the old shard.
+
+Each batch keeps the source's write lock while it is copied to the target and
+committed there, then deletes it from the source, so no write to those
+patients can slip in between. If the process dies after the target commit, the
+patients exist in both shards until the same move is run again, which replaces
+the target copy and finishes the delete.
+"""
+import argparse
+import json
+from typing import Callable, Dict, List, Optional, Sequence
+
+from database import blobs, notes, rollups, shards
+from database.connection import get_db_connection, write_log
+
+DEFAULT_BATCH = 500
+# tables whose rows are copied with their ids; see _restore_sequences
+COPIED_ID_TABLES = ("patients", "appointments", "clinical_notes")
+
+
+def _columns(cur, table: str) -> List[str]:
+    cur.execute(f"PRAGMA table_info({table})")
+    return [r[1] for r in cur.fetchall()]
+
+def _copy_rows(src_cur, dst_cur, table: str, key: str, ids: Sequence[int]) -> int:
+    columns = [c for c in _columns(src_cur, table) if c in set(_columns(dst_cur, table))]
+    marks = ",".join("?" * len(ids))
+    src_cur.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {key} IN ({marks})", list(ids))
+    rows = [tuple(r) for r in src_cur.fetchall()]
+    dst_cur.executemany(
+        f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({','.join('?' * len(columns))})", rows
+    )
+    return len(rows)
+
+def _sequences(cur) -> Dict[str, int]:
+    cur.execute("SELECT name, seq FROM sqlite_sequence")
+    return {r[0]: r[1] for r in cur.fetchall()}
+
+def _restore_sequences(cur, before: Dict[str, int], site: str):
+    # inserting rows with their ids raised the target's sequences into the source's
+    # range; put them back, or the target's next ids would collide with the source's
+    # (new rows take their ids from the sequence, see connection.next_id)
+    for table, seq in _sequences(cur).items():
+        if table in COPIED_ID_TABLES and seq != before.get(table):
+            cur.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?",
+                        (before.get(table, shards.id_base(site)), table))
+
+def _link_subjects(cur, log_id: int, ids: Sequence[int]):
+    cur.executemany("INSERT OR IGNORE INTO log_subjects (patient_id, log_id) VALUES (?,?)",
+                    [(pid, log_id) for pid in ids])
+
+def _move_batch(source: str, target: str, ids: List[int], moved_by: Optional[int]) -> Dict:
+    src = get_db_connection(source)
+    dst = get_db_connection(target)
+    src.isolation_level = dst.isolation_level = None
+    src_cur, dst_cur = src.cursor(), dst.cursor()
+    src_cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'clinical_notes'")
+    has_notes = src_cur.fetchone() is not None
+    if has_notes:
+        # outside the transactions below, so a rolled-back batch cannot undo the DDL
+        notes._ensure(dst, target)
+    try:
+        src_cur.execute("BEGIN IMMEDIATE")
+        marks = ",".join("?" * len(ids))
+        src_cur.execute(f"SELECT patient_id FROM patients WHERE patient_id IN ({marks})", ids)
+        present = [r[0] for r in src_cur.fetchall()]
+        if not present:
+            src_cur.execute("ROLLBACK")
+            return {"patients": 0, "appointments": 0}
+
+        dst_cur.execute("BEGIN IMMEDIATE")
+        sequences = _sequences(dst_cur)
+        patients = _copy_rows(src_cur, dst_cur, "patients", "patient_id", present)
+        appointments = _copy_rows(src_cur, dst_cur, "appointments", "patient_id", present)
+        if has_notes:
+            notes.copy_patient_notes(src_cur, dst_cur, source, target, present)
+        _restore_sequences(dst_cur, sequences, target)
+        log_id = write_log(dst_cur, moved_by, "system", "rebalance_in",
+                           f"received {patients} patients and {appointments} appointments from site {source}")
+        _link_subjects(dst_cur, log_id, present)
+        dst_cur.execute("COMMIT")
+
+        marks = ",".join("?" * len(present))
+        rollups.forget_moved_patients(src_cur, present)
+        src_cur.execute(f"DELETE FROM appointments WHERE patient_id IN ({marks})", present)
+        released = notes.drop_patient_notes(src_cur, present)[1] if has_notes else []
+        src_cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'duplicate_flags'")
+        if src_cur.fetchone():
+            src_cur.execute(
+                f"DELETE FROM duplicate_flags WHERE patient_id IN ({marks}) OR candidate_id IN ({marks})", present * 2
+            )
+        src_cur.execute(f"DELETE FROM patients WHERE patient_id IN ({marks})", present)
+        log_id = write_log(src_cur, moved_by, "system", "rebalance_out",
+                           f"moved {patients} patients and {appointments} appointments to site {target}")
+        _link_subjects(src_cur, log_id, present)
+        src_cur.execute("COMMIT")
+        if released:
+            blobs.collect_garbage(released, site=source)
+        return {"patients": patients, "appointments": appointments}
+    except Exception:
+        for conn, cur in ((dst, dst_cur), (src, src_cur)):
+            if conn.in_transaction:
+                cur.execute("ROLLBACK")
+        raise
+    finally:
+        src.close()
+        dst.close()
+
+def pick_patients(source: str, limit: int) -> List[int]:
+    """The `limit` oldest patients of a site, as rebalance candidates."""
+    conn = get_db_connection(source)
+    ids = [r[0] for r in conn.execute("SELECT patient_id FROM patients ORDER BY patient_id LIMIT ?", (limit,))]
+    conn.close()
+    return ids
+
+def move_patients(patient_ids: Sequence[int], source: str, target: str, batch: int = DEFAULT_BATCH,
+                  moved_by: Optional[int] = None, progress: Optional[Callable] = None) -> Dict:
+    """
+    Move patients (and their appointments) from one site to another in batches,
+    one short transaction pair per batch. Ids not found on the source are skipped.
+    """
+    source, target = shards.resolve(source), shards.resolve(target)
+    if source == target:
+        raise ValueError("source and target site are the same")
+    ids = list(dict.fromkeys(int(pid) for pid in patient_ids))
+    totals = {"patients": 0, "appointments": 0, "batches": 0}
+    for start in range(0, len(ids), batch):
+        moved = _move_batch(source, target, ids[start:start + batch], moved_by)
+        totals["patients"] += moved["patients"]
+        totals["appointments"] += moved["appointments"]
+        totals["batches"] += 1
+        if progress:
+            progress(min(1.0, (start + batch) / len(ids)), f"moved {totals['patients']} patients")
+    # in-process availability indexes of both sites were built from the old placement
+    from database import scheduling
+    scheduling._indexes.pop(source, None)
+    scheduling._indexes.pop(target, None)
+    return totals
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Move patients between site shards")
+    parser.add_argument("--from", dest="source", required=True, help="site to move patients out of")
+    parser.add_argument("--to", dest="target", required=True, help="site to move patients into")
+    pick = parser.add_mutually_exclusive_group(required=True)
+    pick.add_argument("--ids", help="comma-separated patient ids")
+    pick.add_argument("--limit", type=int, help="move this many patients, oldest first")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    parser.add_argument("--user-id", type=int, default=None, help="recorded as the actor in the audit log")
+    args = parser.parse_args(argv)
+    ids = [int(i) for i in args.ids.split(",") if i.strip()] if args.ids else pick_patients(args.source, args.limit)
+    print(json.dumps(move_patients(ids, args.source, args.target, args.batch, args.user_id,
+                                   progress=lambda fraction, message: print(f"{fraction:.0%} {message}")), indent=2))
+
+
+if __name__ == "__main__":
+    main()
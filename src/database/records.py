@@ -0,0 +1,86 @@
+"""
+Compact row types returned by the data-layer read helpers.
+
+Records use __slots__ instead of a per-row dict, and the helpers select only the
+columns a caller (or a role) needs. Columns that were not selected are simply
+unset: `record.get("name")` returns the default and `record["name"]` raises
+KeyError, so code written against the old dict rows keeps working.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from utils.rbac import PATIENT_FIELDS_BY_ROLE
+
+
+class Record:
+    __slots__ = ()
+    COLUMNS: Sequence[str] = ()
+
+    @classmethod
+    def from_row(cls, row, columns: Sequence[str]):
+        record = cls.__new__(cls)
+        for name, value in zip(columns, row):
+            setattr(record, name, value)
+        return record
+
+    @classmethod
+    def from_rows(cls, rows: Iterable, columns: Sequence[str]) -> List["Record"]:
+        return [cls.from_row(row, columns) for row in rows]
+
+    def __getitem__(self, key: str):
+        if key not in self.COLUMNS:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default=None):
+        if key not in self.COLUMNS:
+            return default
+        return getattr(self, key, default)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.COLUMNS and hasattr(self, key)
+
+    def keys(self) -> List[str]:
+        return [c for c in self.COLUMNS if hasattr(self, c)]
+
+    def as_dict(self) -> Dict:
+        return {c: getattr(self, c) for c in self.COLUMNS if hasattr(self, c)}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.as_dict()!r})"
+
+
+PATIENT_COLUMNS = (
+    "patient_id", "name", "contact", "diagnosis", "anonymized_name", "anonymized_contact",
+    "date_added", "anon_version", "name_key", "contact_key",
+)
+
+class PatientRecord(Record):
+    __slots__ = PATIENT_COLUMNS
+    COLUMNS = PATIENT_COLUMNS
+
+
+LOG_COLUMNS = ("log_id", "user_id", "role", "action", "timestamp", "details")
+
+class LogRecord(Record):
+    __slots__ = LOG_COLUMNS
+    COLUMNS = LOG_COLUMNS
+
+
+def patient_columns(role: Optional[str] = None, columns: Optional[Sequence[str]] = None) -> List[str]:
+    """
+    Columns to SELECT for a patient query. An explicit column list wins; otherwise
+    the role's visible fields (utils.rbac); no role means every column.
+    """
+    if columns is not None:
+        wanted = columns
+    elif role is not None:
+        wanted = PATIENT_FIELDS_BY_ROLE.get(role, ("patient_id",))
+    else:
+        wanted = PATIENT_COLUMNS
+    unknown = [c for c in wanted if c not in PATIENT_COLUMNS]
+    if unknown:
+        raise ValueError(f"unknown patient columns: {unknown}")
+    return list(wanted)
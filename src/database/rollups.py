@@ -0,0 +1,243 @@
+"""
+Incremental analytics rollups.
+
+Time-series views read small pre-aggregated tables instead of scanning
+patients.date_added or logs.timestamp:
+
+    rollup_patients_daily      patients added per day
+    rollup_log_actions_hourly  audit entries per hour, role and action
+    rollup_data_access_daily   data-access events per user per day
+
+refresh_rollups() folds in only the rows above a per-source high-water mark
+stored in rollup_state, so its cost depends on how much was written since the
+last refresh, not on history length. Audit entries are followed by log_id,
+patients by the change_seq of their insert entries in the change feed
+(database/changes.py): patient ids are not in insert order once the rebalance
+tool has moved patients in from another shard, the shard's own change sequence
+is. Both are assigned under SQLite's single write lock, and the refresh reads
+from one snapshot, so no committed row can appear below a mark that has
+already been passed.
+
+Rollups count events as they happened: erasing a patient later does not
+subtract them from rollup_patients_daily. A patient moved to another shard
+(database/rebalance.py) is subtracted here and counted there, on the day
+it was added. Patient views are logged once per
+access session (database/access_log.py), so the data-access counts are
+sessions opened; exact view counts are in access_sessions.
+"""
+import datetime
+from typing import Dict, List, Optional
+
+from database import shards
+from database.connection import get_db_connection, ensure_schema
+
+REFRESH_BATCH = 50000
+# audit actions that expose patient data to the acting user
+DATA_ACCESS_ACTIONS = (
+    "data_access", "view_patient", "list_patients", "view_patient_preview",
+    "api_view_patient", "api_list_patients",
+)
+
+
+def _create_rollup_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        source TEXT PRIMARY KEY,
+        high_water INTEGER NOT NULL
+    )""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS rollup_patients_daily (
+        day TEXT PRIMARY KEY,
+        added INTEGER NOT NULL
+    )""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS rollup_log_actions_hourly (
+        hour TEXT NOT NULL,
+        role TEXT NOT NULL,
+        action TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (hour, role, action)
+    ) WITHOUT ROWID""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS rollup_data_access_daily (
+        day TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (day, user_id)
+    ) WITHOUT ROWID""")
+    # the patient fold used to follow patient_id; continue after the inserts it covered
+    cur.execute("SELECT high_water FROM rollup_state WHERE source = 'patients'")
+    row = cur.fetchone()
+    if row is not None:
+        cur.execute(
+            "INSERT OR IGNORE INTO rollup_state (source, high_water) SELECT 'patient_inserts', COALESCE(MAX(change_seq), 0) "
+            "FROM changes WHERE table_name = 'patients' AND op = 'insert' AND row_id <= ?", (row[0],)
+        )
+        cur.execute("DELETE FROM rollup_state WHERE source = 'patients'")
+    conn.commit()
+
+def _connect():
+    conn = get_db_connection()
+    ensure_schema(conn, "rollups", _create_rollup_tables)
+    return conn
+
+def _high_water(cur, source: str) -> int:
+    cur.execute("SELECT high_water FROM rollup_state WHERE source = ?", (source,))
+    row = cur.fetchone()
+    return row["high_water"] if row else 0
+
+def _set_high_water(cur, source: str, value: int):
+    cur.execute(
+        "INSERT INTO rollup_state (source, high_water) VALUES (?, ?) "
+        "ON CONFLICT(source) DO UPDATE SET high_water = excluded.high_water",
+        (source, value)
+    )
+
+def _fold_patients(cur, low: int, high: int):
+    # insert entries of rows still present, unless the row was deleted or copied in again
+    # later (moved away and back): each row is counted once. Most rows have not changed
+    # since, which spares the lookup. "+table_name": walk the change_seq range, not idx_changes_row
+    cur.execute("""
+    INSERT INTO rollup_patients_daily (day, added)
+    SELECT substr(p.date_added, 1, 10), COUNT(*) FROM changes c JOIN patients p ON p.patient_id = c.row_id
+    WHERE c.change_seq > ? AND c.change_seq <= ? AND +c.table_name = 'patients' AND c.op = 'insert'
+      AND (p.change_seq = c.change_seq OR NOT EXISTS (
+          SELECT 1 FROM changes d WHERE d.table_name = 'patients' AND d.row_id = c.row_id
+          AND d.change_seq > c.change_seq AND d.op IN ('insert', 'delete')))
+      AND p.date_added IS NOT NULL
+    GROUP BY 1
+    ON CONFLICT(day) DO UPDATE SET added = added + excluded.added""", (low, high))
+
+def _fold_logs(cur, low: int, high: int):
+    cur.execute("""
+    INSERT INTO rollup_log_actions_hourly (hour, role, action, count)
+    SELECT substr(timestamp, 1, 13), COALESCE(role, ''), COALESCE(action, ''), COUNT(*) FROM logs
+    WHERE log_id > ? AND log_id <= ? AND timestamp IS NOT NULL
+    GROUP BY 1, 2, 3
+    ON CONFLICT(hour, role, action) DO UPDATE SET count = count + excluded.count""", (low, high))
+    cur.execute(f"""
+    INSERT INTO rollup_data_access_daily (day, user_id, count)
+    SELECT substr(timestamp, 1, 10), user_id, COUNT(*) FROM logs
+    WHERE log_id > ? AND log_id <= ? AND timestamp IS NOT NULL AND user_id IS NOT NULL
+      AND action IN ({','.join('?' * len(DATA_ACCESS_ACTIONS))})
+    GROUP BY 1, 2
+    ON CONFLICT(day, user_id) DO UPDATE SET count = count + excluded.count""",
+                (low, high, *DATA_ACCESS_ACTIONS))
+
+# source -> (table, id column, filter on the rows that carry the mark, fold function)
+_SOURCES = {
+    "patient_inserts": ("changes", "change_seq", "+table_name = 'patients' AND op = 'insert'", _fold_patients),
+    "logs": ("logs", "log_id", None, _fold_logs),
+}
+
+def refresh_rollups(batch: int = REFRESH_BATCH) -> Dict[str, int]:
+    """Fold rows written since the last refresh into the rollups. Returns the high-water mark per source."""
+    conn = _connect()
+    conn.isolation_level = None
+    cur = conn.cursor()
+    marks = {}
+    try:
+        for source, (table, id_column, where, fold) in _SOURCES.items():
+            where = f" AND {where}" if where else ""
+            # cheap check without the write lock: page renders refresh on every view. The
+            # newest row of any kind: a mark may pass rows the filter skips
+            marks[source] = _high_water(cur, source)
+            cur.execute(f"SELECT MAX({id_column}) AS m FROM {table}")
+            if (cur.fetchone()["m"] or 0) <= marks[source]:
+                continue
+            while True:
+                cur.execute("BEGIN IMMEDIATE")
+                low = _high_water(cur, source)
+                cur.execute(f"SELECT MAX({id_column}) AS m FROM {table}")
+                top = cur.fetchone()["m"] or 0
+                # batch by rows, not id span: shard id ranges start far above 0 (database/shards.py)
+                cur.execute(f"SELECT {id_column} AS m FROM {table} WHERE {id_column} > ?{where} "
+                            f"ORDER BY {id_column} LIMIT 1 OFFSET ?", (low, batch - 1))
+                row = cur.fetchone()
+                high = min(top, row["m"]) if row else top
+                if high > low:
+                    fold(cur, low, high)
+                    _set_high_water(cur, source, high)
+                cur.execute("COMMIT")
+                marks[source] = max(high, low)
+                if high >= top:
+                    break
+    except Exception:
+        if conn.in_transaction:
+            cur.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return marks
+
+def forget_moved_patients(cur, patient_ids: List[int]):
+    """
+    Subtract patients that are about to be moved off this shard from
+    rollup_patients_daily, if a refresh has counted them; the target shard
+    counts them from its own insert entries. Runs in the caller's write
+    transaction, before the rows are deleted (database/rebalance.py).
+    """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_state'")
+    if cur.fetchone() is None:
+        return
+    mark = _high_water(cur, "patient_inserts")
+    # a row whose insert entry was compacted away is old enough to have been counted
+    cur.execute(f"""
+    SELECT substr(p.date_added, 1, 10) AS day, COUNT(*) AS moved FROM patients p
+    WHERE p.patient_id IN ({','.join('?' * len(patient_ids))}) AND p.date_added IS NOT NULL
+      AND COALESCE((SELECT MAX(change_seq) FROM changes WHERE table_name = 'patients' AND row_id = p.patient_id
+                    AND op = 'insert'), 0) <= ?
+    GROUP BY 1""", (*patient_ids, mark))
+    cur.executemany("UPDATE rollup_patients_daily SET added = added - ? WHERE day = ?",
+                    [(r["moved"], r["day"]) for r in cur.fetchall()])
+
+def _since(days: int) -> str:
+    return (datetime.datetime.utcnow().date() - datetime.timedelta(days=days - 1)).isoformat()
+
+def patients_added_per_day(days: int = 30, refresh: bool = True) -> List[Dict]:
+    """One row per day for the last `days` days, zero-filled."""
+    if refresh:
+        refresh_rollups()
+    start = _since(days)
+    conn = _connect()
+    counts = {r["day"]: r["added"] for r in conn.execute(
+        "SELECT day, added FROM rollup_patients_daily WHERE day >= ?", (start,)
+    )}
+    conn.close()
+    first = datetime.date.fromisoformat(start)
+    return [{"day": d, "added": counts.get(d, 0)}
+            for d in ((first + datetime.timedelta(days=i)).isoformat() for i in range(days))]
+
+def log_actions_per_hour(hours: int = 48, role: Optional[str] = None, refresh: bool = True) -> List[Dict]:
+    """Audit entries per hour and role (actions summed), oldest first."""
+    if refresh:
+        refresh_rollups()
+    start = (datetime.datetime.utcnow() - datetime.timedelta(hours=hours - 1)).strftime("%Y-%m-%dT%H")
+    conn = _connect()
+    query = "SELECT hour, role, SUM(count) AS count FROM rollup_log_actions_hourly WHERE hour >= ?"
+    params = [start]
+    if role is not None:
+        query += " AND role = ?"
+        params.append(role)
+    rows = conn.execute(query + " GROUP BY hour, role ORDER BY hour, role", params).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def data_access_per_user(days: int = 30, user_id: Optional[int] = None, refresh: bool = True) -> List[Dict]:
+    """Data-access events per user per day, oldest first, with usernames."""
+    if refresh:
+        refresh_rollups()
+    conn = _connect()
+    query = "SELECT day, user_id, count FROM rollup_data_access_daily WHERE day >= ?"
+    params = [_since(days)]
+    if user_id is not None:
+        query += " AND user_id = ?"
+        params.append(user_id)
+    rows = conn.execute(query + " ORDER BY day, user_id", params).fetchall()
+    conn.close()
+    # accounts live in the primary site, not necessarily in this shard
+    users = get_db_connection(shards.PRIMARY_SITE)
+    names = {r["user_id"]: r["username"] for r in users.execute("SELECT user_id, username FROM users")}
+    users.close()
+    return [dict(r, username=names.get(r["user_id"])) for r in rows]
@@ -0,0 +1,332 @@
+"""
+Appointment slot availability engine.
+
+Appointments belong to a provider (a user with the doctor role) and last
+duration_minutes. An in-memory interval index per (provider, day) answers
+"does this overlap?" and "what are the next N free slots?" with a couple of
+bisects per day instead of scanning the appointments table. The database stays
+the source of truth: bookings re-read the affected provider/day inside the
+write transaction before inserting.
+"""
+import bisect
+import datetime
+import heapq
+import itertools
+import re
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from database import shards
+from database.cache import cached
+from database.connection import UnitOfWork, get_db_connection, ensure_schema, next_id
+
+SLOT_STEP_MINUTES = 15
+# weekday (Mon=0) -> (open, close) in minutes after midnight, for providers without configured hours
+DEFAULT_HOURS = {wd: (9 * 60, 17 * 60) for wd in range(5)}
+NON_BLOCKING_STATUSES = ("Cancelled",)
+
+
+class SchedulingConflict(Exception):
+    pass
+
+
+class InvalidSlot(ValueError):
+    pass
+
+
+def _create_scheduling_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS provider_hours (
+        provider_id INTEGER NOT NULL,
+        weekday INTEGER NOT NULL,
+        start_minute INTEGER NOT NULL,
+        end_minute INTEGER NOT NULL,
+        PRIMARY KEY (provider_id, weekday)
+    )""")
+    conn.commit()
+
+def _connect():
+    conn = get_db_connection()
+    ensure_schema(conn, "scheduling", _create_scheduling_tables)
+    return conn
+
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_TIME = re.compile(r"(\d{2}):(\d{2})(?::(\d{2}))?")
+
+def validate_slot(date: str, time: str, duration_minutes: int = 30) -> int:
+    """Check a requested date (YYYY-MM-DD), time (HH:MM) and duration; the start in minutes or InvalidSlot."""
+    try:
+        valid_date = isinstance(date, str) and _DATE.fullmatch(date) and datetime.date.fromisoformat(date)
+    except ValueError:  # e.g. 2031-02-30
+        valid_date = None
+    if not valid_date:
+        raise InvalidSlot(f"invalid date {date!r}, expected YYYY-MM-DD")
+    match = _TIME.fullmatch(time) if isinstance(time, str) else None
+    if not match or int(match[1]) > 23 or int(match[2]) > 59 or int(match[3] or 0) > 59:
+        raise InvalidSlot(f"invalid time {time!r}, expected HH:MM")
+    if isinstance(duration_minutes, bool) or not isinstance(duration_minutes, int) or duration_minutes <= 0:
+        raise InvalidSlot("duration must be a positive number of minutes")
+    return int(match[1]) * 60 + int(match[2])
+
+def _to_minutes(value: str) -> int:
+    parts = value.split(":")
+    return int(parts[0]) * 60 + int(parts[1])
+
+def _format_minutes(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+def _align_up(minutes: int, step: int) -> int:
+    return -(-minutes // step) * step
+
+
+class DayIndex:
+    """
+    Booked intervals of one provider on one day, sorted by start. `reach[i]` is the
+    latest end among intervals 0..i, so a single bisect answers overlap queries
+    even if legacy data contains overlapping bookings.
+    """
+    __slots__ = ("starts", "ends", "ids", "reach")
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.ids: List[int] = []
+        self.reach: List[int] = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def blocking_end(self, start: int, end: int) -> Optional[int]:
+        # intervals [0, i) start before `end`; they overlap iff the furthest one reaches past `start`
+        i = bisect.bisect_left(self.starts, end)
+        if i and self.reach[i - 1] > start:
+            return self.reach[i - 1]
+        return None
+
+    def conflict_id(self, start: int, end: int) -> Optional[int]:
+        i = bisect.bisect_left(self.starts, end)
+        for j in range(i - 1, -1, -1):
+            if self.ends[j] > start:
+                return self.ids[j]
+            if self.reach[j] <= start:
+                break
+        return None
+
+    def insert(self, start: int, end: int, appointment_id: int):
+        k = bisect.bisect_right(self.starts, start)
+        self.starts.insert(k, start)
+        self.ends.insert(k, end)
+        self.ids.insert(k, appointment_id)
+        self.reach.insert(k, 0)
+        self._recompute_reach(k)
+
+    def remove(self, appointment_id: int) -> bool:
+        try:
+            k = self.ids.index(appointment_id)
+        except ValueError:
+            return False
+        for lst in (self.starts, self.ends, self.ids, self.reach):
+            del lst[k]
+        self._recompute_reach(k)
+        return True
+
+    def _recompute_reach(self, k: int):
+        best = self.reach[k - 1] if k else 0
+        for i in range(k, len(self.ends)):
+            best = max(best, self.ends[i])
+            self.reach[i] = best
+
+    def free_starts(self, open_: int, close: int, duration: int, step: int, from_minute: int = 0) -> Iterator[int]:
+        t = _align_up(max(open_, from_minute), step)
+        while t + duration <= close:
+            blocked_until = self.blocking_end(t, t + duration)
+            if blocked_until is None:
+                yield t
+                t += step
+            else:
+                t = _align_up(blocked_until, step)
+
+
+class AvailabilityIndex:
+    def __init__(self):
+        self._days: Dict[Tuple[int, str], DayIndex] = {}
+        self._hours: Dict[int, Dict[int, Tuple[int, int]]] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def providers(self) -> List[int]:
+        return sorted(self._hours)
+
+    def set_provider(self, provider_id: int, hours: Optional[Dict[int, Tuple[int, int]]] = None):
+        with self._lock:
+            self._hours[provider_id] = dict(hours) if hours else dict(DEFAULT_HOURS)
+
+    def working_hours(self, provider_id: int, day: datetime.date) -> Optional[Tuple[int, int]]:
+        return self._hours.get(provider_id, {}).get(day.weekday())
+
+    def add(self, provider_id: int, date: str, start: int, duration: int, appointment_id: int):
+        with self._lock:
+            day = self._days.get((provider_id, date))
+            if day is None:
+                day = self._days[(provider_id, date)] = DayIndex()
+            day.insert(start, start + duration, appointment_id)
+
+    def remove(self, provider_id: int, date: str, appointment_id: int) -> bool:
+        with self._lock:
+            day = self._days.get((provider_id, date))
+            return day is not None and day.remove(appointment_id)
+
+    def replace_day(self, provider_id: int, date: str, bookings: List[Tuple[int, int, int]]):
+        """Rebuild one provider/day from (start, duration, appointment_id) tuples."""
+        day = DayIndex()
+        for start, duration, appointment_id in sorted(bookings):
+            day.insert(start, start + duration, appointment_id)
+        with self._lock:
+            self._days[(provider_id, date)] = day
+
+    def conflict(self, provider_id: int, date: str, start: int, duration: int) -> Optional[str]:
+        """Return a human-readable reason the slot is unavailable, or None if it is free."""
+        day_date = datetime.date.fromisoformat(date)
+        hours = self.working_hours(provider_id, day_date)
+        if hours is None or start < hours[0] or start + duration > hours[1]:
+            return "outside the provider's working hours"
+        day = self._days.get((provider_id, date))
+        if day is not None:
+            other = day.conflict_id(start, start + duration)
+            if other is not None:
+                return f"overlaps appointment {other}"
+        return None
+
+    def provider_slots(self, provider_id: int, duration: int, after: datetime.datetime,
+                       horizon_days: int, step: int) -> Iterator[Tuple[datetime.datetime, int]]:
+        empty = DayIndex()
+        for offset in range(horizon_days + 1):
+            day_date = after.date() + datetime.timedelta(days=offset)
+            hours = self.working_hours(provider_id, day_date)
+            if hours is None:
+                continue
+            from_minute = after.hour * 60 + after.minute if offset == 0 else 0
+            day = self._days.get((provider_id, day_date.isoformat()), empty)
+            midnight = datetime.datetime.combine(day_date, datetime.time())
+            for start in day.free_starts(hours[0], hours[1], duration, step, from_minute):
+                yield midnight + datetime.timedelta(minutes=start), provider_id
+
+    def next_free_slots(self, n: int, duration: int = 30, after: Optional[datetime.datetime] = None,
+                        provider_ids: Optional[List[int]] = None, horizon_days: int = 60,
+                        step: int = SLOT_STEP_MINUTES) -> List[Tuple[datetime.datetime, int]]:
+        """
+        Earliest n (start, provider_id) pairs across providers. Each provider yields
+        its slots lazily in time order and heapq.merge interleaves them, so only
+        the days actually needed are visited.
+        """
+        after = after or datetime.datetime.now()
+        providers = provider_ids if provider_ids is not None else self.providers
+        with self._lock:
+            streams = [self.provider_slots(pid, duration, after, horizon_days, step) for pid in providers if pid in self._hours]
+            return list(itertools.islice(heapq.merge(*streams), n))
+
+
+# one index per site: appointments and working hours are per shard, providers are global
+_indexes: Dict[str, AvailabilityIndex] = {}
+_index_lock = threading.Lock()
+
+def _load_index(conn=None) -> AvailabilityIndex:
+    # conn: read through a caller's open transaction instead of a second connection
+    index = AvailabilityIndex()
+    own = conn is None
+    if own:
+        conn = _connect()
+    cur = conn.cursor()
+    hours: Dict[int, Dict[int, Tuple[int, int]]] = {}
+    cur.execute("SELECT provider_id, weekday, start_minute, end_minute FROM provider_hours")
+    for r in cur.fetchall():
+        hours.setdefault(r["provider_id"], {})[r["weekday"]] = (r["start_minute"], r["end_minute"])
+    for provider in get_providers():
+        index.set_provider(provider["user_id"], hours.get(provider["user_id"]))
+    cur.execute(
+        "SELECT appointment_id, provider_id, date, time, duration_minutes FROM appointments "
+        f"WHERE provider_id IS NOT NULL AND status NOT IN ({','.join('?' * len(NON_BLOCKING_STATUSES))})",
+        NON_BLOCKING_STATUSES
+    )
+    for r in cur.fetchall():
+        index.add(r["provider_id"], r["date"], _to_minutes(r["time"]), r["duration_minutes"], r["appointment_id"])
+    if own:
+        conn.close()
+    return index
+
+def get_availability_index(reload: bool = False, conn=None) -> AvailabilityIndex:
+    site = shards.resolve()
+    with _index_lock:
+        if site not in _indexes or reload:
+            _indexes[site] = _load_index(conn)
+        return _indexes[site]
+
+@cached("users", site=shards.PRIMARY_SITE, copy=list)
+def get_providers() -> List[Dict]:
+    conn = get_db_connection(shards.PRIMARY_SITE)
+    rows = conn.execute("SELECT user_id, username FROM users WHERE role = 'doctor' ORDER BY username").fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def set_working_hours(provider_id: int, weekday: int, start: str, end: str):
+    """Set a provider's hours for one weekday (Mon=0), e.g. ("08:30", "16:00")."""
+    start_minute, end_minute = _to_minutes(start), _to_minutes(end)
+    if not 0 <= weekday <= 6 or start_minute >= end_minute:
+        raise ValueError("invalid working hours")
+    conn = _connect()
+    conn.execute(
+        "INSERT INTO provider_hours (provider_id, weekday, start_minute, end_minute) VALUES (?,?,?,?) "
+        "ON CONFLICT(provider_id, weekday) DO UPDATE SET start_minute = excluded.start_minute, end_minute = excluded.end_minute",
+        (provider_id, weekday, start_minute, end_minute)
+    )
+    conn.commit()
+    conn.close()
+    get_availability_index(reload=True)
+
+def book_appointment(patient_id: int, patient_name: str, provider_id: int, date: str, time: str,
+                     duration_minutes: int = 30, status: str = "Scheduled", created_by: int = None,
+                     uow: Optional[UnitOfWork] = None) -> int:
+    """
+    Insert an appointment after checking the provider's hours and existing bookings.
+    Raises SchedulingConflict if the slot is taken. The provider/day is re-read under
+    a write lock, so concurrent bookings from other processes cannot double-book.
+    Pass uow to make the booking part of a larger unit of work (e.g. with its audit entry).
+    Raises InvalidSlot for a malformed date, time or duration, before anything is locked.
+    """
+    start = validate_slot(date, time, duration_minutes)
+    if uow is None:
+        get_availability_index()  # built (providers included) before the write lock is taken
+        with UnitOfWork() as own:
+            return book_appointment(patient_id, patient_name, provider_id, date, time, duration_minutes, status,
+                                    created_by, own)
+    # loaded through the unit of work: a second connection would wait for the write lock it holds
+    ensure_schema(uow.conn, "scheduling", _create_scheduling_tables)
+    index = get_availability_index(conn=uow.conn)
+    if provider_id not in index.providers:
+        index = get_availability_index(reload=True, conn=uow.conn)  # provider added since the index was built
+    rows = uow.execute(
+        "SELECT appointment_id, time, duration_minutes FROM appointments WHERE provider_id = ? AND date = ? "
+        f"AND status NOT IN ({','.join('?' * len(NON_BLOCKING_STATUSES))})",
+        (provider_id, date, *NON_BLOCKING_STATUSES)
+    ).fetchall()
+    index.replace_day(provider_id, date, [(_to_minutes(r["time"]), r["duration_minutes"], r["appointment_id"])
+                                          for r in rows])
+    reason = index.conflict(provider_id, date, start, duration_minutes)
+    if reason:
+        raise SchedulingConflict(f"Slot {date} {time[:5]} is unavailable: {reason}.")
+    appointment_id = uow.execute(
+        "INSERT INTO appointments (appointment_id, patient_name, date, time, status, created_by, created_at, patient_id, "
+        f"provider_id, duration_minutes) VALUES ({next_id('appointments')},?,?,?,?,?,?,?,?,?)",
+        (patient_name, date, _format_minutes(start), status, created_by, datetime.datetime.utcnow().isoformat(),
+         patient_id, provider_id, duration_minutes)
+    ).lastrowid
+    if status not in NON_BLOCKING_STATUSES:
+        # the index only learns about the booking once it is committed
+        uow.after_commit(lambda: index.add(provider_id, date, start, duration_minutes, appointment_id))
+    return appointment_id
+
+def find_free_slots(n: int = 5, duration_minutes: int = 30, after: Optional[datetime.datetime] = None,
+                    provider_ids: Optional[List[int]] = None) -> List[Dict]:
+    slots = get_availability_index().next_free_slots(n, duration_minutes, after, provider_ids)
+    return [{"provider_id": pid, "date": dt.date().isoformat(), "time": dt.time().isoformat()} for dt, pid in slots]
@@ -0,0 +1,140 @@
+"""
+Site shards: one SQLite file per hospital site or department.
+
+    HOSPITAL_SHARDS="north=north.db,south=/srv/hms/south.db"
+
+maps site keys to database files; relative paths sit next to hospital.db. The
+primary site, "main", is always DB_PATH and also holds what is shared by the
+whole group: user accounts (which double as the provider list) and the job
+scheduler. Every other table exists in every shard. Patient, appointment and
+log ids are allocated from a per-shard range (SHARD_ID_SPAN apart, in the order
+sites are configured, so append new sites at the end), which keeps ids unique
+across the group: merged reports can key on them and the rebalance tool
+(database/rebalance.py) moves rows without renumbering them.
+
+The current site is a context variable, so the data-layer helpers keep their
+signatures:
+
+    with use_site("north"):
+        add_patient(...)              # written to north.db
+
+get_db_connection(site) and UnitOfWork(site) override it for one connection.
+Threads do not inherit the variable; fan_out() sets it in each worker.
+"""
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from config import Config
+
+PRIMARY_SITE = "main"
+# ids below 10**12 per shard; SQLite integers go to 9.2 * 10**18
+SHARD_ID_SPAN = 10 ** 12
+
+_current_site: contextvars.ContextVar = contextvars.ContextVar("hospital_site", default=None)
+_configured: Optional[Dict[str, str]] = None
+
+
+class UnknownSite(KeyError):
+    pass
+
+
+def _parse(spec: str) -> Dict[str, str]:
+    shards = {}
+    for part in spec.split(","):
+        site, _, path = part.partition("=")
+        site, path = site.strip(), path.strip()
+        if not site:
+            continue
+        if not path or site == PRIMARY_SITE:
+            raise ValueError(f"invalid shard entry '{part.strip()}' (expected site=path, '{PRIMARY_SITE}' is DB_PATH)")
+        shards[site] = path
+    return shards
+
+def _shards() -> Dict[str, str]:
+    global _configured
+    if _configured is None:
+        _configured = _parse(Config.SHARDS)
+    return _configured
+
+def sites() -> List[str]:
+    """All site keys, the primary first."""
+    return [PRIMARY_SITE, *_shards()]
+
+def is_sharded() -> bool:
+    return bool(_shards())
+
+def resolve(site: Optional[str] = None) -> str:
+    """The given site, else the current one, else the primary; raises UnknownSite."""
+    site = site or _current_site.get() or PRIMARY_SITE
+    if site != PRIMARY_SITE and site not in _shards():
+        raise UnknownSite(site)
+    return site
+
+def current_site() -> Optional[str]:
+    """The site set by use_site(), or None when nothing is pinned."""
+    return _current_site.get()
+
+def shard_path(site: Optional[str] = None) -> Path:
+    from database import connection
+    site = resolve(site)
+    if site == PRIMARY_SITE:
+        return Path(connection.DB_PATH)
+    path = Path(_shards()[site])
+    return path if path.is_absolute() else Path(connection.DB_PATH).parent / path
+
+def id_base(site: Optional[str] = None) -> int:
+    """First id of the site's range; ids above it are allocated by AUTOINCREMENT."""
+    return sites().index(resolve(site)) * SHARD_ID_SPAN
+
+def site_of_id(row_id: int) -> Optional[str]:
+    """The shard an id was allocated by (it may have been moved since)."""
+    index = int(row_id) // SHARD_ID_SPAN
+    all_sites = sites()
+    return all_sites[index] if 0 <= index < len(all_sites) else None
+
+@contextlib.contextmanager
+def use_site(site: Optional[str]):
+    """Route connections opened in this context to `site`; None leaves the current routing alone."""
+    if site is None:
+        yield resolve()
+        return
+    token = _current_site.set(resolve(site))
+    try:
+        yield site
+    finally:
+        _current_site.reset(token)
+
+def fan_out(func: Callable[[str], object], only: Optional[Iterable[str]] = None,
+            workers: Optional[int] = None) -> Dict[str, object]:
+    """
+    Call func(site) for every site (or `only`) in parallel, each with its site
+    pinned, and return {site: result}. Exceptions propagate after all calls finish.
+    """
+    targets = list(only) if only is not None else sites()
+    for site in targets:
+        resolve(site)
+
+    def call(site):
+        with use_site(site):
+            return func(site)
+
+    if len(targets) <= 1:
+        return {site: call(site) for site in targets}
+    with ThreadPoolExecutor(max_workers=workers or min(len(targets), Config.SHARD_FANOUT_WORKERS),
+                            thread_name_prefix="shard") as pool:
+        futures = {site: pool.submit(call, site) for site in targets}
+        return {site: future.result() for site, future in futures.items()}
+
+def sum_counts(results: Dict[str, Dict]) -> Dict:
+    """Add up per-site dicts of numbers (nested dicts are merged the same way)."""
+    total: Dict = {}
+    for counts in results.values():
+        for key, value in counts.items():
+            if isinstance(value, dict):
+                total[key] = sum_counts({"a": total.get(key, {}), "b": value})
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                total[key] = total.get(key, 0) + value
+    return total
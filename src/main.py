@@ -2,7 +2,13 @@ from streamlit import session_state as st_session
 import streamlit as st
 from utils.auth import authenticate_user, get_user_role, get_user_by_username
 from utils.gdpr import check_user_consent
-from database.connection import get_db_connection, get_patients, anonymize_all_patients, add_patient, export_patients_csv, log_action
+from database.connection import get_patients, add_patient, get_logs
+from database.access_log import log_accesses
+from utils.scheduler import enqueue_job, get_job_runs, get_jobs, get_scheduler
+from database.dedup import get_duplicate_flags
+from database.audit import verify_incremental
+from database.shards import PRIMARY_SITE, sites, use_site
+from config import Config
 
 import tempfile
 import os
@@ -12,6 +18,9 @@ def main_app():
     st.set_page_config(page_title="Hospital Management Dashboard", layout="wide")
     st.title("Hospital Management Dashboard")
 
+    if Config.SCHEDULER_ENABLED:
+        get_scheduler()
+
     # Authentication
     if "user" not in st_session:
         username, password = authenticate_user()
@@ -20,6 +29,8 @@ def main_app():
             st_session.role = get_user_role(username)
             user_row = get_user_by_username(username)
             st_session.user_id = user_row["user_id"] if user_row else None
+            # staff work in their home site's shard; admins can switch below
+            st_session.site = (user_row or {}).get("site") or PRIMARY_SITE
             
     if "user" not in st_session:
         st.info("Please login to continue.")
@@ -36,48 +47,81 @@ def main_app():
 
     st.sidebar.markdown(f"**User:** {st_session.user}  \n**Role:** {st_session.role}")
     st.sidebar.markdown(f"Started: {st_session.started_at.isoformat()} UTC")
+    if st_session.role == "admin" and len(sites()) > 1:
+        all_sites = sites()
+        current = st_session.get("site", PRIMARY_SITE)
+        st_session.site = st.sidebar.selectbox("Site", all_sites,
+                                               index=all_sites.index(current) if current in all_sites else 0)
 
-    # Route by role
-    if st_session.role == "admin":
-        show_admin_dashboard()
-    elif st_session.role in ("doctor", "receptionist"):
-        show_staff_dashboard()
-    else:
-        st.error("Unauthorized role.")
+    # Route by role, with connections going to the session's site
+    with use_site(st_session.get("site")):
+        if st_session.role == "admin":
+            show_admin_dashboard()
+        elif st_session.role in ("doctor", "receptionist"):
+            show_staff_dashboard()
+        else:
+            st.error("Unauthorized role.")
 
 def show_admin_dashboard():
     st.subheader("Admin Dashboard")
     col1, col2 = st.columns([3,1])
     with col1:
         st.markdown("### Patients")
-        patients = get_patients()
+        patients = get_patients(columns=("patient_id", "anonymized_name", "anonymized_contact"))
         if patients:
             for p in patients:
                 st.markdown(f"- ID: {p['patient_id']} | Anon: {p.get('anonymized_name') or '(not anonymized)'} | Contact(anon): {p.get('anonymized_contact') or '(not anonymized)'}")
         else:
             st.info("No patients yet.")
     with col2:
+        # maintenance runs on the background scheduler; the page only queues it
+        user_id, role = st_session.get("user_id"), st_session.get("role")
         if st.button("Anonymize all patient data"):
-            anonymize_all_patients(triggered_by_user_id=st_session.get("user_id"), role=st_session.get("role"))
-            st.success("All patients anonymized. Action logged.")
+            run_id = enqueue_job("anonymize_all", requested_by=user_id, role=role)
+            st.success(f"Anonymization queued (job #{run_id}).")
         if st.button("Export CSV"):
-            tmp = tempfile.gettempdir()
-            path = os.path.join(tmp, "patients_export.csv")
-            export_patients_csv(path)
-            with open(path, "rb") as f:
+            run_id = enqueue_job("export_csv", {"path": os.path.join(tempfile.gettempdir(), "patients_export.csv")},
+                                 requested_by=user_id, role=role)
+            st.success(f"Export queued (job #{run_id}).")
+        exports = get_job_runs(limit=1, task="export_csv")
+        if exports and exports[0]["status"] == "succeeded" and os.path.exists(exports[0]["result"]["path"]):
+            with open(exports[0]["result"]["path"], "rb") as f:
                 st.download_button("Download patients CSV", f, file_name="patients_export.csv")
+        if st.button("Check data retention"):
+            run_id = enqueue_job("retention_check", {"retention_days": 365}, requested_by=user_id, role=role)
+            st.success(f"Retention check queued (job #{run_id}).")
+        if st.button("Purge expired records"):
+            run_id = enqueue_job("purge_expired", {"retention_days": 365}, requested_by=user_id, role=role)
+            st.success(f"Purge queued (job #{run_id}).")
         if st.button("View Audit Logs"):
             show_audit_logs()
+    show_maintenance_jobs()
+
+def show_maintenance_jobs():
+    st.markdown("### Maintenance jobs")
+    if st.button("Refresh job status"):
+        pass  # any widget interaction re-runs the script and re-reads job_runs
+    for run in get_job_runs(limit=10):
+        label = f"#{run['run_id']} {run['task']} — {run['status']} (attempt {run['attempts']}/{run['max_attempts']})"
+        if run["status"] in ("queued", "running", "retrying"):
+            st.progress(run["progress"], text=label)
+        else:
+            st.markdown(f"- {label}" + (f" — {run['message']}" if run.get("message") else ""))
+    with st.expander("Schedules"):
+        for job in get_jobs():
+            state = "enabled" if job["enabled"] else "disabled"
+            st.markdown(f"- **{job['job_name']}** `{job['schedule']}` ({job['task']}, {state}) next: {job['next_run_at']} UTC")
 
 def show_staff_dashboard():
     st.subheader("Staff Dashboard")
-    patients = get_patients()
     role = st_session.get("role")
+    patients = get_patients(role=role)
     if role == "doctor":
         st.markdown("### Patients (anonymized view)")
+        log_accesses(st_session.get("user_id"), role, "view_patient", [p["patient_id"] for p in patients],
+                     details="viewed patient_id={patient_id}")
         for p in patients:
             st.markdown(f"- ID: {p['patient_id']} | Name: {p.get('anonymized_name') or '(not anonymized)'} | Contact: {p.get('anonymized_contact') or '(not anonymized)'} | Diagnosis: {p.get('diagnosis')}")
-            log_action(st_session.get("user_id"), role, "view_patient", f"viewed patient_id={p['patient_id']}")
     elif role == "receptionist":
         st.markdown("### Add patient")
         with st.form("add_patient"):
@@ -88,23 +132,26 @@ def show_staff_dashboard():
             if submitted:
                 pid = add_patient(name, contact, diagnosis, added_by_user_id=st_session.get("user_id"), role=role)
                 st.success(f"Patient added with id {pid}")
+                flags = get_duplicate_flags(pid)
+                if flags:
+                    st.warning("Possible duplicate of patient ID(s): " + ", ".join(str(f["candidate_id"]) for f in flags))
         st.markdown("Receptionists cannot view sensitive (raw) patient identifiers.")
         # show only anonymized fields if present
+        log_accesses(st_session.get("user_id"), role, "list_patients", [p["patient_id"] for p in patients],
+                     details="listed patient_id={patient_id}")
         for p in patients:
             anon_name = p.get("anonymized_name") or "(masked)"
             anon_contact = p.get("anonymized_contact") or "(masked)"
             st.markdown(f"- ID: {p['patient_id']} | Name: {anon_name} | Contact: {anon_contact}")
-            log_action(st_session.get("user_id"), role, "list_patients", f"listed patient_id={p['patient_id']}")
     else:
         st.error("Role not supported in staff dashboard.")
 
 def show_audit_logs():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM logs ORDER BY log_id DESC LIMIT 200")
-    rows = cur.fetchall()
-    conn.close()
+    rows = get_logs(200)
     st.markdown("### Integrity Audit Log (Admin only)")
+    integrity = verify_incremental()
+    if not integrity["ok"]:
+        st.error(f"Audit chain verification failed: {integrity['error']}")
     for r in rows:
         st.markdown(f"- [{r['timestamp']}] user_id={r['user_id']} role={r['role']} action={r['action']} details={r['details']}")
 
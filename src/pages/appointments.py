@@ -1,6 +1,9 @@
 import streamlit as st
 from streamlit import session_state as st_session
-from database.connection import get_db_connection, log_action
+from database.connection import get_db_connection, get_appointments, add_appointment, UnitOfWork
+from database.dedup import search_patients_by_name
+from database.scheduling import get_providers, book_appointment, find_free_slots, InvalidSlot, SchedulingConflict
+from database.shards import use_site
 from utils.gdpr import check_user_consent
 import hashlib
 import datetime
@@ -11,21 +14,6 @@ def _anon_label(name: str) -> str:
     h = hashlib.sha256(name.encode("utf-8")).hexdigest()
     return f"ANON_{h[:8]}"
 
-def _ensure_appointments_table(conn):
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS appointments (
-        appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_name TEXT,
-        date TEXT,
-        time TEXT,
-        status TEXT,
-        created_by INTEGER,
-        created_at TEXT
-    )
-    """)
-    conn.commit()
-
 def display_appointments():
     st.title("Appointment Management")
 
@@ -39,12 +27,10 @@ def display_appointments():
         return
 
     conn = get_db_connection()
-    _ensure_appointments_table(conn)
     cur = conn.cursor()
 
     # Fetch appointments
-    cur.execute("SELECT appointment_id, patient_name, date, time, status FROM appointments ORDER BY appointment_id DESC")
-    rows = cur.fetchall()
+    rows = get_appointments()
 
     if rows:
         st.markdown("### Appointments")
@@ -57,12 +43,27 @@ def display_appointments():
     else:
         st.info("No appointments found.")
 
+    providers = get_providers()
+    provider_names = {p["user_id"]: p["username"] for p in providers}
+
+    st.markdown("---")
+    st.markdown("### Next Free Slots")
+    slot_duration = st.number_input("Slot length (minutes)", min_value=5, max_value=240, value=30, step=5, key="slot_duration")
+    slots = find_free_slots(n=5, duration_minutes=int(slot_duration))
+    if slots:
+        for slot in slots:
+            st.write(f"- {slot['date']} {slot['time'][:5]} with {provider_names.get(slot['provider_id'], slot['provider_id'])}")
+    else:
+        st.info("No free slots in the next 60 days.")
+
     st.markdown("---")
     st.markdown("### Add Appointment")
     with st.form("add_appointment_form"):
         patient_input = st.text_input("Patient Name or ID")
         date_val = st.date_input("Date", value=datetime.date.today())
         time_val = st.time_input("Time", value=datetime.datetime.now().time().replace(second=0, microsecond=0))
+        provider_id = st.selectbox("Provider", options=list(provider_names), format_func=lambda pid: provider_names[pid]) if providers else None
+        duration = st.number_input("Duration (minutes)", min_value=5, max_value=240, value=30, step=5)
         status = st.selectbox("Status", ["Scheduled", "Completed", "Cancelled"])
         submitted = st.form_submit_button("Submit")
         if submitted:
@@ -89,32 +90,39 @@ def display_appointments():
                         cur.execute("SELECT patient_id, name FROM patients WHERE lower(name) = lower(?)", (patient_input_str,))
                         matches = cur.fetchall()
                         if not matches:
-                            # try partial match
-                            cur.execute("SELECT patient_id, name FROM patients WHERE lower(name) LIKE lower(?)", (f"%{patient_input_str}%",))
-                            matches = cur.fetchall()
+                            # phonetic match on the indexed name_key block (tolerates typos)
+                            matches = search_patients_by_name(patient_input_str)
                         if not matches:
                             st.error("Patient not found. Please create the patient record first (Patients page) or try a different name/ID.")
                             conn.close()
+                        elif len(matches) > 1:
+                            # ambiguous: never guess, ask for the ID instead
+                            options = "; ".join(
+                                f"ID {m['patient_id']}" + (f" ({m['name']})" if role == "admin" else "") for m in matches[:10]
+                            )
+                            st.warning(f"Multiple patients match that name. Please enter the patient ID instead: {options}")
                         else:
-                            if len(matches) > 1:
-                                # multiple matches: pick first but notify user
-                                found = dict(matches[0])
-                                st.warning(f"Multiple patients matched the name. Using ID {found['patient_id']} / Name '{found['name']}'.")
-                            else:
-                                found = dict(matches[0])
+                            found = dict(matches[0])
 
                     if found:
                         # use canonical patient name from DB
                         canonical_name = found.get("name") or patient_input_str
-                        created_at = datetime.datetime.utcnow().isoformat()
-                        cur.execute(
-                            "INSERT INTO appointments (patient_name, date, time, status, created_by, created_at) VALUES (?,?,?,?,?,?)",
-                            (canonical_name, date_val.isoformat(), time_val.isoformat(), status, user_id, created_at)
-                        )
-                        conn.commit()
-                        appointment_id = cur.lastrowid
-                        log_action(user_id, role, "create_appointment", f"appointment_id={appointment_id} patient_id={found.get('patient_id')}")
+                        with UnitOfWork() as uow:
+                            if provider_id is not None:
+                                appointment_id = book_appointment(
+                                    found.get("patient_id"), canonical_name, provider_id, date_val.isoformat(),
+                                    time_val.isoformat(), duration_minutes=int(duration), status=status,
+                                    created_by=user_id, uow=uow
+                                )
+                            else:
+                                appointment_id = add_appointment(canonical_name, date_val.isoformat(), time_val.isoformat(), status,
+                                                                 created_by=user_id, patient_id=found.get("patient_id"),
+                                                                 duration_minutes=int(duration), uow=uow)
+                            uow.log(user_id, role, "create_appointment", f"appointment_id={appointment_id} patient_id={found.get('patient_id')}",
+                                    patient_id=found.get("patient_id"))
                         st.success(f"Appointment created (id={appointment_id}) for patient '{canonical_name}'.")
+                except (SchedulingConflict, InvalidSlot) as e:
+                    st.error(str(e))
                 except Exception as e:
                     st.error(f"Failed to create appointment: {e}")
 
@@ -132,4 +140,5 @@ def main():
     display_appointments()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with use_site(st_session.get("site")):
+        main()
\ No newline at end of file
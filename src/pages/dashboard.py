@@ -2,16 +2,20 @@ import streamlit as st
 from datetime import datetime
 from streamlit import session_state as st_session
 
-from database.connection import get_db_connection, get_patients
-from database.connection import log_action
+from database.connection import get_db_connection, get_patients, get_logs
+from database.access_log import log_accesses
+from database.shards import use_site
 from utils.gdpr import get_gdpr_compliance_report
-from components.charts import plot_patient_statistics
+from database.audit import verify_incremental, verify_full
+from database.rollups import patients_added_per_day, log_actions_per_hour, data_access_per_user
+from components.charts import plot_patient_statistics, plot_patients_added, plot_log_activity, plot_data_access
 
 
 def display_dashboard():
     st.title(" Hospital Management Dashboard")
 
-    if not get_gdpr_compliance_report():
+    report = get_gdpr_compliance_report()
+    if not report:
         st.error(" This application is NOT GDPR compliant. Access denied.")
         return
 
@@ -45,20 +49,29 @@ def display_dashboard():
     st.markdown("---")
     st.subheader(" Patient Summary")
 
-    patients = get_patients()
-    total_patients = len(patients)
+    patients = get_patients(role=role)
+    if role == "admin" and "error" not in report:
+        # counted on every site shard in parallel by the compliance report
+        total_patients = report["total_patients"]
+        anonymized = report["anonymized_patients"]
+    else:
+        total_patients = len(patients)
+        anonymized = sum(1 for p in patients if p.get("anonymized_name"))
 
     col1, col2, col3 = st.columns(3)
     col1.metric("Total Patients", total_patients)
-    col2.metric("Anonymized Records", sum(1 for p in patients if p.get("anonymized_name")))
-    col3.metric("Raw Records", sum(1 for p in patients if not p.get("anonymized_name")))
+    col2.metric("Anonymized Records", anonymized)
+    col3.metric("Raw Records", total_patients - anonymized)
 
-    # Chart data example
     stats_data = [
         {"category": "Total", "count": total_patients},
-        {"category": "Anonymized", "count": col2.metric},
+        {"category": "Anonymized", "count": anonymized},
     ]
     plot_patient_statistics(stats_data)
+    if role == "admin" and len(report.get("sites", {})) > 1:
+        st.table([{"site": site, "patients": c["total"], "anonymized": c["anonymized"], "audit entries": c["logs"]}
+                  for site, c in report["sites"].items()])
+    plot_patients_added(patients_added_per_day(30))
 
 
     st.markdown("---")
@@ -67,6 +80,9 @@ def display_dashboard():
     if not patients:
         st.info("No patient records available.")
     else:
+        # one audit entry per patient per access session, not per rerun
+        log_accesses(user_id, role, "view_patient_preview", [p["patient_id"] for p in patients[:10]],
+                     details="pid={patient_id}")
         for p in patients[:10]: 
             pid = p["patient_id"]
 
@@ -88,21 +104,32 @@ def display_dashboard():
             else:
                 st.write(f"- **ID {pid}** | Restricted view")
 
-            log_action(
-                user_id=user_id,
-                role=role,
-                action="view_patient_preview",
-                details=f"pid={pid}"
-            )
 
 
     if role == "admin":
+        st.markdown("---")
+        st.subheader(" Activity Trends")
+        plot_log_activity(log_actions_per_hour(48, refresh=False))
+        plot_data_access(data_access_per_user(30, refresh=False))
+
         st.markdown("---")
         st.subheader(" Integrity Audit Logs")
 
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM logs ORDER BY log_id DESC LIMIT 50")
-        logs = cur.fetchall()
+        # only rows written since the last signed checkpoint are re-hashed here
+        integrity = verify_incremental()
+        if integrity["ok"]:
+            st.success(f"Audit chain intact ({integrity['checked']} entries since last checkpoint).")
+        else:
+            st.error(f"Audit chain verification failed: {integrity['error']}")
+        if st.button("Verify entire audit log"):
+            full = verify_full()
+            if full["ok"]:
+                st.success(f"Verified {full['checked']} entries in {full['ranges']} ranges "
+                           f"({full['redacted']} redacted by erasure).")
+            else:
+                st.error(f"Audit chain verification failed: {full['error']}")
+
+        logs = get_logs(50)
 
         if not logs:
             st.info("No logs available.")
@@ -117,4 +144,5 @@ def display_dashboard():
 
 
 if __name__ == "__main__":
-    display_dashboard()
+    with use_site(st_session.get("site")):
+        display_dashboard()
@@ -3,6 +3,11 @@ from streamlit import session_state as st_session
 from database.connection import get_patients, add_patient, log_action
 from utils.gdpr import anonymize_data
 from utils.gdpr import log_data_access
+from utils.rbac import has_permission
+from database.dedup import get_duplicate_flags
+from database.access_log import log_accesses
+from database.notes import add_attachment, add_note, list_notes, note_counts, read_note_text, open_note
+from database.shards import use_site
 
 def view_patients():
     st.title("Patient Records")
@@ -11,16 +16,23 @@ def view_patients():
     role = st_session.get("role", "")
     user_id = st_session.get("user_id")
 
-    patients = get_patients()
+    patients = get_patients(role=role)
     
     # Display existing patients
     st.markdown("### Patient List")
     if not patients:
         st.info("No patient records found.")
     else:
+        if role in ("admin", "doctor", "receptionist"):
+            # logged once per access session, before the records are shown
+            log_data_access(user_id, role, "patient_record", patient_ids=[p["patient_id"] for p in patients])
+        # one grouped query for the whole list; notes themselves load on demand below
+        counts = note_counts(p["patient_id"] for p in patients) if has_permission(role, "view_notes") else {}
         for p in patients:
             pid = p["patient_id"]
             st.subheader(f"Patient ID: {pid}")
+            if counts.get(pid):
+                st.caption(f"{counts[pid]} clinical note(s) / attachment(s)")
 
             # Admin can see raw data + anonymized
             if role == "admin":
@@ -29,21 +41,17 @@ def view_patients():
                 st.write(f"Diagnosis: {p.get('diagnosis')}")
                 st.write(f"Anonymized Name: {p.get('anonymized_name') or '(not anonymized)'}")
                 st.write(f"Anonymized Contact: {p.get('anonymized_contact') or '(not anonymized)'}")
-                log_data_access(user_id, role, "patient_record", patient_id=pid)
 
             # Doctor sees anonymized view only
             elif role == "doctor":
                 st.write(f"Anonymized Name: {p.get('anonymized_name') or '(not anonymized)'}")
                 st.write(f"Anonymized Contact: {p.get('anonymized_contact') or '(not anonymized)'}")
                 st.write(f"Diagnosis: {p.get('diagnosis')}")
-                log_data_access(user_id, role, "patient_record", patient_id=pid)
 
             # Receptionist cannot view sensitive raw identifiers
             elif role == "receptionist":
                 st.write(f"Anonymized Name: {p.get('anonymized_name') or '(masked)'}")
                 st.write(f"Anonymized Contact: {p.get('anonymized_contact') or '(masked)'}")
-                st.write(f"Diagnosis: {p.get('diagnosis')}")
-                log_data_access(user_id, role, "patient_record", patient_id=pid)
 
             else:
                 st.write("Role not recognized. Minimal view shown.")
@@ -52,7 +60,7 @@ def view_patients():
             # Admin or authorized staff can anonymize a single patient
             cols = st.columns([1, 3])
             if cols[0].button("Anonymize", key=f"anon_{pid}"):
-                if role in ("admin", "doctor"):
+                if has_permission(role, "anonymize_patient"):
                     ok = anonymize_data(pid, user_id=user_id, role=role)
                     if ok:
                         st.success(f"Patient {pid} anonymized.")
@@ -63,11 +71,14 @@ def view_patients():
 
             st.markdown("---")
 
+    if has_permission(role, "view_notes") and patients:
+        show_clinical_notes(patients, user_id, role)
+
     # Add patient record button (only for admin and receptionist)
     st.markdown("---")
     col1, col2 = st.columns([2, 1])
     
-    can_add = role in ("admin", "receptionist")
+    can_add = has_permission(role, "add_patient")
     
     with col2:
         if st.button("➕ Add Patient Record", disabled=not can_add):
@@ -78,6 +89,15 @@ def view_patients():
             st.info(f"⚠️ Role '{role}' does not have permission to add patient records.")
         else:
             st.info("⚠️ You must be logged in with appropriate role to add patient records.")
+    # Probable duplicates flagged when the last record was added
+    if st_session.get("duplicate_warning"):
+        new_id, candidate_ids = st_session.duplicate_warning
+        st.warning(
+            f"Patient {new_id} may be a duplicate of existing record(s): "
+            + ", ".join(f"ID {cid}" for cid in candidate_ids)
+            + ". Please review before creating appointments."
+        )
+        st_session.duplicate_warning = None
     # Show form only if button was clicked
     if st_session.get("show_add_patient_form", False):
         st.markdown("### Add Patient Record")
@@ -132,11 +152,55 @@ def view_patients():
                             role=role
                         )
                         st.success(f"✓ Patient record added successfully (ID: {patient_id})")
+                        flags = get_duplicate_flags(patient_id)
+                        if flags:
+                            st_session.duplicate_warning = (patient_id, [f["candidate_id"] for f in flags])
                         st_session.show_add_patient_form = False
                         st.balloons()
                         st.rerun()
                     except Exception as e:
                         st.error(f"Failed to add patient record: {e}")
 
+def show_clinical_notes(patients, user_id, role):
+    st.markdown("---")
+    st.markdown("### Clinical notes")
+    pid = st.selectbox("Patient", [p["patient_id"] for p in patients], key="notes_patient")
+    refs = list_notes(pid)
+    if not refs:
+        st.info("No notes or attachments for this patient.")
+    for ref in refs:
+        label = f"{ref['created_at'][:16]} · {ref['title'] or ref['kind']} · {ref['size']:,} bytes"
+        with st.expander(label):
+            # content is read from the blob store only when asked for
+            if ref["kind"] == "note":
+                st.caption(ref["preview"])
+                if st.button("Show full note", key=f"note_{ref['note_id']}"):
+                    log_accesses(user_id, role, "view_note", [pid], details="read notes of patient_id={patient_id}")
+                    st.text(read_note_text(ref["note_id"]))
+            elif st.button("Prepare download", key=f"attachment_{ref['note_id']}"):
+                log_accesses(user_id, role, "view_note", [pid], details="read notes of patient_id={patient_id}")
+                _, f = open_note(ref["note_id"])
+                with f:
+                    st.download_button("Download", f.read(), file_name=ref["title"] or f"attachment-{ref['note_id']}",
+                                       mime=ref["content_type"], key=f"download_{ref['note_id']}")
+
+    if has_permission(role, "add_note"):
+        with st.form("add_note_form", clear_on_submit=True):
+            title = st.text_input("Title")
+            text = st.text_area("Note", height=150)
+            upload = st.file_uploader("Attachment (optional)")
+            if st.form_submit_button("Save"):
+                if text.strip():
+                    add_note(pid, text, title or None, created_by=user_id, role=role)
+                if upload is not None:
+                    # streamed from the upload buffer into the blob store in chunks
+                    add_attachment(pid, upload, upload.name, upload.type or "application/octet-stream",
+                                   created_by=user_id, role=role)
+                if text.strip() or upload is not None:
+                    st.rerun()
+                else:
+                    st.error("Write a note or choose a file.")
+
 if __name__ == "__main__":
-    view_patients()
\ No newline at end of file
+    with use_site(st_session.get("site")):
+        view_patients()
\ No newline at end of file
@@ -1,14 +1,11 @@
 import streamlit as st
 from streamlit import session_state as st_session
-from database.connection import get_db_connection
+from database.connection import get_staff
+from database.shards import PRIMARY_SITE
 
 def display_staff_records():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    # treat users table as staff registry for this demo
-    cur.execute("SELECT user_id, username, role FROM users ORDER BY role, username")
-    rows = cur.fetchall()
-    conn.close()
+    # treat users table as staff registry for this demo (shared by all sites)
+    rows = get_staff()
 
     st.title("Staff Records")
 
@@ -20,6 +17,7 @@ def display_staff_records():
         st.subheader(f"Name: {r['username']}")
         st.write(f"Role: {r['role']}")
         st.write(f"User ID: {r['user_id']}")
+        st.write(f"Site: {r['site'] or PRIMARY_SITE}")
         st.markdown("---")
 
 def main():
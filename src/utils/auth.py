@@ -1,13 +1,11 @@
 import streamlit as st
 from database.connection import get_db_connection, log_action
-import hashlib
+from database.shards import PRIMARY_SITE
+from utils.passwords import check_user_password, hash_password
 from typing import Optional, Tuple
 
-def _hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
-
 def get_user_by_username(username: str) -> Optional[dict]:
-    conn = get_db_connection()
+    conn = get_db_connection(PRIMARY_SITE)
     cur = conn.cursor()
     cur.execute("SELECT * FROM users WHERE username = ?", (username,))
     row = cur.fetchone()
@@ -17,17 +15,15 @@ def get_user_by_username(username: str) -> Optional[dict]:
     return dict(row)
 
 def verify_user(username: str, password: str) -> bool:
-    row = get_user_by_username(username)
-    if not row:
-        return False
-    return row["password_hash"] == _hash_password(password)
+    # scrypt verification runs on the password worker pool; legacy hashes are upgraded on success
+    return check_user_password(get_user_by_username(username), password)
 
 def get_user_role(username: str) -> Optional[str]:
     row = get_user_by_username(username)
     return row["role"] if row else None
 
 def _user_count() -> int:
-    conn = get_db_connection()
+    conn = get_db_connection(PRIMARY_SITE)
     cur = conn.cursor()
     cur.execute("SELECT COUNT(*) as c FROM users")
     r = cur.fetchone()
@@ -35,12 +31,12 @@ def _user_count() -> int:
     return int(r["c"]) if r else 0
 
 def _create_user(username: str, password: str, role: str = "admin") -> Optional[int]:
-    conn = get_db_connection()
+    conn = get_db_connection(PRIMARY_SITE)
     cur = conn.cursor()
     try:
         cur.execute(
             "INSERT INTO users (username, password_hash, role) VALUES (?,?,?)",
-            (username, _hash_password(password), role)
+            (username, hash_password(password), role)
         )
         conn.commit()
         user_id = cur.lastrowid
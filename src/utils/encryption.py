@@ -1,19 +1,24 @@
-from cryptography.fernet import Fernet
+import hashlib
+
+def _fernet(key):
+    # cryptography is only loaded the first time something is actually encrypted
+    from cryptography.fernet import Fernet
+    return Fernet(key)
 
 def generate_key():
+    from cryptography.fernet import Fernet
     return Fernet.generate_key()
 
 def encrypt_data(data, key):
-    fernet = Fernet(key)
+    fernet = _fernet(key)
     encrypted_data = fernet.encrypt(data.encode())
     return encrypted_data
 
 def decrypt_data(encrypted_data, key):
-    fernet = Fernet(key)
+    fernet = _fernet(key)
     decrypted_data = fernet.decrypt(encrypted_data).decode()
     return decrypted_data
 
 def anonymize_data(data):
     # Simple anonymization example (hashing)
-    import hashlib
     return hashlib.sha256(data.encode()).hexdigest()
\ No newline at end of file
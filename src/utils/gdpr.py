@@ -1,6 +1,11 @@
 import streamlit as st
 from streamlit import session_state as st_session
-from database.connection import get_db_connection, log_action
+from database.connection import get_db_connection, write_log, anonymize_patient, get_patients, get_logs
+from database.connection import UnitOfWork, count_patients
+from database.erasure import erase_patients_everywhere
+from database.access_log import record_accesses, get_accessed_subjects
+from database.shards import PRIMARY_SITE, fan_out, sum_counts
+from database.cache import cached
 import datetime
 import json
 from typing import List, Dict
@@ -24,22 +29,22 @@ def check_user_consent(user: str) -> bool:
         return True
     return False
 
-def log_data_access(user_id: int, role: str, data_accessed: str, patient_id: int = None):
+def log_data_access(user_id: int, role: str, data_accessed: str, patient_id: int = None,
+                    patient_ids: List[int] = None):
     """
     Log all data access events for audit trail and compliance.
-    Records who accessed what data and when for accountability.
+    Records who accessed what data and when for accountability. Repeated access
+    to the same patients is coalesced into access sessions (database/access_log.py).
     """
     try:
+        ids = list(patient_ids or []) + ([patient_id] if patient_id else [])
+        if ids:
+            label = data_accessed.replace("{", "{{").replace("}", "}}")
+            record_accesses(user_id, role, "data_access", ids, details=f"accessed {label} for patient_id={{patient_id}}")
+            return
         conn = get_db_connection()
         cur = conn.cursor()
-        timestamp = datetime.datetime.utcnow().isoformat()
-        details = f"accessed {data_accessed}"
-        if patient_id:
-            details += f" for patient_id={patient_id}"
-        cur.execute(
-            "INSERT INTO logs (user_id, role, action, timestamp, details) VALUES (?,?,?,?,?)",
-            (user_id, role, "data_access", timestamp, details)
-        )
+        write_log(cur, user_id, role, "data_access", f"accessed {data_accessed}")
         conn.commit()
         conn.close()
     except Exception as e:
@@ -52,34 +57,13 @@ def anonymize_data(patient_id: int, user_id: int = None, role: str = None) -> bo
     Returns True on success, False otherwise.
     """
     try:
-        from database.connection import anonymize_name, mask_contact
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Fetch patient record
-        cur.execute("SELECT name, contact FROM patients WHERE patient_id = ?", (patient_id,))
-        row = cur.fetchone()
-        if not row:
-            return False
-        
-        name = row["name"] or ""
-        contact = row["contact"] or ""
-        
-        # Generate anonymized versions
-        anon_name = anonymize_name(name, patient_id)
-        anon_contact = mask_contact(contact)
-        
-        # Update patient record
-        cur.execute(
-            "UPDATE patients SET anonymized_name = ?, anonymized_contact = ? WHERE patient_id = ?",
-            (anon_name, anon_contact, patient_id)
-        )
-        conn.commit()
-        conn.close()
-        
-        # Log the anonymization action
-        if user_id and role:
-            log_action(user_id, role, "anonymize_patient", f"anonymized patient_id={patient_id}")
+        # the update and its audit entry commit together
+        with UnitOfWork() as uow:
+            if not anonymize_patient(patient_id, uow):
+                return False
+            # always audited; jobs and tools without a user act as "system"
+            uow.log(user_id, role or "system", "anonymize_patient", f"anonymized patient_id={patient_id}",
+                    patient_id=patient_id)
         
         return True
     except Exception as e:
@@ -132,31 +116,26 @@ def data_retention_policy(retention_days: int = 365) -> Dict:
 def delete_expired_records(retention_days: int = 365, user_id: int = None, role: str = None) -> bool:
     """
     Permanently delete patient records that exceed retention period.
-    Only callable by Admin. Logs deletion for audit trail.
+    Only callable by Admin, or by the scheduler as role "system" (no user).
+    Logs deletion for audit trail.
     """
     try:
-        if role != "admin":
+        if role not in ("admin", "system"):
             st.error("Only admins can delete expired records.")
             return False
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
         # Calculate cutoff date
         cutoff_date = (datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)).isoformat()
         
-        # Get count before deletion
-        cur.execute("SELECT COUNT(*) as count FROM patients WHERE date_added < ?", (cutoff_date,))
-        deleted_count = cur.fetchone()["count"]
-        
-        # Delete expired records
-        cur.execute("DELETE FROM patients WHERE date_added < ?", (cutoff_date,))
-        conn.commit()
-        conn.close()
-        
-        # Log the deletion
-        if user_id:
-            log_action(user_id, role, "delete_expired", f"deleted {deleted_count} expired patient records")
+        # Selection, cascading erasure and the audit entry form one transaction
+        # on the current site (shards the patients were moved away from commit on their own)
+        with UnitOfWork() as uow:
+            expired_ids = [r["patient_id"] for r in uow.execute(
+                "SELECT patient_id FROM patients WHERE date_added < ?", (cutoff_date,)
+            ).fetchall()]
+            receipts = erase_patients_everywhere(expired_ids, requested_by=user_id, role=role, uow=uow)
+            deleted_count = sum(r["counts"]["patients"] for r in receipts)
+            uow.log(user_id, role, "delete_expired", f"deleted {deleted_count} expired patient records")
         
         return True
     except Exception as e:
@@ -169,7 +148,7 @@ def export_user_data(user_id: int) -> Dict:
     Returns a structured dict containing user info, patient records they created, and access logs.
     """
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(PRIMARY_SITE)
         cur = conn.cursor()
         
         # Get user info
@@ -182,12 +161,12 @@ def export_user_data(user_id: int) -> Dict:
         
         # Get patient records created/modified by this user
         # (we'll get all patients for this demo; in production, track creator_id)
-        cur.execute("SELECT * FROM patients")
-        all_patients = [dict(r) for r in cur.fetchall()]
+        # (records are converted to dicts only here, for JSON serialisation)
+        all_patients = [p.as_dict() for p in get_patients()]
         
-        # Get access logs for this user
-        cur.execute("SELECT * FROM logs WHERE user_id = ? ORDER BY timestamp DESC", (user_id,))
-        user_logs = [dict(r) for r in cur.fetchall()]
+        # Get access logs for this user, and every patient they accessed (coalesced sessions)
+        user_logs = [r.as_dict() for r in get_logs(limit=-1, user_id=user_id)]
+        accessed = get_accessed_subjects(user_id)
         
         conn.close()
         
@@ -196,6 +175,7 @@ def export_user_data(user_id: int) -> Dict:
             "user": user_info,
             "patients_in_system": all_patients,
             "access_logs": user_logs,
+            "accessed_patients": accessed,
             "data_portability_notice": "This data export is provided in compliance with GDPR Article 20 (Data Portability)."
         }
         
@@ -223,74 +203,94 @@ def right_to_be_forgotten(patient_id: int, user_id: int = None, role: str = None
     Permanently removes patient record and all associated data.
     Only callable by Admin.
     """
+    receipts = right_to_be_forgotten_batch([patient_id], user_id, role)
+    return bool(receipts) and receipts[0]["found"]
+
+def right_to_be_forgotten_batch(patient_ids: List[int], user_id: int = None, role: str = None) -> List[Dict]:
+    """
+    Erase several data subjects in one transaction: patient rows, their
+    appointments and duplicate flags, and the details of audit entries about them.
+    Returns one erasure receipt per subject (empty list on failure).
+    Only callable by Admin.
+    """
     try:
         if role != "admin":
             st.error("Only admins can execute right to be forgotten.")
-            return False
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Delete patient record
-        cur.execute("DELETE FROM patients WHERE patient_id = ?", (patient_id,))
-        conn.commit()
-        conn.close()
-        
-        # Log the action
-        if user_id:
-            log_action(user_id, role, "right_to_be_forgotten", f"deleted patient_id={patient_id} per GDPR Article 17")
-        
-        return True
+            return []
+        return erase_patients_everywhere(patient_ids, requested_by=user_id, role=role)
     except Exception as e:
         st.error(f"Failed to execute right to be forgotten: {e}")
-        return False
+        return []
+
+# the 7-day window moves with the clock, not only with writes
+COMPLIANCE_COUNTS_MAX_AGE = 60
+
+@cached("patients", "logs", max_age=COMPLIANCE_COUNTS_MAX_AGE, copy=dict)
+def _site_compliance_counts(site: str) -> Dict:
+    """
+    Patient and audit counts of one site shard (run per site by fan_out), cached
+    until that site's patients or audit log change in any process.
+    """
+    counts = count_patients()
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    # Total log entries
+    cur.execute("SELECT COUNT(*) as count FROM logs")
+    counts["logs"] = cur.fetchone()["count"]
+    
+    # Recent access logs (last 7 days)
+    seven_days_ago = (datetime.datetime.utcnow() - datetime.timedelta(days=7)).isoformat()
+    cur.execute("SELECT COUNT(*) as count FROM logs WHERE timestamp > ?", (seven_days_ago,))
+    counts["recent_logs"] = cur.fetchone()["count"]
+    
+    conn.close()
+    return counts
+
+@cached("users", site=PRIMARY_SITE)
+def _user_counts():
+    # Accounts are shared by all sites
+    conn = get_db_connection(PRIMARY_SITE)
+    cur = conn.cursor()
+    
+    # Total users
+    cur.execute("SELECT COUNT(*) as count FROM users")
+    total_users = cur.fetchone()["count"]
+    
+    # Users by role
+    cur.execute("SELECT role, COUNT(*) as count FROM users GROUP BY role")
+    users_by_role = {row["role"]: row["count"] for row in cur.fetchall()}
+    
+    conn.close()
+    return total_users, users_by_role
 
 def get_gdpr_compliance_report() -> Dict:
     """
     Generate a comprehensive GDPR compliance report.
     Includes consent records, anonymization status, data retention, and audit trail summary.
+    Patient and audit counts are collected from all site shards in parallel and summed.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        per_site = fan_out(_site_compliance_counts)
+        totals = sum_counts(per_site)
+        total_patients = totals["total"]
+        anonymized_patients = totals["anonymized"]
+        total_logs = totals["logs"]
+        recent_logs = totals["recent_logs"]
         
-        # Total users
-        cur.execute("SELECT COUNT(*) as count FROM users")
-        total_users = cur.fetchone()["count"]
-        
-        # Total patients
-        cur.execute("SELECT COUNT(*) as count FROM patients")
-        total_patients = cur.fetchone()["count"]
-        
-        # Anonymized patients
-        cur.execute("SELECT COUNT(*) as count FROM patients WHERE anonymized_name IS NOT NULL")
-        anonymized_patients = cur.fetchone()["count"]
-        
-        # Total log entries
-        cur.execute("SELECT COUNT(*) as count FROM logs")
-        total_logs = cur.fetchone()["count"]
-        
-        # Recent access logs (last 7 days)
-        seven_days_ago = (datetime.datetime.utcnow() - datetime.timedelta(days=7)).isoformat()
-        cur.execute("SELECT COUNT(*) as count FROM logs WHERE timestamp > ?", (seven_days_ago,))
-        recent_logs = cur.fetchone()["count"]
-        
-        # Users by role
-        cur.execute("SELECT role, COUNT(*) as count FROM users GROUP BY role")
-        users_by_role = {row["role"]: row["count"] for row in cur.fetchall()}
-        
-        conn.close()
+        total_users, users_by_role = _user_counts()
         
         report = {
             "report_date": datetime.datetime.utcnow().isoformat(),
             "total_users": total_users,
-            "users_by_role": users_by_role,
+            "users_by_role": dict(users_by_role),
             "total_patients": total_patients,
             "anonymized_patients": anonymized_patients,
             "anonymization_rate": f"{(anonymized_patients/total_patients*100):.1f}%" if total_patients > 0 else "0%",
             "total_audit_logs": total_logs,
             "recent_logs_7days": recent_logs,
-            "gdpr_status": "Compliant" if anonymized_patients > 0 and total_logs > 0 else "Needs Review"
+            "gdpr_status": "Compliant" if anonymized_patients > 0 and total_logs > 0 else "Needs Review",
+            "sites": per_site
         }
         
         return report
@@ -0,0 +1,182 @@
+"""
+Password hashing with scrypt (hashlib, OpenSSL).
+
+Stored format, with a per-user random salt and the cost it was hashed with:
+
+    scrypt$n=32768,r=8,p=1$<salt, base64>$<key, base64>
+
+so the cost can be raised later without invalidating existing hashes. Older
+accounts hold an unsalted SHA-256 hex digest; those still verify, and the first
+successful login rewrites them (and hashes made with an outdated cost) in the
+current format.
+
+A verification takes ~100 ms of CPU by design. It runs on a small worker pool
+(Config.PASSWORD_HASH_WORKERS): OpenSSL releases the GIL, so concurrent logins
+proceed in parallel up to the pool size, and a burst of logins queues instead
+of occupying every core. Pick the cost for a login latency budget with:
+
+    cd src
+    python -m utils.passwords calibrate --budget-ms 150
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from config import Config
+
+SCHEME = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+_LEGACY_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+# verified in place of a missing account's hash; no password matches the random key
+_DUMMY_SALT = os.urandom(SALT_BYTES)
+_DUMMY_KEY = os.urandom(KEY_BYTES)
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # OpenSSL refuses to allocate more than maxmem; scrypt needs about 128 * r * (n + p) bytes
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES,
+                          maxmem=128 * r * (n + p + 2) + 1024 * 1024)
+
+def current_params() -> Dict[str, int]:
+    return {"n": Config.PASSWORD_SCRYPT_N, "r": Config.PASSWORD_SCRYPT_R, "p": Config.PASSWORD_SCRYPT_P}
+
+def hash_password(password: str, n: Optional[int] = None, r: Optional[int] = None, p: Optional[int] = None) -> str:
+    params = current_params()
+    n, r, p = n or params["n"], r or params["r"], p or params["p"]
+    salt = os.urandom(SALT_BYTES)
+    return f"{SCHEME}$n={n},r={r},p={p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+def _parse(stored: str) -> Optional[Dict]:
+    try:
+        scheme, params, salt, key = stored.split("$")
+        if scheme != SCHEME:
+            return None
+        values = dict(item.split("=") for item in params.split(","))
+        return {"n": int(values["n"]), "r": int(values["r"]), "p": int(values["p"]),
+                "salt": _unb64(salt), "key": _unb64(key)}
+    except (ValueError, KeyError, AttributeError):
+        return None
+
+def verify_password(password: str, stored: Optional[str]) -> bool:
+    """Check a password against a stored hash (scrypt or legacy SHA-256). Runs on the calling thread."""
+    if not stored:
+        return False
+    if _LEGACY_SHA256.match(stored):
+        return hmac.compare_digest(stored, hashlib.sha256(password.encode("utf-8")).hexdigest())
+    parsed = _parse(stored)
+    if parsed is None:
+        return False
+    return hmac.compare_digest(parsed["key"], _scrypt(password, parsed["salt"], parsed["n"], parsed["r"], parsed["p"]))
+
+def _dummy_hash() -> str:
+    # at the configured cost, so it takes as long as verifying a current account's hash
+    params = current_params()
+    return f"{SCHEME}$n={params['n']},r={params['r']},p={params['p']}${_b64(_DUMMY_SALT)}${_b64(_DUMMY_KEY)}"
+
+def needs_rehash(stored: Optional[str]) -> bool:
+    """True for legacy hashes and for hashes made with a different cost than the configured one."""
+    parsed = _parse(stored or "")
+    return parsed is None or {k: parsed[k] for k in ("n", "r", "p")} != current_params()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=Config.PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+        return _pool
+
+def _reset_pool(workers: Optional[int] = None):
+    # for benchmarks: resize the pool
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool = None
+        if workers:
+            Config.PASSWORD_HASH_WORKERS = workers
+
+def _upgrade(user_id: int, old_hash: str, password: str):
+    from database.connection import get_db_connection
+    from database.shards import PRIMARY_SITE
+    new_hash = hash_password(password)
+    conn = get_db_connection(PRIMARY_SITE)
+    # only replace the hash that was verified: a password change in between wins
+    conn.execute("UPDATE users SET password_hash = ? WHERE user_id = ? AND password_hash = ?",
+                 (new_hash, user_id, old_hash))
+    conn.commit()
+    conn.close()
+
+def check_user_password(user: Optional[Dict], password: str, timeout: Optional[float] = None) -> bool:
+    """
+    Verify a login on the worker pool for a users row (user_id, password_hash).
+    On success, a legacy or outdated hash is rewritten in the background. An
+    unknown user costs the same scrypt work as a wrong password, so the response
+    time does not tell which usernames exist.
+    """
+    pool = _executor()
+    if not user or not user.get("password_hash"):
+        pool.submit(verify_password, password, _dummy_hash()).result(timeout)
+        return False
+    stored = user["password_hash"]
+    if not pool.submit(verify_password, password, stored).result(timeout):
+        return False
+    if needs_rehash(stored):
+        pool.submit(_upgrade, user["user_id"], stored, password)
+    return True
+
+
+def calibrate(budget_ms: float, r: int = 8, p: int = 1, max_n: int = 2 ** 20, rounds: int = 3) -> Dict:
+    """The largest power-of-two n whose median hash time on this machine fits budget_ms."""
+    best, timings = None, {}
+    n = 2 ** 12
+    while n <= max_n:
+        samples = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            _scrypt("calibration", os.urandom(SALT_BYTES), n, r, p)
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[n] = round(sorted(samples)[len(samples) // 2], 1)
+        if timings[n] > budget_ms:
+            break
+        best = n
+        n *= 2
+    return {"budget_ms": budget_ms, "n": best, "r": r, "p": p, "ms": timings.get(best),
+            "memory_mib": round(128 * r * best / 2 ** 20, 1) if best else None, "timings_ms": timings}
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Password hashing tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cal = sub.add_parser("calibrate", help="pick the scrypt cost for a login latency budget")
+    cal.add_argument("--budget-ms", type=float, default=150.0, help="time one verification may take")
+    cal.add_argument("--r", type=int, default=8)
+    cal.add_argument("--p", type=int, default=1)
+    args = parser.parse_args(argv)
+    result = calibrate(args.budget_ms, args.r, args.p)
+    print(json.dumps(result, indent=2))
+    if result["n"]:
+        print(f"# set in the environment:\nPASSWORD_SCRYPT_N={result['n']}\nPASSWORD_SCRYPT_R={result['r']}\n"
+              f"PASSWORD_SCRYPT_P={result['p']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+from typing import Dict, Optional
+
+# Role-based access rules shared by the Streamlit pages and the HTTP API.
+
+ROLES = ("admin", "doctor", "receptionist")
+
+# which patient columns each role is allowed to see
+PATIENT_FIELDS_BY_ROLE = {
+    "admin": ("patient_id", "name", "contact", "diagnosis", "anonymized_name", "anonymized_contact", "date_added"),
+    "doctor": ("patient_id", "anonymized_name", "anonymized_contact", "diagnosis", "date_added"),
+    "receptionist": ("patient_id", "anonymized_name", "anonymized_contact", "date_added"),
+}
+
+# action -> roles allowed to perform it
+PERMISSIONS = {
+    "view_patients": ("admin", "doctor", "receptionist"),
+    "add_patient": ("admin", "receptionist"),
+    "anonymize_patient": ("admin", "doctor"),
+    "anonymize_all": ("admin",),
+    "export_patients": ("admin",),
+    "view_appointments": ("admin", "doctor", "receptionist"),
+    "create_appointment": ("admin", "doctor", "receptionist"),
+    "view_raw_appointment_names": ("admin",),
+    "view_audit_logs": ("admin",),
+    "read_changes": ("admin",),
+    "view_notes": ("admin", "doctor"),
+    "add_note": ("admin", "doctor"),
+}
+
+def has_permission(role: Optional[str], action: str) -> bool:
+    return role in PERMISSIONS.get(action, ())
+
+def project_patient(patient: Dict, role: Optional[str]) -> Dict:
+    """
+    Return only the patient fields the given role may see.
+    Unknown roles get the patient id and nothing else.
+    """
+    fields = PATIENT_FIELDS_BY_ROLE.get(role, ("patient_id",))
+    return {k: patient.get(k) for k in fields}
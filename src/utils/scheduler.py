@@ -0,0 +1,540 @@
+"""
+Background maintenance scheduler.
+
+Jobs (retention checks, purges, anonymization, CSV export) are queued in the
+job_runs table and executed on a small thread pool, so admin pages only enqueue
+work and poll its progress. Job state lives in SQLite, which lets several
+Streamlit workers (or a sidecar started with `python -m utils.scheduler`)
+share one queue and one global concurrency limit. The queue lives in the
+primary site's database; a run can be pinned to one site shard with a "site"
+param (enqueue_job adds the caller's current site), and scheduled
+per-database maintenance without one runs on every site in turn.
+"""
+import datetime
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from config import Config
+from database.connection import get_db_connection, ensure_schema
+from database.shards import PRIMARY_SITE, current_site, resolve, sites, use_site
+
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 30
+# a running job whose lease was not renewed for this long is assumed dead and requeued;
+# the owning worker renews its leases on every tick, however long the job runs
+LEASE_SECONDS = 300
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+def _create_job_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_name TEXT PRIMARY KEY,
+        task TEXT NOT NULL,
+        schedule TEXT,
+        params TEXT,
+        enabled INTEGER NOT NULL DEFAULT 1,
+        next_run_at TEXT,
+        last_enqueued_at TEXT
+    )""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS job_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_name TEXT,
+        task TEXT NOT NULL,
+        params TEXT,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        result TEXT,
+        requested_by INTEGER,
+        role TEXT,
+        queued_at TEXT,
+        run_after TEXT,
+        started_at TEXT,
+        finished_at TEXT,
+        lease_owner TEXT,
+        lease_expires TEXT
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_job_runs_status ON job_runs(status, run_after)")
+    for job_name, task, schedule, params, enabled in DEFAULT_JOBS:
+        cur.execute(
+            "INSERT OR IGNORE INTO jobs (job_name, task, schedule, params, enabled, next_run_at) VALUES (?,?,?,?,?,?)",
+            (job_name, task, schedule, json.dumps(params), enabled, cron_next(schedule, _now()).isoformat())
+        )
+    conn.commit()
+
+def _connect():
+    conn = get_db_connection(PRIMARY_SITE)
+    ensure_schema(conn, "jobs", _create_job_tables)
+    return conn
+
+
+# Cron expressions: "minute hour day-of-month month day-of-week" (UTC),
+# supporting *, lists (1,15), ranges (1-5) and steps (*/10).
+
+def _parse_field(field: str, lo: int, hi: int) -> set:
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = int(a), int(b)
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end or step < 1:
+            raise ValueError(f"invalid cron field '{field}'")
+        values.update(range(start, end + 1, step))
+    return values
+
+def parse_cron(expr: str):
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError(f"cron expression needs 5 fields: '{expr}'")
+    minutes = _parse_field(fields[0], 0, 59)
+    hours = _parse_field(fields[1], 0, 23)
+    doms = _parse_field(fields[2], 1, 31)
+    months = _parse_field(fields[3], 1, 12)
+    dows = {d % 7 for d in _parse_field(fields[4], 0, 7)}  # 0 and 7 are both Sunday
+    return minutes, hours, doms, months, dows, fields[2] == "*", fields[4] == "*"
+
+def cron_next(expr: str, after: datetime.datetime) -> datetime.datetime:
+    """
+    Return the first minute strictly after `after` that matches the cron expression.
+    """
+    minutes, hours, doms, months, dows, dom_any, dow_any = parse_cron(expr)
+
+    def day_ok(t):
+        dom_ok = t.day in doms
+        dow_ok = (t.weekday() + 1) % 7 in dows
+        if dom_any or dow_any:
+            return dom_ok and dow_ok
+        return dom_ok or dow_ok  # classic cron: either restriction may match
+
+    t = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    limit = t + datetime.timedelta(days=366 * 5)
+    while t < limit:
+        if t.month not in months:
+            t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+        elif not day_ok(t):
+            t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+        elif t.hour not in hours:
+            t = t.replace(minute=0) + datetime.timedelta(hours=1)
+        elif t.minute not in minutes:
+            t += datetime.timedelta(minutes=1)
+        else:
+            return t
+    raise ValueError(f"cron expression never fires: '{expr}'")
+
+
+# Tasks receive a progress(fraction, message=None) callback plus the run params
+# and return a JSON-serialisable result. Raising marks the attempt as failed.
+
+def _each_site(task: Callable) -> Callable:
+    # per-database maintenance: the run's pinned site, else every site in turn
+    # (results keyed by site when there are several)
+    @functools.wraps(task)
+    def run(progress, **params):
+        pinned = current_site()
+        targets = [pinned] if pinned else sites()
+        results = {}
+        for i, site in enumerate(targets):
+            with use_site(site):
+                results[site] = task(lambda f, m=None, i=i: progress((i + f) / len(targets), m), **params)
+        return results[targets[0]] if len(targets) == 1 else results
+    return run
+
+def _task_retention_check(progress, retention_days=365, **_):
+    from utils.gdpr import data_retention_policy
+    report = data_retention_policy(retention_days)
+    if "error" in report:
+        raise RuntimeError(report["error"])
+    return {"expired_count": report["expired_count"], "cutoff_date": report["cutoff_date"]}
+
+def _task_purge_expired(progress, retention_days=365, user_id=None, role=None, **_):
+    from utils.gdpr import delete_expired_records
+    # queued by an admin: their id and role; scheduled: the system actor, so the purge is still audited
+    if not delete_expired_records(retention_days, user_id=user_id, role=role if user_id else "system"):
+        raise RuntimeError("delete_expired_records failed")
+    return {"retention_days": retention_days}
+
+def _task_anonymize_all(progress, user_id=None, role=None, **_):
+    from database.connection import anonymize_all_patients
+    repaired = anonymize_all_patients(triggered_by_user_id=user_id, role=role or "system")
+    return {"repaired": repaired}
+
+def _task_export_csv(progress, path=None, **_):
+    from database.connection import export_patients_csv
+    path = path or os.path.join(tempfile.gettempdir(), "patients_export.csv")
+    progress(0.1, "exporting patients")
+    return {"path": export_patients_csv(path)}
+
+def _task_duplicate_scan(progress, **_):
+    from database.dedup import find_duplicate_clusters
+    clusters = find_duplicate_clusters(progress=progress)
+    return {"clusters": len(clusters), "patients": sum(len(c) for c in clusters)}
+
+def _task_audit_checkpoint(progress, user_id=None, **_):
+    from database.audit import create_checkpoint
+    result = create_checkpoint(created_by=user_id)
+    if not result["ok"]:
+        raise RuntimeError(result["error"])
+    return {"checked": result["checked"], "checkpoint_id": result.get("checkpoint_id")}
+
+def _task_backup(progress, keep=None, **_):
+    from database.backup import create_backup
+    result = create_backup(keep=keep, progress=progress)
+    return {"path": result["path"], "bytes": result["bytes"], "rotated": len(result["rotated"])}
+
+def _task_rollup_refresh(progress, **_):
+    from database.rollups import refresh_rollups
+    return refresh_rollups()
+
+def _task_changes_compact(progress, keep_days=None, **_):
+    from database.changes import compact_changes
+    return compact_changes(keep_days)
+
+def _task_blob_gc(progress, **_):
+    from database.blobs import collect_garbage
+    return collect_garbage()
+
+def _task_parquet_export(progress, out_dir=None, tables=("logs",), **_):
+    from database.connection import DATA_DIR
+    from database.parquet_export import export_all
+    out_dir = out_dir or str(DATA_DIR / "exports")
+    site = resolve()
+    return export_all(out_dir if site == PRIMARY_SITE else os.path.join(out_dir, site), tables)
+
+TASKS: Dict[str, Callable] = {
+    "retention_check": _each_site(_task_retention_check),
+    "purge_expired": _each_site(_task_purge_expired),
+    "anonymize_all": _each_site(_task_anonymize_all),
+    "export_csv": _task_export_csv,
+    "duplicate_scan": _each_site(_task_duplicate_scan),
+    "audit_checkpoint": _each_site(_task_audit_checkpoint),
+    "backup": _each_site(_task_backup),
+    "rollup_refresh": _each_site(_task_rollup_refresh),
+    "parquet_export": _each_site(_task_parquet_export),
+    "changes_compact": _each_site(_task_changes_compact),
+    "blob_gc": _each_site(_task_blob_gc),
+}
+
+# (job_name, task, cron schedule, params, enabled). Purging is destructive and the
+# audit export copies audit data out of the database, so both ship disabled until
+# an admin turns them on.
+DEFAULT_JOBS = [
+    ("nightly_retention_check", "retention_check", "0 2 * * *", {"retention_days": 365}, 1),
+    ("hourly_anonymization_repair", "anonymize_all", "15 * * * *", {}, 1),
+    ("nightly_duplicate_scan", "duplicate_scan", "30 2 * * *", {}, 1),
+    ("hourly_audit_checkpoint", "audit_checkpoint", "45 * * * *", {}, 1),
+    ("nightly_backup", "backup", "0 1 * * *", {}, 1),
+    ("rollup_refresh", "rollup_refresh", "*/5 * * * *", {}, 1),
+    ("nightly_audit_export", "parquet_export", "0 4 * * *", {"tables": ["logs"]}, 0),
+    ("weekly_expired_purge", "purge_expired", "0 3 * * 0", {"retention_days": 365}, 0),
+    ("nightly_change_compaction", "changes_compact", "30 3 * * *", {}, 1),
+    ("nightly_blob_gc", "blob_gc", "45 3 * * *", {}, 1),
+]
+
+def register_task(name: str, func: Callable):
+    TASKS[name] = func
+
+
+# Queue API used by the admin pages
+
+def enqueue_job(task: str, params: Optional[Dict] = None, requested_by: int = None, role: str = None,
+                job_name: str = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+    if task not in TASKS:
+        raise ValueError(f"unknown task '{task}'")
+    params = dict(params or {})
+    if current_site() and "site" not in params:
+        params["site"] = current_site()
+    conn = _connect()
+    cur = conn.cursor()
+    now = _now().isoformat()
+    cur.execute(
+        "INSERT INTO job_runs (job_name, task, params, status, max_attempts, requested_by, role, queued_at, run_after) "
+        "VALUES (?,?,?,?,?,?,?,?,?)",
+        (job_name, task, json.dumps(params), "queued", max_attempts, requested_by, role, now, now)
+    )
+    run_id = cur.lastrowid
+    conn.commit()
+    conn.close()
+    if _scheduler is not None:
+        _scheduler.wake()
+    return run_id
+
+def get_run(run_id: int) -> Optional[Dict]:
+    conn = _connect()
+    row = conn.execute("SELECT * FROM job_runs WHERE run_id = ?", (run_id,)).fetchone()
+    conn.close()
+    return _run_dict(row) if row else None
+
+def get_job_runs(limit: int = 20, task: str = None) -> List[Dict]:
+    conn = _connect()
+    if task:
+        rows = conn.execute("SELECT * FROM job_runs WHERE task = ? ORDER BY run_id DESC LIMIT ?", (task, limit)).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM job_runs ORDER BY run_id DESC LIMIT ?", (limit,)).fetchall()
+    conn.close()
+    return [_run_dict(r) for r in rows]
+
+def get_jobs() -> List[Dict]:
+    conn = _connect()
+    rows = conn.execute("SELECT * FROM jobs ORDER BY job_name").fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def set_job_schedule(job_name: str, schedule: str = None, enabled: bool = None, params: Dict = None) -> bool:
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM jobs WHERE job_name = ?", (job_name,))
+    job = cur.fetchone()
+    if not job:
+        conn.close()
+        return False
+    schedule = schedule or job["schedule"]
+    cur.execute(
+        "UPDATE jobs SET schedule = ?, enabled = ?, params = ?, next_run_at = ? WHERE job_name = ?",
+        (schedule, int(job["enabled"] if enabled is None else enabled),
+         job["params"] if params is None else json.dumps(params),
+         cron_next(schedule, _now()).isoformat(), job_name)
+    )
+    conn.commit()
+    conn.close()
+    return True
+
+def _run_dict(row) -> Dict:
+    d = dict(row)
+    for key in ("params", "result"):
+        if d.get(key):
+            d[key] = json.loads(d[key])
+    return d
+
+
+class JobScheduler:
+    def __init__(self, concurrency: int = None, tick: float = None):
+        self.concurrency = concurrency or Config.SCHEDULER_CONCURRENCY
+        self.tick_seconds = tick or Config.SCHEDULER_TICK
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job")
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._loop, name="job-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        self._stop.set()
+        self._wake.set()
+        if self._thread and wait:
+            self._thread.join()
+        self.executor.shutdown(wait=wait)
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                traceback.print_exc()
+            self._wake.wait(self.tick_seconds)
+            self._wake.clear()
+
+    def tick(self):
+        with self._lock:
+            running = self._in_flight
+        if running:
+            self._renew_leases()
+        self._recover_expired_leases()
+        self._enqueue_due_jobs()
+        while True:
+            with self._lock:
+                if self._in_flight >= self.concurrency:
+                    return
+            run = self._claim()
+            if not run:
+                return
+            with self._lock:
+                self._in_flight += 1
+            self.executor.submit(self._execute, run)
+
+    def _enqueue_due_jobs(self):
+        conn = _connect()
+        cur = conn.cursor()
+        now = _now()
+        cur.execute(
+            "SELECT * FROM jobs WHERE enabled = 1 AND schedule IS NOT NULL AND next_run_at <= ?",
+            (now.isoformat(),)
+        )
+        for job in cur.fetchall():
+            next_run = cron_next(job["schedule"], now).isoformat()
+            # conditional update: only one worker wins the right to enqueue this slot
+            cur.execute(
+                "UPDATE jobs SET next_run_at = ?, last_enqueued_at = ? WHERE job_name = ? AND next_run_at = ?",
+                (next_run, now.isoformat(), job["job_name"], job["next_run_at"])
+            )
+            if cur.rowcount != 1:
+                continue
+            cur.execute(
+                "SELECT 1 FROM job_runs WHERE job_name = ? AND status IN ('queued','retrying','running') LIMIT 1",
+                (job["job_name"],)
+            )
+            if not cur.fetchone():  # don't pile up runs behind a slow one
+                cur.execute(
+                    "INSERT INTO job_runs (job_name, task, params, status, max_attempts, role, queued_at, run_after) "
+                    "VALUES (?,?,?,?,?,?,?,?)",
+                    (job["job_name"], job["task"], job["params"], "queued", DEFAULT_MAX_ATTEMPTS, "system",
+                     now.isoformat(), now.isoformat())
+                )
+            conn.commit()
+        conn.close()
+
+    def _renew_leases(self):
+        # heartbeat: long runs (a large shard's backup, verify_full) keep their lease while this process lives
+        conn = _connect()
+        conn.execute(
+            "UPDATE job_runs SET lease_expires = ? WHERE status = 'running' AND lease_owner = ?",
+            ((_now() + datetime.timedelta(seconds=LEASE_SECONDS)).isoformat(), self.owner)
+        )
+        conn.commit()
+        conn.close()
+
+    def _recover_expired_leases(self):
+        conn = _connect()
+        now = _now().isoformat()
+        conn.execute(
+            "UPDATE job_runs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'retrying' END, "
+            "message = 'worker lost', run_after = ?, lease_owner = NULL "
+            "WHERE status = 'running' AND lease_expires < ?",
+            (now, now)
+        )
+        conn.commit()
+        conn.close()
+
+    def _claim(self) -> Optional[Dict]:
+        conn = _connect()
+        conn.isolation_level = None
+        cur = conn.cursor()
+        now = _now()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute("SELECT COUNT(*) AS c FROM job_runs WHERE status = 'running'")
+            if cur.fetchone()["c"] >= self.concurrency:
+                cur.execute("ROLLBACK")
+                return None
+            cur.execute(
+                "SELECT * FROM job_runs WHERE status IN ('queued','retrying') AND run_after <= ? ORDER BY run_id LIMIT 1",
+                (now.isoformat(),)
+            )
+            row = cur.fetchone()
+            if not row:
+                cur.execute("ROLLBACK")
+                return None
+            cur.execute(
+                "UPDATE job_runs SET status = 'running', attempts = attempts + 1, started_at = ?, "
+                "lease_owner = ?, lease_expires = ?, message = NULL WHERE run_id = ?",
+                (now.isoformat(), self.owner, (now + datetime.timedelta(seconds=LEASE_SECONDS)).isoformat(), row["run_id"])
+            )
+            cur.execute("COMMIT")
+            run = _run_dict(row)
+            run["attempts"] += 1
+            return run
+        except Exception:
+            if conn.in_transaction:
+                cur.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _execute(self, run: Dict):
+        run_id = run["run_id"]
+        last_write = [0.0]
+
+        def progress(fraction: float, message: str = None):
+            # throttled: long jobs report often, the DB only sees a few writes per second
+            if time.monotonic() - last_write[0] < 0.5 and fraction < 1:
+                return
+            last_write[0] = time.monotonic()
+            self._update(run_id, progress=max(0.0, min(1.0, fraction)), message=message)
+
+        try:
+            params = dict(run.get("params") or {})
+            params.setdefault("user_id", run.get("requested_by"))
+            params.setdefault("role", run.get("role"))
+            with use_site(params.pop("site", None)):
+                result = TASKS[run["task"]](progress, **params)
+            self._update(run_id, status="succeeded", progress=1.0, message=None, result=json.dumps(result, default=str),
+                         finished_at=_now().isoformat(), lease_owner=None)
+        except Exception as e:
+            if run["attempts"] < run["max_attempts"]:
+                delay = RETRY_BACKOFF_SECONDS * 2 ** (run["attempts"] - 1)
+                self._update(run_id, status="retrying", message=f"attempt {run['attempts']} failed: {e}",
+                             run_after=(_now() + datetime.timedelta(seconds=delay)).isoformat(), lease_owner=None)
+            else:
+                self._update(run_id, status="failed", message=str(e), finished_at=_now().isoformat(), lease_owner=None)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self.wake()
+
+    def _update(self, run_id: int, **fields):
+        conn = _connect()
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        conn.execute(f"UPDATE job_runs SET {columns} WHERE run_id = ?", (*fields.values(), run_id))
+        conn.commit()
+        conn.close()
+
+
+_scheduler: Optional[JobScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(start: bool = True) -> JobScheduler:
+    """
+    Process-wide scheduler. Streamlit re-runs page scripts but keeps imported
+    modules, so this starts exactly one background thread per server process.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+        if start:
+            _scheduler.start()
+    return _scheduler
+
+
+if __name__ == "__main__":
+    # sidecar mode: set SCHEDULER_ENABLED=False for the Streamlit workers and run this instead
+    print(f"Job scheduler running (concurrency={Config.SCHEDULER_CONCURRENCY})")
+    get_scheduler()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        _scheduler.stop()
@@ -0,0 +1,29 @@
+"""
+The tests run against a throwaway database with one extra site shard. The
+environment is set before anything from src is imported, because the
+connection module and Config read it at import time.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+SRC = str(Path(__file__).resolve().parents[1] / "src")
+sys.path.insert(0, SRC)
+os.environ["HOSPITAL_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="hms-tests-"), "hospital.db")
+os.environ["HOSPITAL_SHARDS"] = "north=north.db"
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """A new, empty primary and north database for one test, as on a first start."""
+    from database import cache, connection, scheduling
+    monkeypatch.setattr(connection, "DB_PATH", tmp_path / "hospital.db")
+    # per-process state that belongs to the previous files
+    monkeypatch.setattr(cache, "_watchers", {})
+    monkeypatch.setattr(scheduling, "_indexes", {})
+    cache.clear_caches()
+    yield tmp_path
+    cache.clear_caches()
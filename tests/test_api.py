@@ -0,0 +1,57 @@
+"""Requests through ApiServer.dispatch, with routing, auth and error mapping, without a socket."""
+import asyncio
+import json
+
+import pytest
+
+from api.server import ApiServer
+
+
+def _request(server, method, path, body=None, token=None):
+    headers = {"authorization": f"Bearer {token}"} if token else {}
+    return asyncio.run(server.dispatch(method, path, headers, json.dumps(body).encode() if body is not None else b""))
+
+
+@pytest.fixture
+def api(fresh_db):
+    server = ApiServer(workers=2)
+    status, payload = _request(server, "POST", "/auth/token", {"username": "admin", "password": "admin123"})
+    assert status == 200
+    yield server, payload["token"]
+    server.executor.shutdown(wait=True)
+
+
+def test_provider_booking_on_a_fresh_database(api):
+    from database.connection import get_db_connection
+    server, token = api
+    status, patient = _request(server, "POST", "/patients", {"name": "Ann Lee", "contact": "0300-1", "diagnosis": "x"},
+                               token)
+    assert status == 201
+    # not through the cached helpers: the booking must be the first to need the cache
+    conn = get_db_connection()
+    provider_id = conn.execute("SELECT user_id FROM users WHERE role = 'doctor'").fetchone()[0]
+    conn.close()
+    booking = {"patient_id": patient["patient_id"], "provider_id": provider_id, "date": "2031-01-06", "time": "10:00"}
+    assert _request(server, "POST", "/appointments", booking, token)[0] == 201
+    assert _request(server, "POST", "/appointments", booking, token)[0] == 409
+
+
+@pytest.mark.parametrize("fields, message", [
+    ({"date": "tomorrow"}, "invalid date"),
+    ({"date": "garbage", "provider_id": None}, "invalid date"),
+    ({"time": "ten"}, "invalid time"),
+    ({"time": "xx", "provider_id": None}, "invalid time"),
+    ({"duration_minutes": -5}, "duration"),
+    ({"duration_minutes": 0, "provider_id": None}, "duration"),
+    ({"duration_minutes": "long"}, "must be integers"),
+])
+def test_malformed_appointments_are_rejected_with_400(api, fields, message):
+    from database.connection import add_patient, get_appointments
+    server, token = api
+    patient_id = add_patient("Ann Lee", "0300-1", "x")
+    body = dict({"patient_id": patient_id, "provider_id": 2, "date": "2031-01-06", "time": "10:00"}, **fields)
+    body = {k: v for k, v in body.items() if v is not None}
+    status, payload = _request(server, "POST", "/appointments", body, token)
+    assert status == 400
+    assert message in payload["error"]
+    assert get_appointments() == []
@@ -0,0 +1,64 @@
+"""
+The query caches stay correct across processes (database/cache.py): a writer
+process adds patients while a reader process keeps calling the cached helpers.
+Processes are spawned, like independent Streamlit or API workers.
+"""
+import multiprocessing
+import time
+
+from database.connection import add_patient
+
+WRITES = 8
+
+
+def _reader(committed, stop, results):
+    from database.cache import cache_stats
+    from database.connection import get_patients, get_staff
+    stale = reads = 0
+    while not stop.is_set():
+        newest = committed.value
+        patients = get_patients(columns=("patient_id",))
+        get_staff()
+        reads += 1
+        if newest and newest not in {p["patient_id"] for p in patients}:
+            stale += 1
+    stats = cache_stats()
+    results.put({"reads": reads, "stale": stale, "get_patients": stats["database.connection.get_patients"],
+                 "get_staff": stats["database.connection.get_staff"]})
+
+
+def _writer(committed, results):
+    from database.connection import add_patient
+    written = []
+    for i in range(WRITES):
+        # published only after the commit: a read starting later must see the patient
+        committed.value = add_patient(f"Walk In {i}", f"0311-{i:07d}", "triage")
+        written.append(committed.value)
+        time.sleep(0.1)
+    results.put({"written": written})
+
+
+def test_writes_in_one_process_invalidate_only_dependent_entries_in_another():
+    add_patient("Before Readers", "0311-9999999", "seed")
+    ctx = multiprocessing.get_context("spawn")
+    committed, stop, results = ctx.Value("q", 0), ctx.Event(), ctx.Queue()
+    reader = ctx.Process(target=_reader, args=(committed, stop, results))
+    writer = ctx.Process(target=_writer, args=(committed, results))
+    reader.start()
+    writer.start()
+    writer.join(60)
+    stop.set()
+    out = [results.get(timeout=60), results.get(timeout=60)]
+    reader.join(60)
+    read = next(r for r in out if "reads" in r)
+    written = next(r for r in out if "written" in r)["written"]
+
+    assert len(written) == WRITES
+    assert read["reads"] > WRITES
+    assert read["stale"] == 0
+    # patient writes drop the cached patient lists, served from the cache in between
+    assert read["get_patients"]["invalidated"] > 0
+    assert read["get_patients"]["hits"] > 0
+    # but never the staff list, which only depends on users
+    assert read["get_staff"]["invalidated"] == 0
+    assert read["get_staff"]["misses"] == 1
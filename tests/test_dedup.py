@@ -0,0 +1,39 @@
+import sqlite3
+
+from database import connection, dedup
+from database.connection import add_patient
+
+
+def test_cluster_scan_does_not_hold_the_write_lock(fresh_db, monkeypatch):
+    for name, contact in [("Ayesha Khan", "0300-1111111"), ("Ayesha Khan", "0300-1111111"),
+                          ("Bilal Ahmed", "0300-2222222"), ("Bilal Ahmed", "0300-2222222")]:
+        add_patient(name, contact, "seed")
+    # add_patient flagged the pairs already; let the scan store its own
+    conn = connection.get_db_connection()
+    conn.execute("DELETE FROM duplicate_flags")
+    conn.commit()
+    conn.close()
+
+    blocked = []
+    score = dedup._combined_score
+
+    def writing_score(*args, **kwargs):
+        # another writer, as add_patient or the API would be, while the scan compares
+        other = sqlite3.connect(connection.DB_PATH, timeout=0.1)
+        try:
+            other.execute("BEGIN IMMEDIATE")
+            other.rollback()
+        except sqlite3.OperationalError:
+            blocked.append(args)
+        finally:
+            other.close()
+        return score(*args, **kwargs)
+
+    monkeypatch.setattr(dedup, "_combined_score", writing_score)
+    clusters = dedup.find_duplicate_clusters()
+
+    assert blocked == []
+    assert len(clusters) == 2
+    conn = connection.get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM duplicate_flags WHERE source = 'scan'").fetchone()[0] == 2
+    conn.close()
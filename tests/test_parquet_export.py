@@ -0,0 +1,47 @@
+import pyarrow.parquet as pq
+import pytest
+
+from database import parquet_export
+from database.connection import get_db_connection
+
+
+def _add_logs(first, count):
+    conn = get_db_connection()
+    conn.executemany(
+        "INSERT INTO logs (user_id, role, action, timestamp, details) VALUES (?,?,?,?,?)",
+        # two days per chunk of four, so a chunk is written as two files
+        [(1, "admin", "seed", f"2024-05-{1 + (i // 2) % 28:02d}T10:00:00", f"entry {i}") for i in range(first, first + count)]
+    )
+    conn.commit()
+    conn.close()
+
+def _exported_log_ids(out_dir):
+    return sorted(i for path in (out_dir / "logs").glob("*/part-*.parquet")
+                  for i in pq.read_table(path).column("log_id").to_pylist())
+
+def _all_log_ids():
+    conn = get_db_connection()
+    ids = [r[0] for r in conn.execute("SELECT log_id FROM logs ORDER BY log_id")]
+    conn.close()
+    return ids
+
+
+def test_export_stopped_before_saving_the_mark_is_not_repeated(fresh_db, monkeypatch):
+    out_dir = fresh_db / "exports"
+    _add_logs(0, 8)
+    parquet_export.export_logs(out_dir, chunk_rows=4)
+    _add_logs(8, 8)
+
+    def crash(*args):
+        raise KeyboardInterrupt
+    with monkeypatch.context() as m, pytest.raises(KeyboardInterrupt):
+        m.setattr(parquet_export, "_save_state", crash)
+        parquet_export.export_logs(out_dir, chunk_rows=4)
+    # and one stopped half-way through its last chunk
+    last_chunk = sorted((out_dir / "logs").glob("*/part-*.parquet"), key=lambda p: p.stem)[-1]
+    last_chunk.unlink()
+
+    _add_logs(16, 5)
+    stats = parquet_export.export_logs(out_dir, chunk_rows=3)
+    assert _exported_log_ids(out_dir) == _all_log_ids()
+    assert stats["rows"] == 9
@@ -0,0 +1,64 @@
+"""
+Every registered statement keeps its expected index (database/query_plans.py).
+The 100k-row timing budgets stay in benchmarks/query_plans.py; plans do not
+depend on the row count, so a small seeded database is enough here.
+"""
+import datetime
+import random
+
+import pytest
+
+from database import dedup, query_plans
+from database.connection import get_db_connection, import_patients
+from database.shards import use_site
+
+ROWS = 2000
+
+
+def _seed(rows, seed_value=7):
+    rng = random.Random(seed_value)
+    start = datetime.datetime(2015, 1, 1)
+    stamp = lambda i: (start + datetime.timedelta(minutes=i * 50)).isoformat()
+    import_patients([{"name": f"Patient {i}", "contact": f"0300-{rng.randrange(10 ** 7):07d}", "diagnosis": "seed",
+                      "date_added": stamp(i)} for i in range(rows)])
+    conn = get_db_connection()
+    patient_ids = [r[0] for r in conn.execute("SELECT patient_id FROM patients")]
+    conn.executemany(
+        "INSERT INTO logs (user_id, role, action, timestamp, details) VALUES (?,?,?,?,?)",
+        [(rng.randrange(1, 51), "doctor", "view_patient", stamp(i), f"seed entry {i}") for i in range(rows)]
+    )
+    conn.executemany(
+        "INSERT INTO appointments (patient_id, patient_name, provider_id, date, time, status, duration_minutes) "
+        "VALUES (?,?,?,?,?,?,30)",
+        [(rng.choice(patient_ids), "seed", rng.randrange(1, 26), f"2031-{rng.randrange(1, 13):02d}-10", "10:00:00",
+          "Scheduled") for _ in range(rows)]
+    )
+    conn.commit()
+    conn.close()
+    conn = dedup._connect()
+    conn.executemany(
+        "INSERT OR IGNORE INTO duplicate_flags (patient_id, candidate_id, score, source, status, flagged_at) "
+        "VALUES (?,?,?,?,?,?)",
+        [(rng.choice(patient_ids), rng.choice(patient_ids), rng.random(), "seed", "open", stamp(i))
+         for i in range(rows // 20)]
+    )
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("site", ["main", "north"])
+def test_registered_statements_use_their_index(site):
+    with use_site(site):
+        _seed(ROWS)
+    results = query_plans.check_plans(site)
+    assert len(results) == len(query_plans.statements(site))
+    assert [r for r in results if r["problem"]] == []
+
+
+def test_a_scan_is_reported():
+    statement = query_plans.Statement("patients.by_diagnosis", "SELECT * FROM patients WHERE diagnosis = ?",
+                                      ("seed",), "idx_patients_diagnosis")
+    conn = get_db_connection()
+    plan = query_plans.explain(conn, statement.sql, statement.params)
+    conn.close()
+    assert query_plans.plan_problem(statement, plan)
@@ -0,0 +1,42 @@
+from database import notes
+from database.connection import add_appointment, add_patient, get_db_connection
+from database.erasure import erase_patients_everywhere
+from database.rebalance import move_patients
+from database.shards import SHARD_ID_SPAN, id_base, use_site
+
+
+def _ids(site, table, key):
+    conn = get_db_connection(site)
+    ids = {r[0] for r in conn.execute(f"SELECT {key} FROM {table}")}
+    conn.close()
+    return ids
+
+
+def test_moved_in_ids_do_not_take_over_the_targets_sequence():
+    with use_site("north"):
+        moved = add_patient("Moved Away", "0300-1000001", "seed")
+        stays = add_patient("Stays North", "0300-1000002", "seed")
+        add_appointment("Moved Away", "2031-01-06", "10:00:00", "Scheduled", patient_id=moved)
+        notes.add_note(moved, "History of hypertension.", "Intake")
+    assert id_base("north") < moved < stays
+
+    move_patients([moved], "north", "main")
+    assert moved in _ids("main", "patients", "patient_id")
+
+    # new rows on main come from main's range, not after the moved-in ids
+    new_patient = add_patient("New Main", "0300-1000003", "seed")
+    appointment = add_appointment("New Main", "2031-01-07", "10:00:00", "Scheduled", patient_id=new_patient)
+    note = notes.add_note(new_patient, "Follow-up in two weeks.", "Progress note")
+    for row_id in (new_patient, appointment, note):
+        assert 0 < row_id < SHARD_ID_SPAN
+    with use_site("north"):
+        north_patient = add_patient("New North", "0300-1000004", "seed")
+    assert id_base("north") < north_patient < id_base("north") + SHARD_ID_SPAN
+    assert not _ids("main", "patients", "patient_id") & _ids("north", "patients", "patient_id")
+    assert not _ids("main", "appointments", "appointment_id") & _ids("north", "appointments", "appointment_id")
+    assert not _ids("main", "clinical_notes", "note_id") & _ids("north", "clinical_notes", "note_id")
+
+    # erasing the new main patient everywhere leaves the other shard's patients alone
+    erase_patients_everywhere([new_patient])
+    assert {stays, north_patient} <= _ids("north", "patients", "patient_id")
+    assert moved in _ids("main", "patients", "patient_id")
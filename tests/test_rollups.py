@@ -0,0 +1,39 @@
+from database.connection import add_patient, get_db_connection
+from database.rebalance import move_patients
+from database.rollups import refresh_rollups
+from database.shards import use_site
+
+
+def _counted_and_present(site):
+    with use_site(site):
+        refresh_rollups()
+    conn = get_db_connection(site)
+    counted = conn.execute("SELECT COALESCE(SUM(added), 0) FROM rollup_patients_daily").fetchone()[0]
+    present = conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+    conn.close()
+    return counted, present
+
+
+def test_patient_rollup_follows_rebalanced_patients(fresh_db):
+    with use_site("north"):
+        counted_before = add_patient("North One", "0300-2000001", "seed")
+        refresh_rollups()
+        not_yet_counted = add_patient("North Two", "0300-2000002", "seed")
+        add_patient("North Three", "0300-2000003", "seed")
+    add_patient("Main One", "0300-2000004", "seed")
+    refresh_rollups()
+
+    move_patients([counted_before, not_yet_counted], "north", "main")
+    # main keeps allocating low ids, below the moved-in ones
+    add_patient("Main Two", "0300-2000005", "seed")
+
+    assert _counted_and_present("main") == (4, 4)
+    assert _counted_and_present("north") == (1, 1)
+    # an id below the moved-in ones, after a refresh has passed them
+    add_patient("Main Three", "0300-2000006", "seed")
+    assert _counted_and_present("main") == (5, 5)
+
+    # and back: counted once on each side again
+    move_patients([counted_before], "main", "north")
+    assert _counted_and_present("main") == (4, 4)
+    assert _counted_and_present("north") == (2, 2)
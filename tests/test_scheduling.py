@@ -0,0 +1,26 @@
+import time
+
+import pytest
+
+from database.connection import get_db_connection
+from database.scheduling import InvalidSlot, book_appointment
+
+
+@pytest.mark.parametrize("date, time_, duration", [
+    ("tomorrow", "10:00", 30),
+    ("2031-02-30", "10:00", 30),
+    ("2031-01-06", "ten", 30),
+    ("2031-01-06", "25:00", 30),
+    ("2031-01-06", "10:00", -5),
+])
+def test_malformed_slots_are_rejected_before_taking_the_write_lock(date, time_, duration):
+    blocker = get_db_connection()
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.monotonic()
+        with pytest.raises(InvalidSlot):
+            book_appointment(None, "Nobody", 2, date, time_, duration_minutes=duration)
+        assert time.monotonic() - started < 1
+    finally:
+        blocker.rollback()
+        blocker.close()
@@ -0,0 +1,38 @@
+"""
+Cold-start budgets from benchmarks/startup.py for the entry points that import
+without Streamlit: the API server, the scheduler and the database package.
+Each module is imported in a fresh interpreter by the benchmark's probe.
+"""
+import importlib.util
+import os
+import statistics
+from pathlib import Path
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "startup_benchmark", Path(__file__).resolve().parents[1] / "benchmarks" / "startup.py")
+startup = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(startup)
+
+# database modules are loaded by the API server and the scheduler, so they get
+# the smaller of the two budgets; models is the SQLAlchemy mapping itself
+DATABASE_BUDGET = startup.ENTRY_POINTS["utils.scheduler"]
+DATABASE_MODULES = sorted(
+    "database" if p.stem == "__init__" else f"database.{p.stem}"
+    for p in (startup.SRC_DIR / "database").glob("*.py") if p.stem != "models"
+)
+ENTRY_POINTS = {**{m: startup.ENTRY_POINTS[m] for m in ("api.server", "utils.scheduler")},
+                **{m: DATABASE_BUDGET for m in DATABASE_MODULES}}
+
+
+@pytest.mark.parametrize("module", list(ENTRY_POINTS))
+def test_entry_point_starts_within_budget(module, tmp_path):
+    max_ms, max_mb = ENTRY_POINTS[module]
+    env = dict(os.environ, PYTHONPATH=str(startup.SRC_DIR), HOSPITAL_DB_PATH=str(tmp_path / "startup.db"))
+    runs = [startup.measure(module, env) for _ in range(3)]
+    assert [r["error"] for r in runs if "error" in r] == []
+
+    assert statistics.median(r["import_ms"] for r in runs) <= max_ms
+    assert statistics.median(r["rss_mb"] for r in runs) <= max_mb
+    assert not set(startup.LAZY_MODULES) & {m for r in runs for m in r["eager_heavy_imports"]}